@@ -30,6 +30,11 @@ nChanged = 0
 sourceDir = ""
 current_file = ""
 issuesFile = None
+use_cache = True    # Replay issues of files that have not changed since the last run, from verify-cache.json
+cache = None
+workers = 0    # Processes checking files at the same time. 0 for one per CPU, 1 to check them all in this process.
+filesPerTask = 50    # Most files a worker process checks per task
+deferOutput = False    # True in worker processes, which return their issues to be written in file order
 
 suppress1 = False    # Suppress warnings about text before first heading
 suppress2 = False    # Suppress warnings about blank headings
@@ -56,6 +61,8 @@ BLANKLINE = 2
 TEXT = 3
 LIST_ITEM = 4
 ORDEREDLIST_ITEM = 5
+linetypes = {'blank': BLANKLINE, 'heading': HEADING, 'badheading': HEADING, 'listitem': LIST_ITEM,
+             'olistitem': ORDEREDLIST_ITEM, 'badolistitem': ORDEREDLIST_ITEM, 'text': TEXT}
 
 import sys
 import os
@@ -67,11 +74,22 @@ import os
 import io
 import codecs
 import re
-
-listitem_re = re.compile(r'[ \t]*[\*\-][ \t]')
-olistitem_re = re.compile(r'[ \t]*[0-9]+\. ')
-badolistitem_re = re.compile(r'[ \t]*[0-9]+[\)]')
-badheading_re = re.compile(r' +#')
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+# Classifies a line with one match. The outer group that matches is the kind of line, the inner groups its defects:
+#   blank, heading (#... with blankheading for #+$, space for #+[ \t]+ and bold for #+[ \t]+[*_]), badheading ( +#),
+#   listitem, olistitem, badolistitem (number followed by a paren), or text.
+# The match of a heading ends after its space, so take() looks for a closing hash run in the rest of the line.
+line_re = re.compile(r'''(?P<blank>\s*\Z)
+    |(?P<heading>\#+(?:(?P<blankheading>$)|(?P<space>[ \t]+)(?P<bold>(?=[\*_]))?)?)
+    |(?P<badheading>\ +\#)
+    |(?P<listitem>[ \t]*[\*\-][ \t])
+    |(?P<olistitem>[ \t]*[0-9]+\.\ )
+    |(?P<badolistitem>[ \t]*[0-9]+\))
+    |(?P<text>)''', re.VERBOSE)
+digitparen_re = re.compile(r'[0-9]\)')
 
 class State:
     def setPath(self, path):
@@ -95,29 +113,24 @@ class State:
         State.underscores = 0
         State.ascii = True
         State.nerrors = 0
+        State.issues = []
+        State.checkedPaths = {}
 
-    def addLine(self, line):
+    # kind is the name of the outer group of line_re that matched the line.
+    def addLine(self, line, kind):
         State.prevlinetype = State.currlinetype
         State.linecount += 1
         State.italicized = False
-        if line and (line[0] == '#' or badheading_re.match(line)):
-            State.currlinetype = HEADING
+        State.currlinetype = linetypes[kind]
+        if State.currlinetype == HEADING:
             State.headingcount += 1
             State.prevheadinglevel = State.currheadinglevel
             State.currheadinglevel = line.count('#', 0, 5)
             State.reported2 = False
-        elif not line or len(line.strip()) == 0:
-            State.currlinetype = BLANKLINE
-        elif listitem_re.match(line):
-            State.currlinetype = LIST_ITEM
-            if State.prevlinetype in {HEADING,BLANKLINE}:
-                State.textcount += 1
-        elif olistitem_re.match(line) or badolistitem_re.match(line):
-            State.currlinetype = ORDEREDLIST_ITEM
+        elif State.currlinetype in {LIST_ITEM, ORDEREDLIST_ITEM}:
             if State.prevlinetype in {HEADING,BLANKLINE}:
                 State.textcount += 1
-        else:
-            State.currlinetype = TEXT
+        elif State.currlinetype == TEXT:
             State.textcount += 1
             State.italicized = (line[0] == '_' and line[-1] == '_')
         State.linetype.append(State.currlinetype)
@@ -126,7 +139,7 @@ class State:
         # sys.stdout.write(str(State.linecount) + ": line length: " + str(len(line)) + ". headingcount is " + str(State.headingcount) + "\n")
     
     def countParens(self, line):
-        if not re.search(r'[0-9]\)', line):   # right parens used in list items voids the paren matching logic for that line
+        if not digitparen_re.search(line):   # right parens used in list items voids the paren matching logic for that line
             State.leftparens += line.count("(")
             State.rightparens += line.count(")")
         State.leftbrackets += line.count("[")
@@ -177,41 +190,41 @@ def openIssuesFile():
 # Writes error message to stderr and to issues.txt.
 def reportError(msg, report_lineno=True):
     state = State()
-    issues = openIssuesFile()       
-
     if report_lineno:
-        try:
-            sys.stderr.write(shortname(state.path) + " line " + str(state.linecount) + ": " + msg + ".\n")
-        except UnicodeEncodeError as e:
-            sys.stderr.write(shortname(state.path) + " line " + str(state.linecount) + ": (Unicode...)\n")
-        issues.write(shortname(state.path) + " line " + str(state.linecount) + ": " + msg + ".\n")
+        issue = shortname(state.path) + " line " + str(state.linecount) + ": " + msg + ".\n"
     else:
-        sys.stderr.write(shortname(state.path) +  ": " + msg + ".\n")
-        issues.write(shortname(state.path) + ": " + msg + ".\n")
+        issue = shortname(state.path) +  ": " + msg + ".\n"
+    if not deferOutput:
+        issues = openIssuesFile()
+        if report_lineno:
+            try:
+                sys.stderr.write(issue)
+            except UnicodeEncodeError:
+                sys.stderr.write(shortname(state.path) + " line " + str(state.linecount) + ": (Unicode...)\n")
+        else:
+            sys.stderr.write(issue)
+        issues.write(issue)
+    state.issues.append(issue)
     state.reportedError()
 
  
 # Reports empty file and returns True if file is empty.
 def verifyNotEmpty(mdPath):
     empty = False
-    if os.path.isfile(mdPath):
+    if pathExists(mdPath):
        statinfo = os.stat(mdPath)
        if statinfo.st_size == 0:
            empty = True 
            reportError("Empty file", False)
     return empty
 
-blankheading_re = re.compile(r'#+$')
-heading_re = re.compile(r'#+[ \t]')
-closedHeading_re = re.compile(r'#+[ \t].*#+[ \t]*$', re.UNICODE)
-badclosedHeading_re = re.compile(r'#+[ \t].*[^# \t]#+[ \t]*$', re.UNICODE)  # closing hash without preceding space
-toobold_re = re.compile(r'#+[ \t]+[\*_]', re.UNICODE)        # unwanted formatting in headings
-
 def take(line):
     global current_file
     state = State()
     state.countParens(line)
-    state.addLine(line)
+    match = line_re.match(line)
+    kind = match.lastgroup
+    state.addLine(line, kind)
     if not line:
         if state.linecount == 1 and not suppress7:
             reportError("starts with blank line")
@@ -231,16 +244,18 @@ def take(line):
     if state.currlinetype == HEADING:
         if state.linecount > 1 and state.prevlinetype != BLANKLINE:
             reportError("missing blank line before heading")
-        if badheading_re.match(line):
+        heading = line[match.end():].rstrip(" \t") if match.group('space') is not None else ""
+        if kind == 'badheading':
             reportError("space(s) before heading")
-        elif closedHeading_re.match(line):
+        elif heading.endswith("#"):
             if not suppress4:
                 reportError("closed heading")
-            if badclosedHeading_re.match(line):
+            heading = heading.rstrip("#")
+            if heading and heading[-1] not in " \t":
                 reportError("no space before closing hash mark")
-        elif not suppress2 and blankheading_re.match(line):
+        elif not suppress2 and match.group('blankheading') is not None:
             reportError("blank heading")
-        elif len(line) > 1 and not heading_re.match(line):
+        elif len(line) > 1 and match.group('space') is None:
             reportError("missing space after hash symbol(s)")
         if not suppress10:
             if resource_type in {"tn", "tq"} and state.currheadinglevel > 1:
@@ -258,9 +273,9 @@ def take(line):
         if i > 1 and state.linetype[i-1] == BLANKLINE and state.linetype[i-2] == LIST_ITEM and not suppress8:
             reportError("invalid list style")
     if state.currlinetype == ORDEREDLIST_ITEM:
-        if badolistitem_re.match(line) and not suppress3:
+        if kind == 'badolistitem' and not suppress3:
             reportError("item number not followed by period")
-        if olistitem_re.match(line):
+        if kind == 'olistitem':
             if state.prevlinetype in { TEXT, HEADING }:
                 reportError("missing blank line before ordered list")
             i = state.linecount - 1
@@ -274,7 +289,7 @@ def take(line):
         reportError("% used to mark a heading")
     if line.find("<!--") != -1 or line.find("&nbsp;") != -1 or line.find("o:p") != -1:
         reportError("html code")
-    if toobold_re.match(line):
+    if kind == 'heading' and match.group('bold') is not None:
         if resource_type != "tn" or current_file != "intro.md":
             reportError("Extra formatting in heading")
     
@@ -307,7 +322,7 @@ def checkTALinks(line):
             reportError("tA page reference in heading")
         manpage = page.group(1)
         path = os.path.join(ta_dir, manpage)
-        if not os.path.isdir(path):
+        if not pathExists(path, True):
             reportError("invalid tA page reference")
         page = tapage_re.search(page.group(2))
 
@@ -322,7 +337,7 @@ def checkTALinks(line):
             path = os.path.join(ta_dir, manpage)
             if path[-3:].lower() == '.md':
                 path = path[:-3]
-            if not os.path.isdir(path):
+            if not pathExists(path, True):
                 reportError("invalid tA link: " + manpage)
             link = talink_re.search(link.group(3))
     return found          
@@ -350,7 +365,7 @@ def checkOBSLinks(line):
             reportError("invalid language code in OBS link")
         elif not suppress6:
             obsPath = os.path.join(obs_dir, link.group(4)) + ".md"
-            if not os.path.isfile(obsPath):
+            if not pathExists(obsPath):
                 reportError("invalid OBS link: " + link.group(1) + link.group(2) + link.group(3) + link.group(4) + link.group(5))
         link = obslink_re.search(link.group(6))
     return found
@@ -367,7 +382,7 @@ def checkNoteLinks(line):
         else:
             notePath = os.path.join(tn_dir, notelink.group(4)) + ".md"
             notePath = os.path.normcase(notePath)
-            if not os.path.isfile(notePath):
+            if not pathExists(notePath):
                 reportError("invalid note link: " + notelink.group(1) + notelink.group(2) + notelink.group(3) + notelink.group(4))
         notelink = notelink_re.search(notelink.group(5))
 
@@ -389,12 +404,12 @@ def checkPassageLinks(line, fullpath):
             paragraph = referent[referent.find("/")+1:]
             if story.isdigit() and paragraph.isdigit():     # otherwise it's not a story link
                 referencedPath = os.path.join( os.path.join(contentDir, story), paragraph + ".md")
-                if not os.path.isfile(referencedPath):
+                if not pathExists(referencedPath):
                     reportError("invalid OBS story link: " + referent)
 #                    reported = True
         elif not (resource_type == 'obs' and obsJpg_re.match(referent)):
             referencedPath = os.path.join( os.path.dirname(fullpath), referent )
-            if not suppress5 and not os.path.isfile(referencedPath):
+            if not suppress5 and not pathExists(referencedPath):
                 reportError("invalid passage link: " + referent)
 #                reported = True
         passage = passagelink_re.search(passage.group(2))
@@ -415,8 +430,154 @@ def shortname(longpath):
 
 storyfile_re = re.compile(r'[0-9][0-9]\.md$')
 
+linkRootList = None
+pathIndexes = {}    # (foldcase, dirs, files) of each link root, each built once per run by walking the root
+
+# The folders that links point into, normalized. Folders that don't exist are left out.
+def linkRoots():
+    global linkRootList
+    if linkRootList is None:
+        linkRootList = [os.path.normcase(os.path.abspath(root)) for root in [ta_dir, obs_dir, tn_dir, sourceDir] if root and os.path.isdir(root)]
+    return linkRootList
+
+# Lists every folder and file under root once, so that links into it are checked without a stat() per link.
+# Paths are normcased, and lowercased as well if the file system of root ignores case.
+def indexRoot(root):
+    swapped = root.swapcase()
+    foldcase = swapped != root and os.path.exists(swapped) and os.path.samefile(root, swapped)
+    dirs = {root}
+    files = set()
+    for dirpath, dirnames, filenames in os.walk(root, followlinks=True):
+        dirnames[:] = [name for name in dirnames if name != ".git"]
+        dirs.update(os.path.join(dirpath, name) for name in dirnames)
+        files.update(os.path.join(dirpath, name) for name in filenames)
+    if foldcase:
+        dirs = set(path.lower() for path in dirs)
+        files = set(path.lower() for path in files)
+    return (foldcase, dirs, files)
+
+# Indexes each link root that is not inside another one, so that worker processes can be given the indexes
+# instead of each walking the roots again.
+def indexLinkRoots():
+    roots = linkRoots()
+    for root in roots:
+        if root not in pathIndexes and not any(root.startswith(other + os.sep) for other in roots):
+            pathIndexes[root] = indexRoot(root)
+    return pathIndexes
+
+# Returns True if the file or folder exists, from the index of the link root it is under.
+# Paths outside all link roots are checked on disk.
+def lookupPath(path, isdir=False):
+    key = os.path.normcase(os.path.normpath(path) if os.path.isabs(path) else os.path.abspath(path))
+    roots = [root for root in linkRoots() if key == root or key.startswith(root + os.sep)]
+    if not roots:
+        return os.path.isdir(path) if isdir else os.path.isfile(path)
+    indexed = [root for root in roots if root in pathIndexes]
+    root = indexed[0] if indexed else min(roots, key=len)
+    if root not in pathIndexes:
+        pathIndexes[root] = indexRoot(root)
+    foldcase, dirs, files = pathIndexes[root]
+    if foldcase:
+        key = key.lower()
+    return key in (dirs if isdir else files)
+
+# Returns True if the file or folder exists, remembering the answer for the cache.
+# A cached result is only replayed if all the paths it depended on still give the same answer.
+def pathExists(path, isdir=False):
+    state = State()
+    exists = lookupPath(path, isdir)
+    state.checkedPaths[path] = [isdir, exists]
+    return exists
+
+# Everything besides a file's contents that can change the issues found in it.
+def cacheSignature():
+    with io.open(__file__, "rb") as input:
+        version = hashlib.sha1(input.read()).hexdigest()
+    options = [language_code, resource_type, ta_dir, obs_dir, tn_dir,
+               suppress1, suppress2, suppress3, suppress4, suppress5, suppress6,
+               suppress7, suppress8, suppress9, suppress10, suppress11, suppress12]
+    return version + " " + json.dumps(options)
+
+def loadCache():
+    global cache
+    signature = cacheSignature()
+    cache = {"signature": signature, "files": {}}
+    path = os.path.join(sourceDir, "verify-cache.json")
+    if os.path.isfile(path):
+        try:
+            with io.open(path, "tr", encoding="utf-8") as input:
+                saved = json.load(input)
+            if saved.get("signature") == signature:
+                cache = saved
+        except ValueError:
+            sys.stderr.write("Ignoring unreadable cache: " + path + "\n")
+
+def saveCache():
+    path = os.path.join(sourceDir, "verify-cache.json")
+    with io.open(path, "tw", encoding="utf-8", newline='\n') as output:
+        json.dump(cache, output, ensure_ascii=False)
+
+# Returns the issues found the last time this file was verified, or None if it must be verified again.
+def cachedIssues(path, digest):
+    entry = cache["files"].get(shortname(path))
+    if not entry or entry["digest"] != digest or entry["current_file"] != current_file:
+        return None
+    for checkedPath, (isdir, exists) in entry["paths"].items():
+        if lookupPath(checkedPath, isdir) != exists:
+            return None
+    return entry["issues"]
+
+def replayIssues(issues):
+    state = State()
+    output = openIssuesFile()
+    for issue in issues:
+        try:
+            sys.stderr.write(issue)
+        except UnicodeEncodeError:
+            sys.stderr.write(issue[0:issue.find(": ")] + ": (Unicode...)\n")
+        output.write(issue)
+        state.issues.append(issue)
+        state.reportedError()
+
+def fileDigest(path):
+    with io.open(path, "rb") as input:
+        return hashlib.sha1(input.read()).hexdigest()
+
+# Returns the digest of the file and its cached issues, which are None if it must be verified again.
+def lookUpFile(path):
+    digest = fileDigest(path)
+    return digest, cachedIssues(path, digest)
+
 # Markdown file verification
-def verifyFile(path):
+# lookedUp is what lookUpFile() returned for the file, if the caller already looked it up.
+# checked is what a worker process found in the file, if it was checked in one.
+def verifyFile(path, lookedUp=None, checked=None):
+    state = State()
+    state.setPath(path)
+    issues = None
+    if cache is not None and not checked:
+        digest, issues = lookedUp or lookUpFile(path)
+    if issues is not None:
+        replayIssues(issues)
+    else:
+        if checked:
+            digest, issues, State.checkedPaths = checked
+            replayIssues(issues)
+        else:
+            checkFile(path)
+        if cache is not None:
+            cache["files"][shortname(path)] = {"digest": digest, "current_file": current_file,
+                                               "paths": state.checkedPaths, "issues": state.issues}
+    sys.stderr.flush()
+
+    global nChecked
+    nChecked += 1
+    global nChanged
+    if state.nerrors > 0:
+#        sys.stdout.write(shortname(path) + u'\n')
+        nChanged += 1
+
+def checkFile(path):
     input = io.open(path, "tr", 1, encoding="utf-8-sig")
     lines = input.readlines(-1)
     if not suppress12:          # newlines at end of file
@@ -425,7 +586,6 @@ def verifyFile(path):
     input.close()
 
     state = State()
-    state.setPath(path)
     empty = verifyNotEmpty(path)
     if not empty:
         for line in lines:
@@ -447,19 +607,11 @@ def verifyFile(path):
                 reportError("Multiple newlines at end of file", False)
             if gulp[-1] != '\n':
                 reportError("No ending newline", False)
-    sys.stderr.flush()
-
-    global nChecked
-    nChecked += 1
-    global nChanged
-    if state.nerrors > 0:
-#        sys.stdout.write(shortname(path) + u'\n')
-        nChanged += 1
 
 # Returns True if the specified file should be verified as a markdown document.
 def verifiable(path, fname):
     v = False
-    if os.path.isfile(path) and fname[-3:].lower() == '.md':
+    if fname[-3:].lower() == '.md':
         if resource_type == "ta":
             v = (fname == "01.md")
         elif resource_type == "obs":
@@ -470,17 +622,75 @@ def verifiable(path, fname):
         v = False
     return v
     
+# Returns the paths of the files to verify in the folder and its subfolders.
+def listFiles(dirpath):
+    paths = []
+    with os.scandir(dirpath) as entries:
+        for entry in entries:
+            if entry.is_dir() and entry.path[-4:] != ".git":
+                paths += listFiles(entry.path)
+            elif entry.is_file() and verifiable(entry.path, entry.name):
+                paths.append(entry.path)
+    return paths
+
+# Sets up a worker process to check files without writing any output.
+# indexes are the link root indexes built by the main process.
+def initWorker(source, indexes):
+    global sourceDir, deferOutput
+    sourceDir = source
+    deferOutput = True
+    pathIndexes.update(indexes)
+
+# Checks a run of files in a worker process.
+# files is a list of the path and digest of each file, as looked up by the main process (None if there is no cache).
+# Returns the digest, the issues and the paths its links depend on, of each file.
+def checkFilesInWorker(files):
+    global current_file
+    results = []
+    for path, digest in files:
+        current_file = os.path.basename(path)
+        state = State()
+        state.setPath(path)
+        checkFile(path)
+        results.append((digest, state.issues, state.checkedPaths))
+    return results
+
+# Verifies the files in sorted path order, so the issues are always written in the same order.
+# Each file is looked up in the cache once. Runs of files with no cached issues are checked by worker processes
+# while the issues of the files before them are written.
 def verifyDir(dirpath):
     global current_file
     sys.stdout.flush()
-    for f in os.listdir(dirpath):
-        path = os.path.join(dirpath, f)
-        if os.path.isdir(path) and path[-4:] != ".git":
-            # It's a directory, recurse into it
-            verifyDir(path)
-        elif verifiable(path, f):
-            current_file = f
-            verifyFile(path)
+    paths = sorted(listFiles(dirpath))
+    lookedUp = {}
+    unchecked = []
+    for path in paths:
+        current_file = os.path.basename(path)
+        if cache is not None:
+            lookedUp[path] = lookUpFile(path)
+        if cache is None or lookedUp[path][1] is None:
+            unchecked.append(path)
+    nworkers = min(workers or os.cpu_count() or 1, len(unchecked))
+    runs = {}    # path => the future of the run of files it is checked in, and its place in the run
+    executor = None
+    if nworkers > 1:
+        executor = ProcessPoolExecutor(max_workers=nworkers, initializer=initWorker,
+                                       initargs=(sourceDir, indexLinkRoots()))
+        runLength = max(1, min(filesPerTask, len(unchecked) // (nworkers * 4)))
+        for start in range(0, len(unchecked), runLength):
+            run = unchecked[start:start + runLength]
+            future = executor.submit(checkFilesInWorker, [(path, lookedUp.get(path, (None, None))[0]) for path in run])
+            for i, path in enumerate(run):
+                runs[path] = (future, i)
+    for path in paths:
+        current_file = os.path.basename(path)
+        checked = None
+        if path in runs:
+            future, i = runs[path]
+            checked = future.result()[i]
+        verifyFile(path, lookedUp.get(path), checked)
+    if executor:
+        executor.shutdown()
 
 if __name__ == "__main__":
     if len(sys.argv) < 2 or sys.argv[1] == 'hard-coded-path':
@@ -494,13 +704,19 @@ if __name__ == "__main__":
 
     if os.path.isdir(source):
         sourceDir = source
+        if use_cache:
+            loadCache()
         verifyDir(sourceDir)
     elif os.path.isfile(source):
         sourceDir = os.path.dirname(source)
+        if use_cache:
+            loadCache()
         verifyFile(source)
     else:
         sys.stderr.write("File not found: " + source + '\n') 
 
     if issuesFile:
         issuesFile.close()
+    if cache is not None:
+        saveCache()
     print("Done. Checked " + str(nChecked) + " files. " + str(nChanged) + " failed.\n")
\ No newline at end of file
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+#
+#  Copyright (c) 2020 unfoldingWord
+#  http://creativecommons.org/licenses/MIT/
+#  See LICENSE file for details.
+#
+#  Contributors:
+#  Richard Mahn <rich.mahn@unfoldingword.org>
+
+"""
+Class for downloading images at the same time into a dir that is kept as a cache between runs
+"""
+
+import os
+import logging
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from ..general_tools.file_utils import load_json_object, write_file
+
+MAX_IMAGE_WORKERS = 8  # Number of images to download at the same time
+IMAGE_TIMEOUT = (10, 60)  # Seconds to connect and to wait between bytes of an image
+IMAGE_RETRIES = 3  # Retries of a failed connection or a 5xx response, with backoff
+IMAGE_CHUNK_SIZE = 64 * 1024  # Bytes of an image written to disk at a time
+CACHE_FILE = 'image_cache.json'
+
+
+class ImageFetcher(object):
+
+    def __init__(self, img_dir, logger=None):
+        """
+        :param img_dir: dir of the images, with the ETag and Last-Modified of each image URL in CACHE_FILE
+        :param logger:
+        """
+        self.img_dir = img_dir
+        self.logger = logger if logger else logging.getLogger()
+        self.cache_file = os.path.join(img_dir, CACHE_FILE)
+        self.cache = load_json_object(self.cache_file, {})
+        self.session = requests.Session()
+        retries = Retry(total=IMAGE_RETRIES, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504])
+        adapter = HTTPAdapter(pool_connections=MAX_IMAGE_WORKERS, pool_maxsize=MAX_IMAGE_WORKERS, max_retries=retries)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def fetch_all(self, files_by_url):
+        """
+        Downloads the images that aren't in the dir yet and revalidates the ones that are
+        :param files_by_url: dict of image URLs to the file name to save each as in the dir
+        """
+        if not files_by_url:
+            return
+        os.makedirs(self.img_dir, exist_ok=True)
+        with ThreadPoolExecutor(max_workers=MAX_IMAGE_WORKERS) as executor:
+            results = list(executor.map(self.fetch, files_by_url.keys(), files_by_url.values()))
+        for url, validators in zip(files_by_url.keys(), results):
+            if validators:
+                self.cache[url] = validators
+        write_file(self.cache_file, self.cache)
+
+    def fetch(self, url, filename):
+        """
+        Downloads an image, streaming it to a temp file that replaces the image when done. An image that is already
+        there is only downloaded again if the server says it changed.
+        :param url:
+        :param filename:
+        :return: dict of the file name, ETag and Last-Modified of the image, or None if it couldn't be downloaded
+        """
+        filepath = os.path.join(self.img_dir, filename)
+        cached = self.cache.get(url)
+        headers = {}
+        if os.path.exists(filepath):
+            if cached and cached.get('file') == filename:
+                if cached.get('etag'):
+                    headers['If-None-Match'] = cached['etag']
+                if cached.get('last_modified'):
+                    headers['If-Modified-Since'] = cached['last_modified']
+            if not headers:
+                headers['If-Modified-Since'] = formatdate(os.path.getmtime(filepath), usegmt=True)
+        temp_filepath = f'{filepath}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with self.session.get(url, headers=headers, stream=True, timeout=IMAGE_TIMEOUT) as response:
+                if response.status_code == 304:
+                    return cached if cached and cached.get('file') == filename else {'file': filename}
+                response.raise_for_status()
+                with open(temp_filepath, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=IMAGE_CHUNK_SIZE):
+                        f.write(chunk)
+                os.replace(temp_filepath, filepath)
+                return {
+                    'file': filename,
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified')
+                }
+        except (requests.RequestException, OSError) as e:
+            self.logger.error(f'Unable to download image {url}: {e}')
+            if os.path.exists(temp_filepath):
+                os.remove(temp_filepath)
+            return None
@@ -12,24 +12,34 @@ Class for any resource PDF converter
 """
 import os
 import re
+import codecs
+import hashlib
 import logging
 import tempfile
 import markdown2
 import shutil
 import subprocess
 import string
-import requests
 import sys
 import argparse
 import jsonpickle
 import yaml
+import soupsieve
 from collections import OrderedDict
+from html import unescape
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from typing import List, Type
+from urllib.parse import unquote
 from bs4 import BeautifulSoup
+from bs4.element import Tag
 from abc import abstractmethod
-from weasyprint import HTML, LOGGER
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import ArrayObject, Fit, FloatObject, NameObject, NullObject, TextStringObject
+from weasyprint import HTML, LOGGER, __version__ as weasyprint_version
 from .resource import Resource, Resources
 from .rc_link import ResourceContainerLink
+from .phrase_matcher import PhraseMatcher
+from .image_fetcher import ImageFetcher
 from ..general_tools.file_utils import write_file, read_file, load_json_object
 
 DEFAULT_LANG_CODE = 'en'
@@ -41,12 +51,87 @@ LANGUAGE_FILES = {
 }
 APPENDIX_LINKING_LEVEL = 1
 APPENDIX_RESOURCES = ['ta', 'tw']
+MAX_SETUP_WORKERS = 8  # Number of resources to clone/fetch at the same time
+FRAGMENT_CACHE_VERSION = 1  # Bump to throw away all cached markdown HTML fragments
+PDF_PIECES_PER_WORKER = 4  # Pieces the HTML is split into per PDF worker, so workers done early can take another
+PDF_PIECE_LINK_SCHEME = 'pdf-piece:'  # Links to anchors of other pieces are rendered as URIs of this scheme
+PDF_POINTS_PER_PX = 0.75  # WeasyPrint lays out in CSS px, PDF coordinates are in points
+TOC_ID = 'contents'
+TOC_PAGE_PLACEHOLDER = '000'  # Page number of the TOC entries until the pages of all pieces are known
+MAX_TOC_PASSES = 3  # Renders of the TOC with real page numbers, in case the numbers change its page count
+# Running headings of style.css, carried over to a piece from the pieces before it
+RUNNING_HEADING_SELECTORS = {
+    'heading-left': '.manual-cover h2, .resource-title-page h1, h1.section-header',
+    'heading-right': '.heading-right'
+}
+# Every piece hides its own page numbers, which only count its own pages, and shows the TOC page numbers it's given
+PDF_PIECE_STYLE = '''<style>
+@page { @bottom-center { visibility: hidden; } }
+#contents a[data-pdf-page]::after { content: attr(data-pdf-page) !important; }
+.pdf-heading-left { string-set: heading-left content(); }
+.pdf-heading-right { string-set: heading-right content(); }
+</style>'''
+PDF_STAMP_STYLE = '<style>.pdf-stamp-page { break-before: page; }</style>'
+
+# All link sites rewritten by resolve_links(), matched in a single sweep of the document:
+#   [[http...]] links, rc:// links (bare, in [[...]] or as an <a> tag's href), http(s)/ftp URLs and www. URLs
+RC_LINK_PATTERN = r'(\[\[|<a[^>]+href=")*(rc://[/A-Za-z0-9*_-]+)(\]\]|"[^>]*>(.*?)</a>)*'
+LINK_SITES_REGEX = re.compile(r'(?=[\[<rhHfFwW])'  # cheap first character check so most positions fail fast
+                              r'(?:(?P<bracket_url>(?i:\[\[http[^\]]+\]\]))'
+                              r'|(?P<rc>(?P<rc_left>\[\[|<a[^>]+href=")*(?P<rc_link>rc://[/A-Za-z0-9*_-]+)'
+                              r'(?P<rc_right>\]\]|"[^>]*>(?P<rc_title>.*?)</a>)*)'
+                              r'|(?<=[^">])(?P<url>(?i:(?:http|https|ftp)://[A-Za-z0-9/?&_.:=#-]+[A-Za-z0-9/?&_:=#-]))'
+                              r'|(?<=[^/])(?P<www>(?i:www\.[A-Za-z0-9/?&_.:=#-]+[A-Za-z0-9/?&_:=#-])))')
+WWW_URL_REGEX = re.compile(r'([^/])(www\.[A-Za-z0-9/?&_.:=#-]+[A-Za-z0-9/?&_:=#-])', flags=re.IGNORECASE)
+URL_HINT_REGEX = re.compile(r'(?:https?|ftp)://|www\.', flags=re.IGNORECASE)
+IMAGE_TAG_REGEX = re.compile(r'<img\s', flags=re.IGNORECASE)
+IMAGE_SRC_REGEX = re.compile(r'(?P<left><img\s[^>]*?\bsrc\s*=\s*(?P<quote>["\']))(?P<url>http[^"\']*)(?P=quote)',
+                             flags=re.IGNORECASE)
+IMAGE_FILENAME_REGEX = re.compile(r'/([\w_-]+[.](jpg|gif|png))$')
+
+
+def get_pdf_page_name(page):
+    """
+    Gets the name of the named page (CSS `page` property) a rendered page was laid out as. WeasyPrint has no public
+    API for it, so it is read from the page box of the page, as in the WeasyPrint version pinned in requirements.txt.
+    :param page: page of a WeasyPrint document
+    :return: page name, '' if the page has none
+    """
+    page_type = getattr(getattr(page, '_page_box', None), 'page_type', None)
+    name = getattr(page_type, 'name', None)
+    if not isinstance(name, str):
+        raise RuntimeError(f'WeasyPrint {weasyprint_version} does not give the page names of its pages, '
+                           f'so the PDF cannot be rendered in pieces')
+    return name
+
+
+def render_pdf_piece(html, base_url, pdf_file):
+    """
+    Renders a piece of the HTML to its own PDF file
+    :param html: HTML document of the piece
+    :param base_url:
+    :param pdf_file:
+    :return: list of its pages, each with its page name, its anchors and its bookmarks, in PDF points
+    """
+    document = HTML(string=html, base_url=base_url).render()
+    pages = []
+    for page in document.pages:
+        pages.append({
+            'name': get_pdf_page_name(page),
+            # An anchor is the (x, y) of its top left corner, followed by its bottom right corner since WeasyPrint 53
+            'anchors': {name: (anchor[0] * PDF_POINTS_PER_PX, (page.height - anchor[1]) * PDF_POINTS_PER_PX)
+                        for name, anchor in page.anchors.items()},
+            'bookmarks': [(level, label, x * PDF_POINTS_PER_PX, (page.height - y) * PDF_POINTS_PER_PX, state)
+                          for level, label, (x, y), state in page.bookmarks]
+        })
+    document.write_pdf(pdf_file)
+    return pages
 
 
 class PdfConverter:
 
     def __init__(self, resources: Resources, project_id=None, working_dir=None, output_dir=None,
-                 lang_code=DEFAULT_LANG_CODE, regenerate=False, logger=None):
+                 lang_code=DEFAULT_LANG_CODE, regenerate=False, logger=None, pdf_workers=1):
         self.resources = resources
         self.main_resource = self.resources.main
         self.project_id = project_id
@@ -55,8 +140,10 @@ class PdfConverter:
         self.lang_code = lang_code
         self.regenerate = regenerate
         self.logger = logger
+        self.pdf_workers = pdf_workers
 
         self.save_dir = None
+        self.fragments_dir = None
         self.log_dir = None
         self.images_dir = None
         self.output_res_dir = None
@@ -66,6 +153,7 @@ class PdfConverter:
         self.rcs = {}
         self.appendix_rcs = {}
         self.all_rcs = {}
+        self.rcs_by_article_id = None
 
         self.html_file = None
         self.pdf_file = None
@@ -230,6 +318,10 @@ class PdfConverter:
         if not os.path.isdir(self.save_dir):
             os.makedirs(self.save_dir)
 
+        self.fragments_dir = os.path.join(self.save_dir, 'fragments')
+        if not os.path.isdir(self.fragments_dir):
+            os.makedirs(self.fragments_dir)
+
         self.log_dir = os.path.join(self.output_res_dir, 'log')
         if not os.path.isdir(self.log_dir):
             os.makedirs(self.log_dir)
@@ -268,15 +360,15 @@ class PdfConverter:
             body_html = self.get_body_html()
             self.get_appendix_rcs()
             self.all_rcs = {**self.rcs, **self.appendix_rcs}
+            self.rcs_by_article_id = None
             if 'ta' in self.resources:
                 body_html += self.get_appendix_html(self.resources['ta'])
             if 'tw' in self.resources:
                 body_html += self.get_appendix_html(self.resources['tw'])
             self.logger.info('Fixing links in body HTML...')
             body_html = self.fix_links(body_html)
-            body_html = self._fix_links(body_html)
             self.logger.info('Replacing RC links in body HTML...')
-            body_html = self.replace_rc_links(body_html)
+            body_html = self.resolve_links(body_html)
             self.logger.info('Generating Contributors HTML...')
             body_html += self.get_contributors_html()
             body_html = self.download_all_images(body_html)
@@ -307,8 +399,14 @@ class PdfConverter:
     def generate_pdf(self):
         if self.regenerate or not os.path.exists(self.pdf_file):
             self.logger.info(f'Generating PDF file {self.pdf_file}...')
-            weasy = HTML(filename=self.html_file, base_url=f'file://{self.output_res_dir}/')
-            weasy.write_pdf(self.pdf_file)
+            if self.pdf_workers > 1:
+                try:
+                    self.write_pdf_in_pieces()
+                except Exception as e:
+                    self.logger.exception(f'Unable to render the PDF in pieces, rendering it whole instead: {e}')
+                    self.write_pdf()
+            else:
+                self.write_pdf()
             self.logger.info('Generated PDF file.')
             self.logger.info(f'PDF file located at {self.pdf_file}')
 
@@ -318,6 +416,291 @@ class PdfConverter:
             self.logger.info(
                 f'PDF file {self.pdf_file} is already there. Not generating. Use -r to force regeneration.')
 
+    def write_pdf(self):
+        weasy = HTML(filename=self.html_file, base_url=f'file://{self.output_res_dir}/')
+        weasy.write_pdf(self.pdf_file)
+
+    def write_pdf_in_pieces(self):
+        """
+        Renders the HTML file in pieces in parallel, each piece starting on a new page, then merges them into the PDF
+        file with the links, bookmarks and page numbers of the whole document. The TOC is rendered again once the
+        pages of all pieces are known.
+        """
+        base_url = f'file://{self.output_res_dir}/'
+        soup = BeautifulSoup(read_file(self.html_file), 'html.parser')
+        pieces = self.get_pdf_pieces(soup)
+        toc = soup.find(id=TOC_ID)
+        toc_links = toc.find_all('a', href=True) if toc else []
+        for link in toc_links:
+            link['data-pdf-page'] = TOC_PAGE_PLACEHOLDER
+        with tempfile.TemporaryDirectory(dir=self.output_res_dir) as pieces_dir:
+            piece_files = [os.path.join(pieces_dir, f'piece_{idx}.pdf') for idx in range(len(pieces))]
+            self.logger.info(f'Rendering {len(pieces)} PDF pieces with {self.pdf_workers} workers...')
+            with ProcessPoolExecutor(max_workers=self.pdf_workers) as executor:
+                pieces_pages = list(executor.map(render_pdf_piece,
+                                                 [self.get_pdf_piece_html(soup, piece) for piece in pieces],
+                                                 [base_url] * len(pieces), piece_files))
+            toc_idx = next((idx for idx, piece in enumerate(pieces) if piece['toc']), None)
+            for _ in range(MAX_TOC_PASSES if toc_idx is not None else 0):
+                self.logger.info('Rendering the TOC PDF piece with page numbers...')
+                anchors = self.get_pdf_anchors(pieces_pages)
+                for link in toc_links:
+                    anchor = self.get_pdf_link_anchor(link['href'])
+                    link['data-pdf-page'] = str(anchors[anchor][0] + 1) if anchor in anchors else ''
+                toc_pages = render_pdf_piece(self.get_pdf_piece_html(soup, pieces[toc_idx]), base_url,
+                                             piece_files[toc_idx])
+                page_count_changed = len(toc_pages) != len(pieces_pages[toc_idx])
+                pieces_pages[toc_idx] = toc_pages
+                if not page_count_changed:
+                    break
+            self.logger.info('Rendering the page numbers...')
+            stamp_file = os.path.join(pieces_dir, 'page_numbers.pdf')
+            stamp_pages = ''.join(f'<div class="pdf-stamp-page" style="page: {page["name"] or "auto"}"></div>'
+                                  for pages in pieces_pages for page in pages)
+            HTML(string=f'<html>{self.get_pdf_piece_head(soup, PDF_STAMP_STYLE)}<body>{stamp_pages}</body></html>',
+                 base_url=base_url).write_pdf(stamp_file)
+            self.logger.info('Merging the PDF pieces...')
+            title = soup.title.get_text() if soup.title else self.title
+            self.merge_pdf_pieces(piece_files, pieces_pages, stamp_file, title)
+
+    def get_pdf_pieces(self, soup):
+        """
+        Splits the body into pieces of about the same size at the sections and articles that start a new page, going
+        into sections too big to be a piece. The TOC is a piece of its own. Links to anchors of other pieces are
+        changed to PDF_PIECE_LINK_SCHEME links.
+        :param soup:
+        :return: list of pieces, each a dict of its units (wrapping sections, node, size, can start a piece), the
+                 wrapping sections it opens first, the running headings it carries over and if it is the TOC
+        """
+        piece_size = len(str(soup.body)) / (self.pdf_workers * PDF_PIECES_PER_WORKER)
+        pieces = []
+        piece = None
+        headings = {}
+        opened = set()
+        for unit in self.get_pdf_piece_units(soup.body, piece_size):
+            wrappers, node, size, is_start = unit
+            is_toc = isinstance(node, Tag) and node.get('id') == TOC_ID
+            if not piece or (is_start and (piece['size'] >= piece_size or piece['toc'] or is_toc)):
+                unit_headings = self.get_running_headings(node)
+                piece = {
+                    'units': [],
+                    'opens': [],
+                    'size': 0,
+                    'headings': {name: text for name, text in headings.items() if name not in unit_headings},
+                    'toc': is_toc
+                }
+                pieces.append(piece)
+            for wrapper in wrappers:
+                if id(wrapper) not in opened:
+                    opened.add(id(wrapper))
+                    piece['opens'].append(wrapper)
+            piece['units'].append(unit)
+            piece['size'] += size
+            headings.update(self.get_running_headings(node))
+
+        piece_by_anchor = {}
+        for idx, piece in enumerate(pieces):
+            for wrapper in piece['opens']:
+                if wrapper.get('id'):
+                    piece_by_anchor.setdefault(wrapper['id'], idx)
+            for _, node, _, _ in piece['units']:
+                if isinstance(node, Tag):
+                    for element in ([node] if node.get('id') else []) + node.find_all(id=True):
+                        piece_by_anchor.setdefault(element['id'], idx)
+        for idx, piece in enumerate(pieces):
+            for _, node, _, _ in piece['units']:
+                if isinstance(node, Tag):
+                    for link in ([node] if node.name == 'a' else []) + node.find_all('a', href=True):
+                        href = link.get('href', '')
+                        if href.startswith('#') and piece_by_anchor.get(href[1:], idx) != idx:
+                            link['href'] = PDF_PIECE_LINK_SCHEME + href[1:]
+        return pieces
+
+    def get_pdf_piece_units(self, element, piece_size, wrappers=()):
+        """
+        Gets the children of an element as units a piece is made of, going into the sections and articles that are
+        bigger than a piece and have children that can start a piece
+        :param element:
+        :param piece_size:
+        :param wrappers: the sections and articles the element is in, itself included
+        :return: list of (wrappers, node, size, can start a piece) units
+        """
+        units = []
+        for child in element.children:
+            size = len(str(child))
+            if size > piece_size and isinstance(child, Tag) and child.name in ['section', 'article'] and \
+                    any(self.is_pdf_piece_start(grandchild) for grandchild in child.find_all(['section', 'article'],
+                                                                                             recursive=False)):
+                child_units = self.get_pdf_piece_units(child, piece_size, wrappers + (child,))
+                if child_units:
+                    child_wrappers, node, node_size, _ = child_units[0]
+                    child_units[0] = (child_wrappers, node, node_size, self.is_pdf_piece_start(child))
+                units += child_units
+            else:
+                units.append((wrappers, child, size, self.is_pdf_piece_start(child)))
+        return units
+
+    @staticmethod
+    def is_pdf_piece_start(node):
+        """
+        Tells if a node starts a new page going by the page breaks of style.css, so a piece can start with it
+        :param node:
+        :return: bool
+        """
+        if not isinstance(node, Tag) or node.name not in ['section', 'article'] or 'no-break' in node.get('class', []):
+            return False
+        previous = node.find_previous_sibling(True)
+        if previous and 'section-header' in previous.get('class', []):
+            return False
+        if node.parent.name != 'section' or node.find_previous_sibling(node.name):
+            return True
+        # section > article:nth-of-type(1) + section:nth-of-type(1)
+        return node.name == 'section' and previous is not None and previous.name == 'article' and \
+            not previous.find_previous_sibling('article')
+
+    @staticmethod
+    def get_running_headings(node):
+        """
+        Gets the last value a node and its descendants set each running heading to
+        :param node:
+        :return: dict of running heading names to their text
+        """
+        headings = {}
+        if isinstance(node, Tag):
+            for name, selector in RUNNING_HEADING_SELECTORS.items():
+                elements = ([node] if soupsieve.match(selector, node) else []) + soupsieve.select(selector, node)
+                if elements:
+                    headings[name] = elements[-1].get_text()
+        return headings
+
+    @staticmethod
+    def get_pdf_piece_head(soup, style):
+        head = str(soup.head) if soup.head else '<head></head>'
+        return f'{head[:-len("</head>")]}{style}</head>'
+
+    @staticmethod
+    def get_start_tag(soup, element, keep_id=True):
+        attrs = {name: value for name, value in element.attrs.items() if keep_id or name != 'id'}
+        return str(soup.new_tag(element.name, attrs=attrs))[:-len(f'</{element.name}>')]
+
+    def get_pdf_piece_html(self, soup, piece):
+        """
+        Makes the HTML document of a piece, with the head of the whole document and the sections the piece's nodes
+        are in. Only the piece that opens a section first keeps its ID.
+        :param soup:
+        :param piece:
+        :return: the HTML of the piece
+        """
+        html = [self.get_start_tag(soup, soup.html) if soup.html else '<html>',
+                self.get_pdf_piece_head(soup, PDF_PIECE_STYLE),
+                self.get_start_tag(soup, soup.body)]
+        for name, text in piece['headings'].items():
+            span = soup.new_tag('span', attrs={'class': f'hidden pdf-{name}'})
+            span.string = text
+            html.append(str(span))
+        opened_here = set(id(wrapper) for wrapper in piece['opens'])
+        open_wrappers = ()
+        for wrappers, node, _, _ in piece['units']:
+            common = 0
+            while common < min(len(open_wrappers), len(wrappers)) and open_wrappers[common] is wrappers[common]:
+                common += 1
+            for wrapper in reversed(open_wrappers[common:]):
+                html.append(f'</{wrapper.name}>')
+            for wrapper in wrappers[common:]:
+                html.append(self.get_start_tag(soup, wrapper, keep_id=id(wrapper) in opened_here))
+            open_wrappers = wrappers
+            html.append(str(node))
+        for wrapper in reversed(open_wrappers):
+            html.append(f'</{wrapper.name}>')
+        html.append('</body>\n</html>')
+        return ''.join(html)
+
+    @staticmethod
+    def get_pdf_anchors(pieces_pages):
+        """
+        Gets where each anchor is in the whole document, the first one of a name winning as in WeasyPrint
+        :param pieces_pages: the pages of each piece, as returned by render_pdf_piece()
+        :return: dict of anchor names to their (page index, x, y)
+        """
+        anchors = {}
+        page_idx = 0
+        for pages in pieces_pages:
+            for page in pages:
+                for name, (x, y) in page['anchors'].items():
+                    anchors.setdefault(name, (page_idx, x, y))
+                page_idx += 1
+        return anchors
+
+    @staticmethod
+    def get_pdf_link_anchor(href):
+        if href.startswith('#'):
+            return unquote(href[1:])
+        if href.startswith(PDF_PIECE_LINK_SCHEME):
+            return unquote(href[len(PDF_PIECE_LINK_SCHEME):])
+        return None
+
+    def merge_pdf_pieces(self, piece_files, pieces_pages, stamp_file, title):
+        """
+        Merges the PDF files of the pieces into the PDF file, adding the page numbers, pointing the links of the
+        pieces to where their anchors are in the whole document and making the bookmarks of the whole document
+        :param piece_files:
+        :param pieces_pages: the pages of each piece, as returned by render_pdf_piece()
+        :param stamp_file: PDF file with the page numbers of the whole document, one page for each page of the pieces
+        :param title:
+        """
+        writer = PdfWriter()
+        for piece_file in piece_files:
+            for page in PdfReader(piece_file).pages:
+                writer.add_page(page)
+
+        stamp_pages = PdfReader(stamp_file).pages
+        if len(stamp_pages) == len(writer.pages):
+            for page, stamp_page in zip(writer.pages, stamp_pages):
+                page.merge_page(stamp_page)
+        else:
+            self.logger.error(f'Page numbers have {len(stamp_pages)} pages for {len(writer.pages)} pages. '
+                              f'Not adding page numbers.')
+
+        anchors = self.get_pdf_anchors(pieces_pages)
+        for page in writer.pages:
+            if '/Annots' not in page:
+                continue
+            annotations = ArrayObject()
+            for annotation_ref in page['/Annots']:
+                annotation = annotation_ref.get_object()
+                anchor = None
+                if isinstance(annotation.get('/Dest'), TextStringObject):
+                    anchor = str(annotation['/Dest'])
+                elif '/A' in annotation and str(annotation['/A'].get('/URI', '')).startswith(PDF_PIECE_LINK_SCHEME):
+                    anchor = self.get_pdf_link_anchor(str(annotation['/A']['/URI']))
+                if anchor is not None:
+                    if anchor not in anchors:
+                        continue
+                    page_idx, x, y = anchors[anchor]
+                    annotation[NameObject('/Dest')] = ArrayObject([
+                        writer.pages[page_idx].indirect_reference, NameObject('/XYZ'), FloatObject(x), FloatObject(y),
+                        NullObject()])
+                    if '/A' in annotation:
+                        del annotation['/A']
+                annotations.append(annotation_ref)
+            page[NameObject('/Annots')] = annotations
+
+        parents = []
+        page_idx = 0
+        for pages in pieces_pages:
+            for page in pages:
+                for level, label, x, y, state in page['bookmarks']:
+                    while parents and parents[-1][0] >= level:
+                        parents.pop()
+                    bookmark = writer.add_outline_item(label, page_idx, parent=parents[-1][1] if parents else None,
+                                                       fit=Fit.xyz(x, y), is_open=state == 'open')
+                    parents.append((level, bookmark))
+                page_idx += 1
+
+        writer.add_metadata({'/Title': title})
+        with open(self.pdf_file, 'wb') as pdf_file:
+            writer.write(pdf_file)
+
     def save_bad_links_html(self):
         link_file_path = os.path.join(self.output_res_dir, f'{self.file_base_id}_bad_links.html')
 
@@ -418,14 +801,37 @@ class PdfConverter:
     def setup_resource(self, resource):
         resource.clone(self.working_dir)
         self.generation_info[resource.repo_name] = {'tag': resource.tag, 'commit': resource.commit}
+        self.download_logo(resource)
+
+    def download_logo(self, resource):
         logo_path = os.path.join(self.images_dir, resource.logo_file)
         if not os.path.isfile(logo_path):
             command = f'cd "{self.images_dir}" && curl -O "{resource.logo_url}"'
             subprocess.call(command, shell=True)
 
     def setup_resources(self):
-        for resource_name, resource in self.resources.items():
-            self.setup_resource(resource)
+        # Clones and logo downloads are all network/git bound, so they run in a thread pool.
+        # generation_info is filled in afterwards, in resource order, so it is the same however the
+        # fetches finish. If any resource fails, all failures are logged and the first one is raised.
+        resources = list(self.resources.values())
+        logos = {}
+        for resource in resources:
+            logos.setdefault(resource.logo_file, resource)  # resources can share a logo, only fetch it once
+        with ThreadPoolExecutor(max_workers=MAX_SETUP_WORKERS) as executor:
+            clones = [executor.submit(resource.clone, self.working_dir) for resource in resources]
+            downloads = [executor.submit(self.download_logo, resource) for resource in logos.values()]
+        errors = []
+        for resource, future in zip(resources, clones):
+            if future.exception():
+                self.logger.error(f'Unable to set up {resource.repo_name} ({resource.tag}): {future.exception()}')
+                errors.append(future.exception())
+            else:
+                self.generation_info[resource.repo_name] = {'tag': resource.tag, 'commit': resource.commit}
+        for resource, future in zip(logos.values(), downloads):
+            if future.exception():
+                self.logger.error(f'Unable to download logo {resource.logo_url}: {future.exception()}')
+        if errors:
+            raise errors[0]
 
     def determine_if_regeneration_needed(self):
         # check if any commit hashes have changed
@@ -478,29 +884,40 @@ class PdfConverter:
             return {}
 
     def download_all_images(self, html):
+        """
+        Downloads the remote images of the HTML into the images dir and points their src attributes to them
+        :param html:
+        :return: the HTML with the image src attributes rewritten
+        """
+        if not IMAGE_TAG_REGEX.search(html):
+            return html
         img_dir = os.path.join(self.images_dir, f'{self.main_resource.repo_name}_images')
-        os.makedirs(img_dir, exist_ok=True)
-        soup = BeautifulSoup(html, 'html.parser')
-        for img in soup.find_all('img'):
-            if img['src'].startswith('http'):
-                url = img['src']
-                filename = re.search(r'/([\w_-]+[.](jpg|gif|png))$', url).group(1)
-                img['src'] = f'images/{self.main_resource.repo_name}_images/{filename}'
-                filepath = os.path.join(img_dir, filename)
-                if not os.path.exists(filepath):
-                    with open(filepath, 'wb') as f:
-                        response = requests.get(url)
-                        f.write(response.content)
-        return str(soup)
+        files_by_url = {}
+
+        def replace_src(match):
+            url = unescape(match.group('url'))  # as an HTML parser would give the src attribute, e.g. &amp; as &
+            filename_match = IMAGE_FILENAME_REGEX.search(url)
+            if not filename_match:
+                self.logger.error(f'Unable to get an image file name from {url}')
+                return match.group(0)
+            files_by_url[url] = filename_match.group(1)
+            return f'{match.group("left")}images/{self.main_resource.repo_name}_images/{files_by_url[url]}' \
+                   f'{match.group("quote")}'
+
+        html = IMAGE_SRC_REGEX.sub(replace_src, html)
+        ImageFetcher(img_dir, self.logger).fetch_all(files_by_url)
+        return html
 
     @abstractmethod
     def get_body_html(self):
         pass
 
     def get_rc_by_article_id(self, article_id):
-        for rc_link, rc in self.all_rcs.items():
-            if rc.article_id == article_id:
-                return rc
+        if self.rcs_by_article_id is None:
+            self.rcs_by_article_id = {}
+            for rc in self.all_rcs.values():
+                self.rcs_by_article_id.setdefault(rc.article_id, rc)
+        return self.rcs_by_article_id.get(article_id)
 
     def get_toc_html(self, body_html):
         toc_html = f'''
@@ -669,37 +1086,12 @@ class PdfConverter:
         return processed_text
 
     def highlight_text_with_phrases(self, orig_text, phrases, rc, ignore=None):
-        highlighted_text = orig_text
         phrases.sort(key=len, reverse=True)
-        for phrase in phrases:
-            new_highlighted_text = self.highlight_text(highlighted_text, phrase)
-            if new_highlighted_text != highlighted_text:
-                highlighted_text = new_highlighted_text
-            elif not ignore or phrase.lower() not in ignore:
-                # This is just to determine the fix for any terms that differ in curly/straight quotes
-                bad_highlights = OrderedDict({phrase: None})
-                alt_phrase = [
-                    # All curly quotes made straight
-                    phrase.replace('‘', "'").replace('’', "'").replace('“', '"').replace('”', '"'),
-                    # All straight quotes made curly, first single and double pointing right
-                    phrase.replace("'", '’').replace('’', '‘', 1).replace('"', '”').replace('”', '“', 1),
-                    # All curly double quotes made straight
-                    phrase.replace('“', '"').replace('”', '"'),
-                    # All straight double quotes made curly with first pointing right
-                    phrase.replace('"', '”').replace('”', '“', 1),
-                    # All straight single quotes made curly with first pointing right
-                    phrase.replace("'", '’').replace('’', '‘', 1),
-                    # All straight single quotes made straight (all point left)
-                    phrase.replace("'", '’'),
-                    # All left pointing curly single quotes made straight
-                    phrase.replace('’', "'"),
-                    # All right pointing curly single quotes made straight
-                    phrase.replace('‘', "'")]
-                for alt_phrase in alt_phrase:
-                    if orig_text != self.highlight_text(orig_text, alt_phrase):
-                        bad_highlights[phrase] = alt_phrase
-                        break
-                self.add_bad_highlight(rc, orig_text, bad_highlights)
+        highlighted_text, not_found = PhraseMatcher(phrases).highlight(orig_text)
+        for phrase, fix in not_found:
+            if not ignore or phrase.lower() not in ignore:
+                # The fix is the phrase with the curly/straight quotes it has in the text, if it is there with them
+                self.add_bad_highlight(rc, orig_text, OrderedDict({phrase: fix}))
         return highlighted_text
 
     @staticmethod
@@ -750,6 +1142,9 @@ class PdfConverter:
         return m.group()
 
     def replace_rc(self, match):
+        return self.resolve_rc_link(match.group(1), match.group(2), match.group(3), match.group(4))
+
+    def resolve_rc_link(self, left, rc_link, right, title):
         # Replace rc://... rc links according to self.resource_data:
         # Case 1: RC links in double square brackets that need to be converted to <a> elements with articles title:
         #   e.g. [[rc://en/tw/help/bible/kt/word]] => <a href="#tw-kt-word">God's Word</a>
@@ -761,10 +1156,6 @@ class PdfConverter:
         #   e.g. <a href="rc://en/tw/help/bible/names/horeb">Horeb Mountain</a> => Horeb Mountain
         #   e.g. [[rc://en/tw/help/bible/names/horeb]] => Horeb
         # Case 5: Remove other links to resources without text (they weren't directly reference by main content)
-        left = match.group(1)
-        rc_link = match.group(2)
-        right = match.group(3)
-        title = match.group(4)
         if rc_link in self.all_rcs:
             rc = self.all_rcs[rc_link]
             if (left == '[[' and right == ']]') or (not left and not right):
@@ -786,10 +1177,32 @@ class PdfConverter:
         return title if title else rc_link
 
     def replace_rc_links(self, text):
-        regex = re.compile(r'(\[\[|<a[^>]+href=")*(rc://[/A-Za-z0-9*_-]+)(\]\]|"[^>]*>(.*?)</a>)*')
+        regex = re.compile(RC_LINK_PATTERN)
         text = regex.sub(self.replace_rc, text)
         return text
 
+    def replace_link_site(self, match):
+        site = match.group()
+        if match.group('rc') is not None:
+            if URL_HINT_REGEX.search(site):
+                # URLs in the text of an rc:// link's <a> tag get linked before the rc:// link is replaced
+                return self.replace_rc_links(self._fix_links(site))
+            return self.resolve_rc_link(match.group('rc_left'), match.group('rc_link'), match.group('rc_right'),
+                                        match.group('rc_title'))
+        if match.group('url') is not None:
+            return WWW_URL_REGEX.sub(r'\1<a href="http://\2">\2</a>', f'<a href="{site}">{site}</a>')
+        if match.group('www') is not None:
+            return f'<a href="http://{site}">{site}</a>'
+        return self._fix_links(site)
+
+    def resolve_links(self, html):
+        """
+        Does what _fix_links() followed by replace_rc_links() does, but with a single sweep of the document
+        :param html:
+        :return: the html with its links fixed and rc:// links replaced
+        """
+        return LINK_SITES_REGEX.sub(self.replace_link_site, html)
+
     @staticmethod
     def _fix_links(html):
         # Change [[http.*]] to <a href="http\1">http\1</a>
@@ -800,8 +1213,7 @@ class PdfConverter:
                       r'\1<a href="\2">\2</a>', html, flags=re.IGNORECASE)
 
         # URLS wth just www at the start, no http
-        html = re.sub(r'([^/])(www\.[A-Za-z0-9/?&_.:=#-]+[A-Za-z0-9/?&_:=#-])', r'\1<a href="http://\2">\2</a>',
-                      html, flags=re.IGNORECASE)
+        html = WWW_URL_REGEX.sub(r'\1<a href="http://\2">\2</a>', html)
 
         return html
 
@@ -872,7 +1284,7 @@ class PdfConverter:
         article_dir = os.path.join(self.resources[rc.resource].repo_dir, rc.project, rc.path)
         article_file = os.path.join(article_dir, '01.md')
         if os.path.isfile(article_file):
-            article_file_html = markdown2.markdown_path(article_file, extras=['markdown-in-html', 'tables'])
+            article_file_html = self.get_markdown_file_html(article_file, extras=['markdown-in-html', 'tables'])
         else:
             self.logger.error("NO FILE AT {0}".format(article_file))
             if os.path.isdir(article_dir):
@@ -971,6 +1383,34 @@ class PdfConverter:
         article_html = self.fix_ta_links(article_html, rc.project)
         rc.set_article(article_html)
 
+    def get_markdown_html(self, text, extras=None):
+        """
+        Renders markdown to HTML, reusing the HTML saved by an earlier run if this exact markdown has been
+        rendered before, so that only articles and notes that changed are rendered again.
+        :param text: the markdown
+        :param extras: markdown2 extras to render with
+        :return: the HTML
+        """
+        if not self.fragments_dir:
+            return markdown2.markdown(text, extras=extras)
+        key = f'{FRAGMENT_CACHE_VERSION} {markdown2.__version__} {extras}\n{text}'
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        fragment_file = os.path.join(self.fragments_dir, digest[:2], f'{digest}.html')
+        if os.path.isfile(fragment_file):
+            with codecs.open(fragment_file, 'r', encoding='utf-8') as f:
+                return f.read()
+        html = markdown2.markdown(text, extras=extras)
+        os.makedirs(os.path.dirname(fragment_file), exist_ok=True)
+        temp_file = f'{fragment_file}.{os.getpid()}'
+        with codecs.open(temp_file, 'w', encoding='utf-8') as f:
+            f.write(html)
+        os.replace(temp_file, fragment_file)  # so a build running at the same time never reads half a fragment
+        return html
+
+    def get_markdown_file_html(self, file_path, extras=None):
+        with codecs.open(file_path, 'r', encoding='utf-8') as f:
+            return self.get_markdown_html(f.read(), extras=extras)
+
     def get_go_back_to_html(self, source_rc):
         if source_rc.linking_level == 0:
             return ''
@@ -1016,7 +1456,7 @@ class PdfConverter:
         if os.path.isfile(file_path):
             if fix:
                 self.add_bad_link(source_rc, rc.rc_link, fix)
-            tw_article_html = markdown2.markdown_path(file_path)
+            tw_article_html = self.get_markdown_file_html(file_path)
             tw_article_html = self.make_first_header_section_header(tw_article_html)
             tw_article_html = self.increase_headers(tw_article_html)
             tw_article_html = self.fix_tw_links(tw_article_html, rc.extra_info[0])
@@ -1054,6 +1494,8 @@ def run_converter(resource_names: List[str], pdf_converter_class: Type[PdfConver
     parser.add_argument('--owner', dest='owner', default=DEFAULT_OWNER, required=False, help='Owner')
     parser.add_argument('-r', '--regenerate', dest='regenerate', action='store_true',
                         help='Regenerate PDF even if exists')
+    parser.add_argument('--pdf-workers', dest='pdf_workers', type=int, default=1, required=False,
+                        help='Number of processes rendering pieces of the PDF, 1 to render it in one go')
     for resource_name in resource_names:
         parser.add_argument(f'--{resource_name}-tag', dest=resource_name, default=DEFAULT_TAG, required=False)
 
@@ -1064,6 +1506,7 @@ def run_converter(resource_names: List[str], pdf_converter_class: Type[PdfConver
     output_dir = args.output_dir
     owner = args.owner
     regenerate = args.regenerate
+    pdf_workers = args.pdf_workers
     if not lang_codes:
         lang_codes = [DEFAULT_LANG_CODE]
     if not project_ids:
@@ -1081,7 +1524,8 @@ def run_converter(resource_names: List[str], pdf_converter_class: Type[PdfConver
                 resource = Resource(resource_name=resource_name, repo_name=repo_name, tag=tag, owner=owner, logo_url=logo)
                 resources[resource_name] = resource
             converter = pdf_converter_class(resources=resources, project_id=project_id, working_dir=working_dir,
-                                            output_dir=output_dir, lang_code=lang_code, regenerate=regenerate)
+                                            output_dir=output_dir, lang_code=lang_code, regenerate=regenerate,
+                                            pdf_workers=pdf_workers)
             project_id_str = f'_{project_id}' if project_id else ''
             converter.logger.info(f'Starting PDF Converter for {resources.main.repo_name}_{resources.main.tag}{project_id_str}...')
             converter.run()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+#
+#  Copyright (c) 2020 unfoldingWord
+#  http://creativecommons.org/licenses/MIT/
+#  See LICENSE file for details.
+#
+#  Contributors:
+#  Richard Mahn <rich.mahn@unfoldingword.org>
+
+"""
+Class for finding all the phrases to highlight in a text with one scan (Aho-Corasick style)
+"""
+
+import re
+
+PHRASE_SPLIT_REGEX = re.compile(r'\s*…\s*|\s*\.\.\.\s*')
+# Whitespace and <span> tags count as a single space, any other tag can't be matched over, the rest is text
+HTML_TOKEN_REGEX = re.compile(r'((?:\s|</*span[^>]*>)+)|(<[^>]*>)|([^<\s]+|<)')
+WHITESPACE_REGEX = re.compile(r'\s+')
+TAG_CHAR = '\0'
+# Curly and straight quotes are matched as the same character so we can suggest fixes for bad highlights
+QUOTE_FOLDING = str.maketrans({'‘': "'", '’': "'", '“': '"', '”': '"'})
+QUOTES = "'‘’\"“”"
+
+
+class PhraseMatcher(object):
+
+    def __init__(self, phrases):
+        """
+        Builds one automaton for the parts of all phrases, with curly and straight quotes folded together
+        :param phrases: phrases to highlight, longest first
+        """
+        self.phrases = phrases
+        self.phrase_parts = []
+        self.patterns = []
+        self.goto = [{}]
+        self.fail = [0]
+        self.outputs = [[]]
+        pattern_ids = {}
+        for phrase in phrases:
+            raw_parts = PHRASE_SPLIT_REGEX.split(phrase)
+            parts = []
+            for part in raw_parts:
+                if not part.strip():
+                    continue
+                pattern = WHITESPACE_REGEX.sub(' ', part)
+                if pattern not in pattern_ids:
+                    pattern_ids[pattern] = len(self.patterns)
+                    self.patterns.append(pattern)
+                    self.add_pattern(pattern.translate(QUOTE_FOLDING), pattern_ids[pattern])
+                parts.append((part, pattern_ids[pattern]))
+            self.phrase_parts.append((parts, len(raw_parts) > 1))
+        self.build_fail_links()
+
+    def add_pattern(self, pattern, pattern_id):
+        state = 0
+        for char in pattern:
+            if char not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.outputs.append([])
+                self.goto[state][char] = len(self.goto) - 1
+            state = self.goto[state][char]
+        self.outputs[state].append(pattern_id)
+
+    def build_fail_links(self):
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fail = self.fail[state]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[next_state] = self.goto[fail].get(char, 0)
+                self.outputs[next_state] = self.outputs[next_state] + self.outputs[self.fail[next_state]]
+
+    @staticmethod
+    def tokenize(text):
+        """
+        Turns HTML into the characters that phrases are matched against and where each one is in the HTML
+        :param text:
+        :return: the characters and the start and end offset in text of each
+        """
+        chars = []
+        starts = []
+        ends = []
+        for match in HTML_TOKEN_REGEX.finditer(text):
+            if match.group(3) is None:
+                chars.append(' ' if match.group(1) else TAG_CHAR)
+                starts.append(match.start())
+                ends.append(match.end())
+            else:
+                for idx in range(match.start(), match.end()):
+                    chars.append(text[idx])
+                    starts.append(idx)
+                    ends.append(idx + 1)
+        return ''.join(chars), starts, ends
+
+    def find_all(self, chars):
+        """
+        Scans the characters once for every occurrence of every phrase part, ignoring the kind of quotes
+        :param chars:
+        :return: per pattern, the list of (start, end, exact) occurrences in the order they appear
+        """
+        occurrences = [[] for _ in self.patterns]
+        state = 0
+        for idx, char in enumerate(chars.translate(QUOTE_FOLDING)):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for pattern_id in self.outputs[state]:
+                start = idx + 1 - len(self.patterns[pattern_id])
+                exact = chars[start:idx + 1] == self.patterns[pattern_id]
+                occurrences[pattern_id].append((start, idx + 1, exact))
+        return occurrences
+
+    def highlight(self, text):
+        """
+        Highlights the first occurrence of each phrase, longest phrase first, without overlapping
+        :param text:
+        :return: the highlighted text and a list of (phrase, fix) for phrases not found, the fix being the phrase
+                 with the quotes that are in the text, or None if it isn't there with other quotes either
+        """
+        chars, starts, ends = self.tokenize(text)
+        occurrences = self.find_all(chars)
+        taken = []
+        highlights = []
+        not_found = []
+        for phrase, (parts, split) in zip(self.phrases, self.phrase_parts):
+            position = 0
+            found_exact = False
+            for idx, (part, pattern_id) in enumerate(parts):
+                exact = [(start, end) for start, end, is_exact in occurrences[pattern_id]
+                         if is_exact and start >= position]
+                if idx == 0:
+                    found_exact = bool(exact)
+                for start, end in exact:
+                    if not any(start < taken_end and taken_start < end for taken_start, taken_end in taken):
+                        taken.append((start, end))
+                        highlights.append((starts[start], ends[end - 1], split))
+                        position = end
+                        break
+                else:
+                    break
+            if not found_exact and parts:
+                not_found.append((phrase, self.get_fix(phrase, parts, chars, occurrences)))
+        highlights.sort()
+        highlighted_text = ''
+        position = 0
+        for start, end, split in highlights:
+            highlight_classes = 'highlight split' if split else 'highlight'
+            highlighted_text += f'{text[position:start]}<span class="{highlight_classes}">{text[start:end]}</span>'
+            position = end
+        return highlighted_text + text[position:], not_found
+
+    @staticmethod
+    def get_fix(phrase, parts, chars, occurrences):
+        position = 0
+        fix = phrase
+        fix_position = 0
+        for idx, (part, pattern_id) in enumerate(parts):
+            matched = [(start, end) for start, end, is_exact in occurrences[pattern_id] if start >= position]
+            if not matched:
+                if idx == 0:
+                    return None
+                break
+            start, end = matched[0]
+            position = end
+            text_quotes = iter([char for char in chars[start:end] if char in QUOTES])
+            fixed_part = ''.join(next(text_quotes) if char in QUOTES else char for char in part)
+            part_position = fix.index(part, fix_position)
+            fix = fix[:part_position] + fixed_part + fix[part_position + len(part):]
+            fix_position = part_position + len(fixed_part)
+        return fix
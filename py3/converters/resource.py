@@ -12,9 +12,13 @@
 Class for a resource
 """
 import os
+import re
 import git
+import fcntl
+import shutil
 from collections import OrderedDict
-from ..general_tools.file_utils import load_yaml_object
+from contextlib import contextmanager
+from ..general_tools.file_utils import load_yaml_object, load_json_object, write_file
 
 DEFAULT_OWNER = 'unfoldingWord'
 DEFAULT_TAG = 'master'
@@ -28,6 +32,8 @@ LOGO_MAP = {
     'obs-sq': 'obs'
 }
 RUN_LOCALLY = False
+# Bare mirrors of every repo cloned, shared by all builds and working dirs on this machine
+MIRROR_DIR = os.environ.get('MIRROR_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'resource_mirrors'))
 
 
 class Resource(object):
@@ -63,23 +69,62 @@ class Resource(object):
     def get_resource_git_url(resource, owner):
         return f'https://git.door43.org/{owner}/{resource}.git'
 
-    def clone(self, working_dir):
+    @staticmethod
+    def get_mirror_dir(url):
+        return os.path.join(MIRROR_DIR, re.sub(r'[^\w.-]+', '_', re.sub(r'^\w+://', '', url)))
+
+    @contextmanager
+    def mirror_lock(self):
+        # Held while this repo's mirror is created or updated, by threads and by other builds
+        os.makedirs(MIRROR_DIR, exist_ok=True)
+        with open(os.path.join(MIRROR_DIR, f'{self.repo_name}.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def update_mirror(self):
+        """
+        Creates or fetches the bare mirror of this repo in MIRROR_DIR, trying the other OWNERS if the repo
+        can't be cloned from its own URL. The URL that worked is remembered so later builds go straight to it.
+        :return: the mirror's directory, or None if the repo could not be found
+        """
         if not self.url:
             self.url = self.get_resource_git_url(self.repo_name, self.owner)
-        self.repo_dir = os.path.join(working_dir, self.repo_name)
-        if not os.path.isdir(self.repo_dir):
-            try:
-                git.Repo.clone_from(self.url, self.repo_dir)
-            except git.GitCommandError:
-                owners = OWNERS
-                for owner in owners:
-                    self.url = self.get_resource_git_url(self.repo_name, owner)
+        with self.mirror_lock():
+            fallbacks_file = os.path.join(MIRROR_DIR, f'{self.repo_name}.json')
+            fallbacks = load_json_object(fallbacks_file, {})
+            urls = [fallbacks.get(self.url, self.url), self.url] + \
+                [self.get_resource_git_url(self.repo_name, owner) for owner in OWNERS]
+            for url in OrderedDict.fromkeys(urls):
+                mirror_dir = self.get_mirror_dir(url)
+                if os.path.isdir(mirror_dir):
+                    if not RUN_LOCALLY:
+                        git.Git(mirror_dir).fetch('--prune', 'origin')
+                else:
                     try:
-                        git.Repo.clone_from(self.url, self.repo_dir)
+                        git.Repo.clone_from(url, mirror_dir, mirror=True)
                     except git.GitCommandError:
+                        shutil.rmtree(mirror_dir, ignore_errors=True)
                         continue
-                    if os.path.isdir(self.repo_dir):
-                        break
+                if url != self.url:
+                    if fallbacks.get(self.url) != url:
+                        fallbacks[self.url] = url
+                        write_file(fallbacks_file, fallbacks)
+                    self.url = url
+                return mirror_dir
+        return None
+
+    def clone(self, working_dir):
+        self.repo_dir = os.path.join(working_dir, self.repo_name)
+        if not os.path.isdir(self.repo_dir):
+            mirror_dir = self.update_mirror()
+            if mirror_dir:
+                # A local clone hard-links the mirror's objects, so only the checkout costs anything
+                git.Repo.clone_from(mirror_dir, self.repo_dir)
+        elif not RUN_LOCALLY and git.Repo(self.repo_dir).remotes.origin.url.startswith(MIRROR_DIR):
+            self.update_mirror()  # the fetch below is from the mirror, so bring it up to date first
         self.git = git.Git(self.repo_dir)
         if not RUN_LOCALLY:
             self.git.fetch()
@@ -12,10 +12,24 @@ This script generates the HTML and PDF TN documents
 """
 import os
 import re
+import csv
+from collections import OrderedDict
 from datetime import datetime
-from ..general_tools.file_utils import write_file, read_file, load_json_object, unzip, load_yaml_object
-from ..general_tools.usfm_utils import usfm3_to_usfm2
+from ..general_tools.file_utils import read_file, load_json_object, get_latest_version
+from ..general_tools.bible_books import BOOK_CHAPTER_VERSES
+from ..general_tools.usfm_utils import get_usfm_book_index
 from .pdf_converter import PdfConverter, run_converter
+from .tw_words_index import TwWordsIndex
+
+ALIGNED_CHAPTERS_CACHE_SIZE = 10  # Number of parsed aligned Bible chapter JSON files to keep in memory
+WORDS_TO_IGNORE = frozenset([
+    'a', 'am', 'an', 'and', 'as', 'are', 'at', 'be', 'by', 'did', 'do', 'does', 'done', 'for', 'from', 'had', 'has',
+    'have', 'he', 'her', 'his', 'i', 'in', 'into', 'less', 'let', 'may', 'might', 'more', 'my', 'not', 'is', 'of', 'on',
+    'one', 'onto', 'our', 'she', 'than', 'the', 'their', 'then', 'they', 'this', 'that', 'those', 'these', 'to', 'was',
+    'we', 'who', 'whom', 'with', 'will', 'were', 'your', 'you', 'would', 'could', 'should', 'shall', 'can'])
+LEADING_WORDS_TO_IGNORE_REGEX = re.compile(r'^(({0})\s+)+'.format('|'.join(sorted(WORDS_TO_IGNORE))),
+                                           flags=re.MULTILINE | re.IGNORECASE)
+TW_WORD_BOUNDARY_CHARS = '></\\_-'  # A tW word next to one of these is in or next to a tag, so not linked there
 
 
 class TnPdfConverter(PdfConverter):
@@ -28,7 +42,8 @@ class TnPdfConverter(PdfConverter):
         self.resource_data = {}
         self.rc_lookup = {}
         self.tn_book_data = {}
-        self.tw_words_data = {}
+        self.tw_words_index = None
+        self.tw_words_indexes = {}
         self.bad_links = {}
         self.bad_notes = {}
         self.usfm_chunks = {}
@@ -44,6 +59,9 @@ class TnPdfConverter(PdfConverter):
         self.soup = None
         self.date = datetime.now().strftime('%Y-%m-%d')
         self.verse_to_chunk = {}
+        self.bible_version_dirs = {}
+        self.aligned_chapters = OrderedDict()
+        self.alignment_index = None
 
     def get_body_html(self):
         self.logger.info('Generating TA html...')
@@ -112,42 +130,17 @@ class TnPdfConverter(PdfConverter):
         self.populate_verse_usfm_ust()
 
     def populate_verse_usfm_ust(self):
-        book_data = {}
-        book_file = os.path.join(self.resources['ust'].repo_dir, f'{self.book_number}-{self.book_id.upper}.usfm')
-        usfm3 = read_file(book_file)
-        usfm2 = usfm3_to_usfm2(usfm3)
-        chapters = usfm2.split(r'\c ')
-        for chapter_usfm in chapters[1:]:
-            chapter = int(re.findall('(\d+)', chapter_usfm)[0])
-            book_data[chapter] = {}
-            chapter_usfm = r'\c '+chapter_usfm
-            verses = chapter_usfm.split(r'\v ')
-            for verseUsfm in verses[1:]:
-                verse = int(re.findall('(\d+)', verseUsfm)[0])
-                verseUsfm = r'\v '+verseUsfm
-                if re.match(r'^\\v \d+\s*$', verseUsfm, flags=re.MULTILINE):
-                    verseUsfm = ''
-                book_data[chapter][verse] = verseUsfm
-        self.verse_usfm[self.ust_id] = book_data
+        self.populate_verse_usfm_for_resource('ust', self.ust_id)
 
     def populate_verse_usfm_ult(self):
-        bookData = {}
-        book_file = os.path.join(self.ult_dir, '{0}-{1}.usfm'.format(self.book_number, self.book_id.upper()))
+        self.populate_verse_usfm_for_resource('ult', self.ult_id)
+
+    def populate_verse_usfm_for_resource(self, resource_name, resource_id):
+        book_file = os.path.join(self.resources[resource_name].repo_dir,
+                                 '{0}-{1}.usfm'.format(self.book_number, self.book_id.upper()))
         usfm3 = read_file(book_file)
-        usfm2 = usfm3_to_usfm2(usfm3)
-        chapters = usfm2.split(r'\c ')
-        for chapterUsfm in chapters[1:]:
-            chapter = int(re.findall('(\d+)', chapterUsfm)[0])
-            bookData[chapter] = {}
-            chapterUsfm = r'\c '+chapterUsfm
-            verses = chapterUsfm.split(r'\v ')
-            for verseUsfm in verses[1:]:
-                verse = int(re.findall('(\d+)', verseUsfm)[0])
-                verseUsfm = r'\v '+verseUsfm
-                if re.match(r'^\\v \d+\s*$', verseUsfm, flags=re.MULTILINE):
-                    verseUsfm = ''
-                bookData[chapter][verse] = verseUsfm
-        self.verse_usfm[self.ult_id] = bookData
+        # Chapters are converted to USFM 2 only when one of their verses is looked up with get_verse_usfm2()
+        self.verse_usfm[resource_id] = get_usfm_book_index(usfm3)
 
     def populate_chapters_and_verses(self):
         versification_file = os.path.join(self.versification_dir, '{0}.json'.format(self.book_id))
@@ -202,7 +195,7 @@ class TnPdfConverter(PdfConverter):
 </div>
 '''.format(self.book_id, self.tn_manifest['dublin_core']['title'], self.book_title)
         if 'front' in self.tn_book_data and 'intro' in self.tn_book_data['front']:
-            intro = markdown2.markdown(self.tn_book_data['front']['intro'][0]['OccurrenceNote'].replace('<br>', '\n'))
+            intro = self.get_markdown_html(self.tn_book_data['front']['intro'][0]['OccurrenceNote'].replace('<br>', '\n'))
             title = self.get_first_header(intro)
             intro = self.fix_tn_links(intro, 'intro')
             intro = self.increase_headers(intro)
@@ -227,7 +220,7 @@ class TnPdfConverter(PdfConverter):
             self.verse_to_chunk[self.pad(chapter)] = {}
             self.logger.info('Chapter {0}...'.format(chapter))
             if 'intro' in self.tn_book_data[chapter]:
-                intro = markdown2.markdown(self.tn_book_data[chapter]['intro'][0]['OccurrenceNote'].replace('<br>',"\n"))
+                intro = self.get_markdown_html(self.tn_book_data[chapter]['intro'][0]['OccurrenceNote'].replace('<br>',"\n"))
                 intro = re.sub(r'<h(\d)>([^>]+) 0+([1-9])', r'<h\1>\2 \3', intro, 1, flags=re.MULTILINE | re.IGNORECASE)
                 title = self.get_first_header(intro)
                 intro = self.fix_tn_links(intro, chapter)
@@ -262,7 +255,7 @@ class TnPdfConverter(PdfConverter):
                         verse_notes = ''
                         for data in self.tn_book_data[chapter][str(verse)]:
                             note_quote = data['GLQuote']
-                            note = markdown2.markdown(data['OccurrenceNote'].replace('<br>', "\n"))
+                            note = self.get_markdown_html(data['OccurrenceNote'].replace('<br>', "\n"))
                             note = re.sub(r'</*p[^>]*>', '', note, flags=re.IGNORECASE | re.MULTILINE)
                             verse_notes += '''
                 <div class="verse-note">
@@ -348,33 +341,18 @@ class TnPdfConverter(PdfConverter):
         return tn_html
 
     def populate_tw_words_data(self):
-        groups = ['kt', 'names', 'other']
         if int(self.book_number) < 41:
-            ol_path = get_latest_version(os.path.join(self.tn_resources_dir, 'hbo/translationHelps/translationWords'))
+            ol_lang = 'hbo'
         else:
-            ol_path = get_latest_version(os.path.join(self.tn_resources_dir, 'el-x-koine/translationHelps/translationWords'))
+            ol_lang = 'el-x-koine'
+        ol_path = get_latest_version(os.path.join(self.tn_resources_dir, ol_lang, 'translationHelps/translationWords'))
         if not os.path.isdir(ol_path):
             self.logger.error('{0} not found! Please make sure you ran `setup.sh` in the `tn` dir'.format(ol_path))
             exit(1)
-        words = {}
-        for group in groups:
-            files_path = '{0}/{1}/groups/{2}/*.json'.format(ol_path, group, self.book_id)
-            files = glob(files_path)
-            for file in files:
-                base = os.path.splitext(os.path.basename(file))[0]
-                rc = 'rc://{0}/tw/dict/bible/{1}/{2}'.format(self.lang_code, group, base)
-                occurrences = load_json_object(file)
-                for occurrence in occurrences:
-                    context_id = occurrence['contextId']
-                    chapter = context_id['reference']['chapter']
-                    verse = context_id['reference']['verse']
-                    context_id['rc'] = rc
-                    if chapter not in words:
-                        words[chapter] = {}
-                    if verse not in words[chapter]:
-                        words[chapter][verse] = []
-                    words[chapter][verse].append(context_id)
-        self.tw_words_data = words
+        if ol_path not in self.tw_words_indexes:
+            index_file = os.path.join(self.save_dir, '{0}_tw_words.sqlite'.format(ol_lang))
+            self.tw_words_indexes[ol_path] = TwWordsIndex(ol_path, index_file, self.lang_code)
+        self.tw_words_index = self.tw_words_indexes[ol_path]
 
     def get_plain_html(self, resource, chapter, first_verse, last_verse):
         verses = ''
@@ -423,24 +401,8 @@ class TnPdfConverter(PdfConverter):
         new_html = verses_split[0]
         for verse_num in range(first_verse, last_verse+1):
             words = self.get_all_words_to_match(resource, chapter, verse_num)
-            for word in words:
-                parts = word['text'].split(' ... ')
-                pattern = ''
-                replace = ''
-                new_parts = []
-                for idx, part in enumerate(parts):
-                    words_to_ignore = ['a', 'am', 'an', 'and', 'as', 'are', 'at', 'be', 'by', 'did', 'do', 'does', 'done', 'for', 'from', 'had', 'has', 'have', 'he', 'her', 'his', 'i', 'in', 'into', 'less', 'let', 'may', 'might', 'more', 'my', 'not', 'is', 'of', 'on', 'one', 'onto', 'our', 'she', 'than', 'the', 'their', 'then', 'they', 'this', 'that', 'those', 'these', 'to', 'was', 'we', 'who', 'whom', 'with', 'will', 'were', 'your', 'you', 'would', 'could', 'should', 'shall', 'can']
-                    part = re.sub(r'^(({0})\s+)+'.format('|'.join(words_to_ignore)), '', part, flags=re.MULTILINE | re.IGNORECASE)
-                    if not part or (idx < len(parts)-1 and part.lower().split(' ')[-1] in words_to_ignore):
-                        continue
-                    new_parts.append(part)
-                for idx, part in enumerate(new_parts):
-                    pattern += r'(?<![></\\_-])\b{0}\b(?![></\\_-])'.format(part)
-                    replace += r'<a href="{0}">{1}</a>'.format(word['contextId']['rc'], part)
-                    if idx + 1 < len(new_parts):
-                        pattern += r'(.*?)'
-                        replace += r'\{0}'.format(idx + 1)
-                verses[verse_num] = re.sub(pattern, replace, verses[verse_num], 1, flags=re.MULTILINE | re.IGNORECASE)
+            if words:
+                verses[verse_num] = self.link_tw_words(verses[verse_num], words)
             rc = 'rc://{0}/tn/help/{1}/{2}/{3}'.format(self.lang_code, self.book_id, self.pad(chapter),
                                                        str(verse_num).zfill(3))
             verse_text = ''
@@ -453,57 +415,188 @@ class TnPdfConverter(PdfConverter):
         new_html += footer_html
         return new_html
 
+    def link_tw_words(self, text, words):
+        """
+        Links the first match of each aligned tW word in a verse's text. Each word in turn gets the first match that
+        isn't in or next to the link of a word before it, then all the links are put in with one pass of the text.
+        :param text: the verse's HTML
+        :param words: the words to link from get_all_words_to_match()
+        :return: the text with the tW links
+        """
+        lower_text = text.lower()
+        if len(lower_text) != len(text):
+            lower_text = None
+        links = []
+        for word in words:
+            parts = word['text'].split(' ... ')
+            new_parts = []
+            for idx, part in enumerate(parts):
+                part = LEADING_WORDS_TO_IGNORE_REGEX.sub('', part)
+                if not part or (idx < len(parts) - 1 and part.lower().split(' ')[-1] in WORDS_TO_IGNORE):
+                    continue
+                new_parts.append(part)
+            if not new_parts:
+                continue
+            # The parts must come one after the other, each the first match after the one before it in the same line
+            for first_start in self.find_tw_word_part(text, lower_text, new_parts[0], 0, links):
+                word_links = [(first_start, first_start + len(new_parts[0]))]
+                for part in new_parts[1:]:
+                    last_end = word_links[-1][1]
+                    start = next(self.find_tw_word_part(text, lower_text, part, last_end, links), None)
+                    if start is None or '\n' in text[last_end:start]:
+                        break
+                    word_links.append((start, start + len(part)))
+                if len(word_links) == len(new_parts):
+                    rc = word['contextId']['rc']
+                    links += [(start, end, '<a href="{0}">{1}</a>'.format(rc, part))
+                              for (start, end), part in zip(word_links, new_parts)]
+                    break
+        if not links:
+            return text
+        links.sort()
+        linked_text = ''
+        pos = 0
+        for start, end, link in links:
+            linked_text += text[pos:start] + link
+            pos = end
+        return linked_text + text[pos:]
+
+    @staticmethod
+    def find_tw_word_part(text, lower_text, part, pos, links):
+        # Yields where the part is found from pos on as a whole word (case insensitive), not next to a tag or any of
+        # the links made so far, nor in them
+        def is_boundary(idx):
+            return (idx > 0 and (text[idx - 1].isalnum() or text[idx - 1] == '_')) != \
+                   (idx < len(text) and (text[idx].isalnum() or text[idx] == '_'))
+
+        if lower_text is None:
+            matches = (m.start() for m in re.finditer(re.escape(part), text[pos:], flags=re.IGNORECASE))
+            starts = (pos + start for start in matches)
+        else:
+            starts = TnPdfConverter.find_all(lower_text, part.lower(), pos)
+        for start in starts:
+            end = start + len(part)
+            if not is_boundary(start) or not is_boundary(end) or \
+                    (start > 0 and text[start - 1] in TW_WORD_BOUNDARY_CHARS) or \
+                    (end < len(text) and text[end] in TW_WORD_BOUNDARY_CHARS) or \
+                    any(start <= link_end and link_start <= end for link_start, link_end, link in links):
+                continue
+            yield start
+
+    @staticmethod
+    def find_all(text, sub, pos):
+        pos = text.find(sub, pos)
+        while pos >= 0:
+            yield pos
+            pos = text.find(sub, pos + 1)
+
+    def get_bible_version_dir(self, resource):
+        if resource not in self.bible_version_dirs:
+            self.bible_version_dirs[resource] = get_latest_version(
+                os.path.join(self.tn_resources_dir, '{0}/bibles/{1}'.format(self.lang_code, resource)))
+        return self.bible_version_dirs[resource]
+
+    def get_aligned_chapter(self, resource, chapter):
+        """
+        Gets the parsed aligned Bible JSON of a chapter of this book, keeping the most recently used ones in memory
+        :param resource: the aligned Bible, e.g. ult
+        :param chapter:
+        :return: the verses of the chapter, keyed by verse number
+        """
+        path = '{0}/{1}/{2}.json'.format(self.get_bible_version_dir(resource), self.book_id, chapter)
+        if path in self.aligned_chapters:
+            self.aligned_chapters.move_to_end(path)
+        else:
+            self.aligned_chapters[path] = load_json_object(path)
+            if len(self.aligned_chapters) > ALIGNED_CHAPTERS_CACHE_SIZE:
+                self.aligned_chapters.popitem(last=False)
+        return self.aligned_chapters[path]
+
     def get_all_words_to_match(self, resource, chapter, verse):
-        path = '{0}/{1}/{2}.json'.format(
-            get_latest_version(os.path.join(self.tn_resources_dir, '{0}/bibles/{1}'.format(self.lang_code, resource))),
-            self.book_id, chapter)
         words = []
-        data = load_json_object(path)
-        chapter = int(chapter)
-        if chapter in self.tw_words_data and verse in self.tw_words_data[chapter]:
-            context_ids = self.tw_words_data[int(chapter)][int(verse)]
-            verse_objects = data[str(verse)]['verseObjects']
+        context_ids = self.tw_words_index.get_context_ids(self.book_id, int(chapter), verse) \
+            if self.tw_words_index else []
+        if context_ids:
+            verse_objects = self.get_aligned_chapter(resource, chapter)[str(verse)]['verseObjects']
             for context_id in context_ids:
                 aligned_text = self.get_aligned_text(verse_objects, context_id, False)
                 if aligned_text:
                     words.append({'text': aligned_text, 'contextId': context_id})
         return words
 
-    def find_target_from_combination(self, verse_objects, quote, occurrence):
-        ol_words = []
+    def get_alignment_index(self, verse_objects):
+        """
+        Indexes the top level alignments of a verse once for all the context IDs of that verse
+        :param verse_objects:
+        :return: dict with the verse's OL words, their target text and where each OL word starts a word list entry
+        """
+        if self.alignment_index and self.alignment_index['verse_objects'] is verse_objects:
+            return self.alignment_index
         word_list = []
+        word_list_idx = {}
         for verse_object in verse_objects:
             if 'content' in verse_object and 'type' in verse_object and verse_object['type'] == 'milestone':
-                ol_words.append(verse_object['content'])
                 target_words = []
                 for child in verse_object['children']:
                     if child['type'] == 'word':
                         target_words.append(child['text'])
                 target = ' '.join(target_words)
-                found = False
-                for idx, word in enumerate(word_list):
-                    if word['ol'] == verse_object['content'] and 'occurrence' in verse_object and \
-                            word['occurrence'] == verse_object['occurrence']:
-                        word_list[idx]['target'] += ' ... ' + target
-                        found = True
-                if not found:
-                    word_list.append({'ol': verse_object['content'], 'target': target, 'occurrence': verse_object['occurrence']})
-        combinations = []
-        occurrences = {}
-        for i in range(0, len(word_list)):
-            ol = word_list[i]['ol']
-            target = word_list[i]['target']
-            for j in range(i, len(word_list)):
-                if i != j:
-                    ol += ' '+word_list[j]['ol']
-                    target += ' '+word_list[j]['target']
-                if ol not in occurrences:
-                    occurrences[ol] = 0
-                occurrences[ol] += 1
-                combinations.append({'ol': ol, 'target': target, 'occurrence': occurrences[ol]})
-        for combination in combinations:
-            if combination['ol'] == quote and combination['occurrence'] == occurrence:
-                return combination['target']
+                key = (verse_object['content'], verse_object.get('occurrence'))
+                if 'occurrence' in verse_object and key in word_list_idx:
+                    word_list[word_list_idx[key]]['target'] += ' ... ' + target
+                else:
+                    if key not in word_list_idx:
+                        word_list_idx[key] = len(word_list)
+                    word_list.append({'ol': verse_object['content'], 'target': target,
+                                      'occurrence': verse_object['occurrence']})
+        starts = {}
+        for idx, word in enumerate(word_list):
+            starts.setdefault(word['ol'], []).append(idx)
+        self.alignment_index = {
+            'verse_objects': verse_objects,
+            'word_list': word_list,
+            'starts': starts,
+            'split_words': self.get_split_words(verse_objects)
+        }
+        return self.alignment_index
+
+    def get_split_words(self, verse_objects, split_words=None):
+        # All (content or lemma, occurrence) pairs find_target_from_split() could match anywhere in the verse
+        if split_words is None:
+            split_words = set()
+        for verse_object in verse_objects:
+            if 'type' in verse_object and (verse_object['type'] == 'milestone' or verse_object['type'] == 'word'):
+                for key in ['content', 'lemma']:
+                    if key in verse_object:
+                        split_words.add((verse_object[key], verse_object.get('occurrence')))
+            if 'children' in verse_object and verse_object['children']:
+                self.get_split_words(verse_object['children'], split_words)
+        return split_words
+
+    def find_target_from_combination(self, verse_objects, quote, occurrence):
+        # The quote is the OL words of one or more contiguous entries of the word list joined with spaces, each entry
+        # being an OL word and occurrence with all its target words. The nth time the quote can be made from the word
+        # list, going by where it starts, is its nth occurrence.
+        if not isinstance(quote, str):
+            return None
+        index = self.get_alignment_index(verse_objects)
+        word_list = index['word_list']
+        candidates = []
+        for end in range(len(quote) + 1):
+            if end == len(quote) or quote[end] == ' ':
+                candidates += index['starts'].get(quote[:end], [])
+        count = 0
+        for i in sorted(candidates):
+            pos = len(word_list[i]['ol'])
+            j = i
+            while pos < len(quote) and j + 1 < len(word_list) and quote[pos] == ' ' and \
+                    quote.startswith(word_list[j + 1]['ol'], pos + 1):
+                j += 1
+                pos += 1 + len(word_list[j]['ol'])
+            if pos == len(quote):
+                count += 1
+                if count == occurrence:
+                    return ' '.join(word['target'] for word in word_list[i:j + 1])
         return None
 
     def find_target_from_split(self, verse_objects, quote, occurrence, is_match=False):
@@ -513,6 +606,10 @@ class TnPdfConverter(PdfConverter):
                 words_to_match.append(q['word'])
         else:
             words_to_match = quote.split(' ')
+        if not is_match and self.alignment_index and self.alignment_index['verse_objects'] is verse_objects:
+            split_words = self.alignment_index['split_words']
+            if not any((word, occurrence) in split_words for word in words_to_match):
+                return ''
         separator = ' '
         needs_ellipsis = False
         text = ''
@@ -573,7 +670,7 @@ class TnPdfConverter(PdfConverter):
                                      self.book_id.upper(), context_id['reference']['chapter'],
                                      context_id['reference']['verse']))
 
-     def fix_tn_links(self, text, chapter):
+    def fix_tn_links(self, text, chapter):
         def replace_link(match):
             before_href = match.group(1)
             link = match.group(2)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+#
+#  Copyright (c) 2020 unfoldingWord
+#  http://creativecommons.org/licenses/MIT/
+#  See LICENSE file for details.
+#
+#  Contributors:
+#  Richard Mahn <rich.mahn@unfoldingword.org>
+
+"""
+Class for looking up the tW words of a verse in one SQLite index of a whole translationWords groups tree
+"""
+
+import os
+import json
+import sqlite3
+from glob import glob
+from ..general_tools.file_utils import load_json_object
+
+TW_GROUPS = ['kt', 'names', 'other']
+INDEX_VERSION = 1  # Bump to rebuild every tW words index
+INDEX_MMAP_SIZE = 256 * 1024 * 1024  # Bytes of the index file SQLite reads through mmap
+
+
+class TwWordsIndex(object):
+
+    def __init__(self, ol_path, index_file, lang_code):
+        """
+        Opens the index of the tW groups of an OL version dir, building it first if it is missing or was built
+        from another version dir
+        :param ol_path: the version dir of the OL translationWords, with a <group>/groups/<book>/<word>.json tree
+        :param index_file: the SQLite file of the index
+        :param lang_code: the language of the tW rc links
+        """
+        self.ol_path = ol_path
+        self.index_file = index_file
+        self.lang_code = lang_code
+        self.source = '{0} {1}'.format(INDEX_VERSION, os.path.realpath(ol_path))
+        if self.get_indexed_source() != self.source:
+            self.build()
+        self.connection = sqlite3.connect('file:{0}?mode=ro'.format(index_file), uri=True, check_same_thread=False)
+        self.connection.execute('PRAGMA mmap_size = {0}'.format(INDEX_MMAP_SIZE))
+
+    def get_indexed_source(self):
+        if not os.path.isfile(self.index_file):
+            return None
+        try:
+            connection = sqlite3.connect('file:{0}?mode=ro'.format(self.index_file), uri=True)
+            try:
+                row = connection.execute("SELECT value FROM meta WHERE key = 'source'").fetchone()
+            finally:
+                connection.close()
+        except sqlite3.DatabaseError:
+            return None
+        return row[0] if row else None
+
+    def build(self):
+        """
+        Loads every word JSON file of every book once into a new index, which then replaces the old one
+        """
+        temp_file = '{0}.{1}.tmp'.format(self.index_file, os.getpid())
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        os.makedirs(os.path.dirname(os.path.abspath(self.index_file)), exist_ok=True)
+        connection = sqlite3.connect(temp_file)
+        try:
+            connection.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)')
+            connection.execute('CREATE TABLE occurrences (book TEXT, chapter INTEGER, verse INTEGER, seq INTEGER, '
+                               'word_group TEXT, word TEXT, context_id TEXT)')
+            seq = 0
+            for group in TW_GROUPS:
+                for book_dir in sorted(glob(os.path.join(self.ol_path, group, 'groups', '*'))):
+                    book = os.path.basename(book_dir)
+                    rows = []
+                    for word_file in sorted(glob(os.path.join(book_dir, '*.json'))):
+                        word = os.path.splitext(os.path.basename(word_file))[0]
+                        for occurrence in load_json_object(word_file):
+                            context_id = occurrence['contextId']
+                            rows.append((book, context_id['reference']['chapter'], context_id['reference']['verse'],
+                                         seq, group, word, json.dumps(context_id, ensure_ascii=False)))
+                            seq += 1
+                    connection.executemany('INSERT INTO occurrences VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+            connection.execute('CREATE INDEX verse_index ON occurrences (book, chapter, verse, seq)')
+            connection.execute("INSERT INTO meta VALUES ('source', ?)", (self.source,))
+            connection.commit()
+        finally:
+            connection.close()
+        os.replace(temp_file, self.index_file)
+
+    def get_context_ids(self, book, chapter, verse):
+        """
+        Gets the context IDs of the tW words of a verse, each with the rc link of its word
+        :param book: the book ID, in lower case
+        :param chapter:
+        :param verse:
+        :return: list of the context IDs in the order of the group, word and occurrence
+        """
+        context_ids = []
+        for group, word, context_id in self.connection.execute(
+                'SELECT word_group, word, context_id FROM occurrences WHERE book = ? AND chapter = ? AND verse = ? '
+                'ORDER BY seq', (book, chapter, verse)):
+            context_id = json.loads(context_id)
+            context_id['rc'] = 'rc://{0}/tw/dict/bible/{1}/{2}'.format(self.lang_code, group, word)
+            context_ids.append(context_id)
+        return context_ids
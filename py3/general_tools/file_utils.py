@@ -2,6 +2,7 @@ from __future__ import unicode_literals, print_function
 import codecs
 import json
 import os
+import re
 import zipfile
 import sys
 import shutil
@@ -160,6 +161,21 @@ def get_files(dir, relative_paths=False, include_directories=False, topdown=Fals
                 file_list.append(os.path.join(path, dir_name))
     return file_list
 
+def get_latest_version(path_to_versions):
+    """
+    Returns the highest numbered version directory (v1, v2, ... v10) in <path_to_versions>.
+    :param str|unicode path_to_versions: The directory holding the version directories
+    :return: The path to the latest version, or <path_to_versions> itself if there are no versions
+    """
+    versions = [d for d in os.listdir(path_to_versions) if re.match(r'^v\d+', d) and
+                os.path.isdir(os.path.join(path_to_versions, d))]
+    if versions:
+        versions.sort(key=lambda v: [int(c) if c.isdigit() else c for c in re.split('([0-9]+)', v)])
+        return os.path.join(path_to_versions, versions[-1])
+    else:
+        return path_to_versions
+
+
 def get_subdirs(dir, relative_paths=False, topdown=False):
     dir_list = []
     for root, dirs, files in os.walk(dir, topdown=topdown):
@@ -0,0 +1,145 @@
+# test_usfm_utils.py
+
+# Checks usfm3_to_usfm2() against what it returned before it was made to take fewer passes, e.g.
+#   python -m unittest py3.general_tools.test_usfm_utils
+
+import unittest
+
+from .usfm_utils import usfm3_to_usfm2
+
+
+# (name, USFM 3, USFM 2 with strip, USFM 2 without strip), the USFM 2 as given by the regex by regex conversion
+GOLDEN = [
+    ('aligned verses',
+     '\n'
+     '\\c 1\n'
+     '\\p\n'
+     '\\v 1 \\zaln-s |x-strong="G39720" x-lemma="Παῦλος" x-occurrence="1" x-occurrences="1"\\*'
+     '\\w Paul|x-occurrence="1" x-occurrences="1"\\w*\\zaln-e\\*,\n'
+     '\\zaln-s |x-strong="G14010"\\*\\w a|x-occurrence="1" x-occurrences="1"\\w*\n'
+     '\\w servant|x-occurrence="1" x-occurrences="1"\\w*\\zaln-e\\*\n'
+     '\n'
+     '\\v 2 \\w which|x-occurrence="1"\\w* \\w he|x-occurrence="1"\\w* \\w promised|x-occurrence="1"\\w* .\n',
+     '\\c 1\n'
+     '\\p\n'
+     '\\v 1 Paul, a servant\n'
+     '\\v 2 which he promised.',
+     '\\c 1\n'
+     '\\p\n'
+     '\\v 1 Paul, a servant\n'
+     '\\v 2 which he promised.\n'),
+    ('malformed word markers',
+     '\\c 1\n'
+     '\\p\n'
+     '\\v 1 \\w no attributes\\w* \\w unclosed|x-occurrence="1" and \\w closed|x-occurrence="1"\\w*\n'
+     '\\v 2 \\w split\n'
+     'word|x-occurrence="1"\\w* stray\\w* end\n'
+     '\\v 3 \\w a|b|c\\w* \\w|x="1"\\w*\n',
+     '\\c 1\n'
+     '\\p\n'
+     '\\v 1 no attributes\\w* \\w unclosed\n'
+     '\\v 2 split word stray\\w* end\n'
+     '\\v 3 a \\w |x= "1" \\w*',
+     '\\c 1\n'
+     '\\p\n'
+     '\\v 1 no attributes\\w* \\w unclosed\n'
+     '\\v 2 split word stray\\w* end\n'
+     '\\v 3 a \\w |x= "1" \\w*\n'),
+    ('unclosed fqa',
+     '\\c 2\n'
+     '\\p\n'
+     '\\v 1 text\\f + \\ft Some read \\fqa other words\\fqa here.\\f*\n'
+     '\\v 2 closed \\f + \\fqa fine\\fqa*\\f* and \\fqa twice\\fqa and\\fqa again\\fqa\n',
+     '\\c 2\n'
+     '\\p\n'
+     '\\v 1 text\\f + \\ft Some read \\fqa other words\\fqa* here.\\f*\n'
+     '\\v 2 closed \\f + \\fqa fine\\fqa* \\f* and \\fqa twice\\fqa and\\fqa again\\fqa*',
+     '\\c 2\n'
+     '\\p\n'
+     '\\v 1 text\\f + \\ft Some read \\fqa other words\\fqa* here.\\f*\n'
+     '\\v 2 closed \\f + \\fqa fine\\fqa* \\f* and \\fqa twice\\fqa and\\fqa again\\fqa*\n'),
+    ('quotes across verses and chapters',
+     '\\c 3\n'
+     '\\p\n'
+     '\\v 1 He said, " Come\n'
+     '\\v 2 and see " . Then\n'
+     '\\q1" another \'quote\' and it\' s here\n'
+     '\\c 4\n'
+     '\\p\n'
+     '\\v 1 An " unpaired quote\n'
+     '\\c 5\n'
+     '\\v 1 \\s5\n'
+     '\\v 2 ( spaced ) [ out ] , and - dashes ;\n',
+     '\\c 3\n'
+     '\\p\n'
+     '\\v 1 He said, "Come\n'
+     '\\v 2 and see ". Then\n'
+     '\\q1 " another \'quote\' and it\'s here\n'
+     '\\c 4\n'
+     '\\p\n'
+     '\\v 1 An " unpaired quote\n'
+     '\\c 5\n'
+     '\\v 1 \n'
+     '\\v 2 (spaced) [out], and-dashes;',
+     '\\c 3\n'
+     '\\p\n'
+     '\\v 1 He said, "Come\n'
+     '\\v 2 and see ". Then\n'
+     '\\q1 " another \'quote\' and it\'s here\n'
+     '\\c 4\n'
+     '\\p\n'
+     '\\v 1 An " unpaired quote\n'
+     '\\c 5\n'
+     '\\v 1 \n'
+     '\\v 2 (spaced) [out], and-dashes;\n'),
+    ('quoted words without a chapter',
+     '\\v 6 \\w "|x="1"\\w* \\w Go|x="1"\\w*\\w ,"|x="1"\\w* \\w he|x="1"\\w*\n'
+     '\n'
+     '\\v 7 \\w said|x="1"\\w* \\w "|x="1"\\w*\n',
+     '\\v 6 " Go," he\n'
+     '\\v 7 said "',
+     '\\v 6 " Go," he\n'
+     '\\v 7 said "\n'),
+    ('blank lines and spaces',
+     '\n'
+     '\n'
+     '\\id GEN\n'
+     '\n'
+     '\\c 1\n'
+     '\\p\n'
+     '\\v 1   In    the\n'
+     'beginning\n'
+     '\n'
+     '\n'
+     '\\v 2 \t tabs \n'
+     '  \n',
+     '\\id GEN\n'
+     '\\c 1\n'
+     '\\p\n'
+     '\\v 1 In the beginning\n'
+     '\\v 2 \t tabs',
+     '\\id GEN\n'
+     '\\c 1\n'
+     '\\p\n'
+     '\\v 1 In the beginning\n'
+     '\\v 2 \t tabs \n'),
+    ('leading and trailing spaces',
+     ' \\v 5 "Go," he said .  \n'
+     '\n',
+     '\\v 5 "Go," he said.',
+     ' \\v 5 "Go," he said. \n'),
+]
+
+
+class TestUsfm3ToUsfm2(unittest.TestCase):
+
+    def test_golden(self):
+        for name, usfm3, stripped, unstripped in GOLDEN:
+            with self.subTest(name=name, strip=True):
+                self.assertEqual(usfm3_to_usfm2(usfm3), stripped)
+            with self.subTest(name=name, strip=False):
+                self.assertEqual(usfm3_to_usfm2(usfm3, strip=False), unstripped)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,36 +2,142 @@
 
 from __future__ import unicode_literals
 import re
+import hashlib
+from collections import OrderedDict
 
-def usfm3_to_usfm2(usfm):
+CHAPTER_REGEX = re.compile(r'\\c ')
+VERSE_MARKER_REGEX = re.compile(r'\\v ')
+NUMBER_REGEX = re.compile(r'\d+')
+EMPTY_VERSE_REGEX = re.compile(r'^\\v \d+\s*$', flags=re.MULTILINE)
+ZALN_S_REGEX = re.compile(r'\\zaln-s[^\*]*\*')
+WORD_REGEX = re.compile(r'\\w ([^|]+)\|.*?\\w\*')
+# A \w that isn't followed by its word, attributes and \w* before any other marker
+LOOSE_WORD_REGEX = re.compile(r'\\w (?![^|\\]+\|[^\\\n]*\\w\*)')
+WORD_ATTRIBUTES_REGEX = re.compile(r'\|[^\\\n]*\\w\*')
+JOIN_LINES_REGEX = re.compile(r'\n+(?=[^\\\n])')
+BLANK_LINES_REGEX = re.compile(r'\n\n+')
+MULTIPLE_SPACES_REGEX = re.compile(r'  +')
+SPLIT_POSSESSIVE_REGEX = re.compile(r"\s*' s(?!\w)")
+FQA_REGEX = re.compile(r'\\fqa([^*]+)\\fqa(?![*])')
+QUOTES_REGEX = re.compile(r'\s*"\s*([^"]+)\s*"\s*', flags=re.DOTALL)
+MARKER_PUNCTUATION_REGEX = re.compile(r'\\(\w+\**)([^\w* \n])')
+SPACE_BEFORE_PUNCTUATION_REGEX = re.compile(r' +(?=[:;.?,!\]})-])')
+SPACE_AFTER_PUNCTUATION_REGEX = re.compile(r'(?<=[{(\[-]) +')
+BOOK_INDEXES_CACHE_SIZE = 4  # Number of indexed books to keep, enough for all the Bibles of the book being built
+book_indexes = OrderedDict()  # sha1 of a book's USFM 3 => its UsfmBookIndex
+
+
+def usfm3_to_usfm2(usfm, strip=True):
     """
     Converts a USFM 3 string to a USFM 2 compatible string
     :param usfm3:
+    :param strip: strip the whitespace from the start and end of the result
     :return: the USFM 2 version of the string
     """
     # Kind of usfm3 to usfm2
-    usfm = re.sub(r'\\zaln-s[^\*]*\*', r'', usfm, flags=re.UNICODE | re.MULTILINE)
-    usfm = re.sub(r'\\zaln-e\\\*', r'', usfm, flags=re.UNICODE | re.MULTILINE)
-    usfm = re.sub(r'\\w ([^|]+)\|.*?\\w\*', r'\1', usfm, flags=re.UNICODE | re.MULTILINE)
-    usfm = re.sub(r'^\n', '', usfm, flags=re.UNICODE | re.MULTILINE)
-    usfm = re.sub(r'^([^\\].*)\n(?=[^\\])', r'\1 ', usfm, flags=re.UNICODE | re.MULTILINE)
-    usfm = re.sub(r'^\\(.*)\n(?=[^\\])', r'\\\1 ', usfm, flags=re.UNICODE | re.MULTILINE)
-    usfm = re.sub(r'  +', ' ', usfm, flags=re.UNICODE | re.MULTILINE)
+    usfm = ZALN_S_REGEX.sub('', usfm)
+    usfm = usfm.replace('\\zaln-e\\*', '')
+    if usfm.count('\\w ') == usfm.count('\\w*') and not LOOSE_WORD_REGEX.search(usfm):
+        # Every \w is well formed and every \w* closes one, so their attributes and markers can simply be dropped
+        usfm = WORD_ATTRIBUTES_REGEX.sub('', usfm).replace('\\w ', '')
+    else:
+        usfm = WORD_REGEX.sub(r'\1', usfm)
+    # Drops the blank lines and joins each line to the previous one unless it starts with a marker
+    usfm = usfm.lstrip('\n')
+    usfm = JOIN_LINES_REGEX.sub(' ', usfm)
+    usfm = BLANK_LINES_REGEX.sub('\n', usfm)
+    usfm = MULTIPLE_SPACES_REGEX.sub(' ', usfm)
 
     # Clean up bad USFM data and fixing punctuation
-    usfm = re.sub(r"\s*' s(?!\w)", "'s", usfm, flags=re.UNICODE | re.MULTILINE)
-    usfm = re.sub(r'\\s5', '', usfm, flags=re.UNICODE | re.MULTILINE)
-    usfm = re.sub(r'\\fqa([^*]+)\\fqa(?![*])', r'\\fqa\1\\fqa*', usfm, flags=re.UNICODE | re.MULTILINE)
-    
+    if "' s" in usfm:
+        usfm = SPLIT_POSSESSIVE_REGEX.sub("'s", usfm)
+    usfm = usfm.replace('\\s5', '')
+    if '\\fqa' in usfm:
+        usfm = FQA_REGEX.sub(r'\\fqa\1\\fqa*', usfm)
+
     # Pair up quotes by chapter
-    chapters = re.compile(r'\\c').split(usfm)
-    usfm = chapters[0]
-    for chapter in chapters[1:]:
-        chapter = re.sub(r'\s*"\s*([^"]+)\s*"\s*', r' "\1" ', chapter, flags=re.UNICODE | re.MULTILINE | re.DOTALL)
-        usfm += '\c'+chapter
-    usfm = re.sub(r'\\(\w+\**)([^\w* \n])', r'\\\1 \2', usfm, flags=re.UNICODE | re.MULTILINE) # \\q1" => \q1 "
-    usfm = re.sub(r" ' ", r" '", usfm, flags=re.UNICODE | re.MULTILINE)
-    usfm = re.sub(r' +([:;.?,!\]})-])', r'\1', usfm, flags=re.UNICODE | re.MULTILINE)
-    usfm = re.sub(r'([{(\[-]) +', r'\1', usfm, flags=re.UNICODE | re.MULTILINE)
-
-    return usfm.strip()
+    if '"' in usfm:
+        chapters = usfm.split('\\c')
+        for idx in range(1, len(chapters)):
+            if '"' in chapters[idx]:
+                chapters[idx] = QUOTES_REGEX.sub(r' "\1" ', chapters[idx])
+        usfm = '\\c'.join(chapters)
+    usfm = MARKER_PUNCTUATION_REGEX.sub(r'\\\1 \2', usfm)  # \\q1" => \q1 "
+    usfm = usfm.replace(" ' ", " '")
+    usfm = SPACE_BEFORE_PUNCTUATION_REGEX.sub('', usfm)
+    usfm = SPACE_AFTER_PUNCTUATION_REGEX.sub('', usfm)
+
+    return usfm.strip() if strip else usfm
+
+
+class UsfmBookIndex(object):
+
+    def __init__(self, usfm):
+        """
+        Indexes where each chapter and verse of a USFM 3 book is with one scan, converting to USFM 2 only when asked
+        :param usfm: the USFM 3 of the book
+        """
+        self.usfm = usfm
+        self.chapters = {}  # chapter => (start, end) of it in the USFM 3, from its \c to the next one
+        self.verses = {}  # (chapter, verse) => (start, end) of it in the USFM 3, from its \v to the next \v or \c
+        self.last_chapter = None
+        self.chapters_usfm2 = {}
+        starts = [match.start() for match in CHAPTER_REGEX.finditer(usfm)]
+        for idx, start in enumerate(starts):
+            end = starts[idx + 1] if idx + 1 < len(starts) else len(usfm)
+            chapter = int(NUMBER_REGEX.search(usfm, start, end).group())
+            self.chapters[chapter] = (start, end)
+            self.last_chapter = chapter
+            verse_starts = [match.start() for match in VERSE_MARKER_REGEX.finditer(usfm, start, end)]
+            for verse_idx, verse_start in enumerate(verse_starts):
+                verse_end = verse_starts[verse_idx + 1] if verse_idx + 1 < len(verse_starts) else end
+                verse = int(NUMBER_REGEX.search(usfm, verse_start, verse_end).group())
+                self.verses[(chapter, verse)] = (verse_start, verse_end)
+
+    def get_chapter_usfm2(self, chapter):
+        """
+        Gets the USFM 2 of each verse of a chapter, converting the chapter the first time it is asked for. The chapter
+        is what gets converted since usfm3_to_usfm2() pairs up quotes by chapter.
+        :param chapter:
+        :return: dict of verse => its USFM 2, or '' if the verse has no text
+        """
+        if chapter not in self.chapters_usfm2:
+            start, end = self.chapters[chapter]
+            chapter_usfm = usfm3_to_usfm2(self.usfm[start:end], strip=False)
+            if chapter == self.last_chapter:
+                chapter_usfm = chapter_usfm.rstrip()
+            verses = {}
+            for verse_usfm in VERSE_MARKER_REGEX.split(chapter_usfm)[1:]:
+                verse = int(NUMBER_REGEX.search(verse_usfm).group())
+                verse_usfm = r'\v ' + verse_usfm
+                if EMPTY_VERSE_REGEX.match(verse_usfm):
+                    verse_usfm = ''
+                verses[verse] = verse_usfm
+            self.chapters_usfm2[chapter] = verses
+        return self.chapters_usfm2[chapter]
+
+    def get_verse_usfm2(self, chapter, verse):
+        """
+        :param chapter:
+        :param verse:
+        :return: the USFM 2 of the verse, '' if it has no text, or None if the book doesn't have it
+        """
+        if chapter not in self.chapters:
+            return None
+        return self.get_chapter_usfm2(chapter).get(verse)
+
+
+def get_usfm_book_index(usfm):
+    """
+    Gets the index of a USFM 3 book, indexing the same book only once
+    :param usfm:
+    :return: the UsfmBookIndex of the book
+    """
+    key = hashlib.sha1(usfm.encode('utf-8')).hexdigest()
+    if key in book_indexes:
+        book_indexes[key] = book_indexes.pop(key)  # the most recently used book goes last
+    else:
+        book_indexes[key] = UsfmBookIndex(usfm)
+        if len(book_indexes) > BOOK_INDEXES_CACHE_SIZE:
+            book_indexes.popitem(last=False)
+    return book_indexes[key]
@@ -26,16 +26,18 @@ import json
 import git
 import requests
 import string
+import time
 import prettierfier
 from glob import glob
 from bs4 import BeautifulSoup
 from weasyprint import HTML, LOGGER
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
 from ..usfm_tools.transform import UsfmTransform
 from ..general_tools.file_utils import write_file, read_file, load_json_object, unzip, load_yaml_object
 from ..general_tools.url_utils import download_file
 from ..general_tools.bible_books import BOOK_NUMBERS, BOOK_CHAPTER_VERSES
-from ..general_tools.usfm_utils import usfm3_to_usfm2
+from ..general_tools.usfm_utils import get_usfm_book_index
 
 
 _print = print
@@ -46,6 +48,8 @@ DEFAULT_UST_ID = 'ust'
 DEFAULT_ULT_ID = 'ult'
 DEFAULT_TN_ID = 'tn'
 OWNERS = [DEFAULT_OWNER, 'STR', 'Door43-Catalog']
+DEFAULT_JOBS = 1  # Number of books to generate at the same time
+ARTICLES_PER_TASK = 50  # Number of tA/tW articles each worker renders from markdown at a time
 
 
 def print(obj):
@@ -77,12 +81,24 @@ def get_latest_version(path_to_versions):
         return path_to_versions
 
 
+book_converter = None  # The TnConverter a book worker process generates its books with
+
+
+def init_book_worker(tn_converter):
+    global book_converter
+    book_converter = tn_converter
+
+
+def run_book_in_worker(project):
+    return book_converter.run_book(project)
+
+
 class TnConverter(object):
 
     def __init__(self, ta_tag=None, tn_tag=None, tw_tag=None, ust_tag=None, ult_tag=None,
                  ust_id=DEFAULT_UST_ID, ult_id=DEFAULT_ULT_ID, tn_id=DEFAULT_TN_ID,
                  working_dir=None, output_dir=None, lang_code=DEFAULT_LANG, books=None, owner=DEFAULT_OWNER,
-                 regenerate=False, regenerate_all=False, logger=None):
+                 regenerate=False, regenerate_all=False, logger=None, jobs=DEFAULT_JOBS):
         self.ta_tag = ta_tag
         self.tn_tag = tn_tag
         self.tw_tag = tw_tag
@@ -99,7 +115,9 @@ class TnConverter(object):
         self.owner = owner
         self.regenerate = regenerate_all or regenerate
         self.regenerate_all = regenerate_all
+        self.regenerate_setup = self.regenerate
         self.logger = logger
+        self.jobs = jobs
 
         if not self.working_dir:
             self.working_dir = tempfile.mkdtemp(prefix='tn-')
@@ -156,12 +174,33 @@ class TnConverter(object):
         self.soup = None
         self.date = datetime.now().strftime('%Y-%m-%d')
         self.verse_to_chunk = {}
+        self.article_html = {}
 
     def run(self):
+        start = time.time()
+        self.setup()
+        projects = self.get_book_projects() or []
+        if self.jobs > 1 and len(projects) > 1:
+            # Each worker would otherwise render the articles its books link to again
+            self.populate_article_html()
+            with ProcessPoolExecutor(max_workers=min(self.jobs, len(projects)), initializer=init_book_worker,
+                                     initargs=(self,)) as executor:
+                timings = list(executor.map(run_book_in_worker, projects))
+        else:
+            timings = [self.run_book(project) for project in projects]
+        self.save_generation_info()
+        self.log_timings(timings, time.time() - start)
+
+    def setup(self):
+        """
+        Prepares what all the books share, once: the resources, manifests and style files
+        """
         self.setup_resource_files()
         self.file_id = '{0}_{1}_tn_{2}_{3}'.format(self.date, self.lang_code, self.tn_tag,
                                                    self.generation_info[self.tn_id]['commit'])
         self.determine_if_regeneration_needed()
+        # Each book starts from this, not from what the books run before it in the same process found
+        self.regenerate_setup = self.regenerate
 
         logger_handler = logging.FileHandler(os.path.join(self.output_dir, '{0}_logger.log'.format(self.file_id)))
         self.logger.addHandler(logger_handler)
@@ -175,78 +214,117 @@ class TnConverter(object):
         self.ust_manifest = load_yaml_object(os.path.join(self.ust_dir, 'manifest.yaml'))
         self.version = self.tn_manifest['dublin_core']['version']
         self.title = self.tn_manifest['dublin_core']['title']
-        projects = self.get_book_projects()
-        for p in projects:
-            self.project = p
-            self.book_id = p['identifier'].lower()
-            self.book_title = p['title']
-            self.book_number = BOOK_NUMBERS[self.book_id]
-            self.book_file_id = '{0}_{1}_tn_{2}_{3}_{4}-{5}'.format(self.date, self.lang_code, self.tn_tag,
-                                                                self.generation_info[self.tn_id]['commit'],
-                                                                self.book_number.zfill(2), self.book_id.upper())
-            self.logger.info('Creating tN for {0}...'.format(self.book_file_id))
-            self.load_resource_data()
-            html_file = os.path.join(self.output_dir, '{0}.html'.format(self.book_file_id))
-            pdf_file = os.path.join(self.output_dir, '{0}.pdf'.format(self.book_file_id))
-            if self.regenerate or not os.path.exists(html_file):
-                self.logger.info('Generating HTML file {0}...'.format(html_file))
-                self.resource_data = {}
-                self.rc_references = {}
-                self.verse_to_chunk = {}
-                self.populate_tn_book_data()
-                self.populate_tw_words_data()
-                self.populate_chapters_and_verses()
-                self.populate_verse_usfm()
-                self.populate_chunks_text()
-                with open(os.path.join(self.my_path, '../common_files/template.html')) as template_file:
-                    html_template = string.Template(template_file.read())
-                html = html_template.safe_substitute(title='{0} - {1} - v{2}'.format(self.title, self.book_title,
-                                                                                     self.version))
-                self.soup = BeautifulSoup(html, 'html.parser')
-                self.soup.html.head.title.string = self.title
-                self.soup.html.head.append(
-                    BeautifulSoup('<link href="html/tn_style.css" rel="stylesheet"/>', 'html.parser'))
-                self.get_cover()
-                self.get_license()
-                self.get_body_html()
-                self.download_all_images()
-
-                write_file(os.path.join(self.output_dir, 'tn_not_prettified.html'), str(self.soup))
-                write_file(os.path.join(self.output_dir, 'tn_soup_prettified.html'), self.soup.prettify())
-                prettierfied_html = prettierfier.prettify_html(self.soup.prettify())
-                write_file(os.path.join(self.output_dir, 'tn_prettierfier_prettified.html'), prettierfied_html)
-
-                write_file(html_file, str(self.soup))
-
-                self.logger.info("Copying style sheet files...")
-                style_file = os.path.join(self.my_path, '../common_files/style.css')
-                shutil.copy2(style_file, self.html_dir)
-                style_file = os.path.join(self.my_path, 'tn_style.css')
-                shutil.copy2(style_file, self.html_dir)
-                if not os.path.exists(os.path.join(self.html_dir, 'fonts')):
-                    fonts_dir = os.path.join(self.my_path, '../common_files/fonts')
-                    shutil.copytree(fonts_dir, os.path.join(self.html_dir, 'fonts'))
-
-                self.save_resource_data()
-                self.save_bad_links()
-                self.logger.info('Generated HTML file.')
-            else:
-                self.logger.info('HTML file {0} already there. Not generating. Use -r to force regeneration.'.
-                                 format(html_file))
-
-            if self.regenerate or not os.path.exists(pdf_file):
-                self.logger.info('Generating PDF file {0}...'.format(pdf_file))
-                weasy = HTML(filename=html_file, base_url='file://{0}/'.format(self.output_dir))
-                weasy.write_pdf(pdf_file)
-                self.logger.info('Generated PDF file.')
-                link_file = os.path.join(self.output_dir, '{0}_tn_{1}_{2}-{3}.pdf'.
-                                         format(self.lang_code, self.tn_tag, self.book_number.zfill(2),
-                                                self.book_id.upper()))
-                subprocess.call('ln -sf "{0}" "{1}"'.format(pdf_file, link_file), shell=True)
-                self.logger.info('PDF file located at {0}'.format(pdf_file))
-            else:
-                self.logger.info(
-                    'PDF file {0} already there. Not generating. Use -r to force regeneration.'.format(pdf_file))
+
+        self.logger.info("Copying style sheet files...")
+        style_file = os.path.join(self.my_path, '../common_files/style.css')
+        shutil.copy2(style_file, self.html_dir)
+        style_file = os.path.join(self.my_path, 'tn_style.css')
+        shutil.copy2(style_file, self.html_dir)
+        if not os.path.exists(os.path.join(self.html_dir, 'fonts')):
+            fonts_dir = os.path.join(self.my_path, '../common_files/fonts')
+            shutil.copytree(fonts_dir, os.path.join(self.html_dir, 'fonts'))
+
+    def run_book(self, project):
+        """
+        Generates the HTML and PDF of a book. Only uses what setup() prepared, so books can be run in worker processes
+        :param project: the book's project from the tN manifest
+        :return: dict of the book's ID and the seconds its HTML and PDF took
+        """
+        timing = {'book': project['identifier'], 'html': 0, 'pdf': 0}
+        self.regenerate = self.regenerate_setup
+        self.project = project
+        self.book_id = project['identifier'].lower()
+        self.book_title = project['title']
+        self.book_number = BOOK_NUMBERS[self.book_id]
+        self.book_file_id = '{0}_{1}_tn_{2}_{3}_{4}-{5}'.format(self.date, self.lang_code, self.tn_tag,
+                                                            self.generation_info[self.tn_id]['commit'],
+                                                            self.book_number.zfill(2), self.book_id.upper())
+        self.logger.info('Creating tN for {0}...'.format(self.book_file_id))
+        self.load_resource_data()
+        html_file = os.path.join(self.output_dir, '{0}.html'.format(self.book_file_id))
+        pdf_file = os.path.join(self.output_dir, '{0}.pdf'.format(self.book_file_id))
+        if self.regenerate or not os.path.exists(html_file):
+            start = time.time()
+            self.logger.info('Generating HTML file {0}...'.format(html_file))
+            self.resource_data = {}
+            self.rc_references = {}
+            self.verse_to_chunk = {}
+            self.populate_tn_book_data()
+            self.populate_tw_words_data()
+            self.populate_chapters_and_verses()
+            self.populate_verse_usfm()
+            self.populate_chunks_text()
+            with open(os.path.join(self.my_path, '../common_files/template.html')) as template_file:
+                html_template = string.Template(template_file.read())
+            html = html_template.safe_substitute(title='{0} - {1} - v{2}'.format(self.title, self.book_title,
+                                                                                 self.version))
+            self.soup = BeautifulSoup(html, 'html.parser')
+            self.soup.html.head.title.string = self.title
+            self.soup.html.head.append(
+                BeautifulSoup('<link href="html/tn_style.css" rel="stylesheet"/>', 'html.parser'))
+            self.get_cover()
+            self.get_license()
+            self.get_body_html()
+            self.download_all_images()
+
+            write_file(os.path.join(self.output_dir, '{0}_not_prettified.html'.format(self.book_file_id)),
+                       str(self.soup))
+            write_file(os.path.join(self.output_dir, '{0}_soup_prettified.html'.format(self.book_file_id)),
+                       self.soup.prettify())
+            prettierfied_html = prettierfier.prettify_html(self.soup.prettify())
+            write_file(os.path.join(self.output_dir, '{0}_prettierfier_prettified.html'.format(self.book_file_id)),
+                       prettierfied_html)
+
+            write_file(html_file, str(self.soup))
+
+            self.save_resource_data()
+            self.save_bad_links()
+            self.logger.info('Generated HTML file.')
+            timing['html'] = time.time() - start
+        else:
+            self.logger.info('HTML file {0} already there. Not generating. Use -r to force regeneration.'.
+                             format(html_file))
+
+        if self.regenerate or not os.path.exists(pdf_file):
+            start = time.time()
+            self.logger.info('Generating PDF file {0}...'.format(pdf_file))
+            weasy = HTML(filename=html_file, base_url='file://{0}/'.format(self.output_dir))
+            weasy.write_pdf(pdf_file)
+            self.logger.info('Generated PDF file.')
+            link_file = os.path.join(self.output_dir, '{0}_tn_{1}_{2}-{3}.pdf'.
+                                     format(self.lang_code, self.tn_tag, self.book_number.zfill(2),
+                                            self.book_id.upper()))
+            subprocess.call('ln -sf "{0}" "{1}"'.format(pdf_file, link_file), shell=True)
+            self.logger.info('PDF file located at {0}'.format(pdf_file))
+            timing['pdf'] = time.time() - start
+        else:
+            self.logger.info(
+                'PDF file {0} already there. Not generating. Use -r to force regeneration.'.format(pdf_file))
+        return timing
+
+    def log_timings(self, timings, seconds):
+        self.logger.info('Generated {0} book(s) in {1:.1f}s with {2} job(s):'.format(len(timings), seconds,
+                                                                                   self.jobs))
+        for timing in timings:
+            self.logger.info('  {0}: HTML {1:.1f}s, PDF {2:.1f}s'.format(timing['book'], timing['html'],
+                                                                         timing['pdf']))
+
+    def populate_article_html(self):
+        """
+        Renders every tA and tW article from markdown in parallel, once for all the book worker processes. Books
+        generated in this process render only the articles they link to, with get_article_html()
+        """
+        article_files = sorted(glob(os.path.join(self.ta_dir, '*', '*', '01.md')) +
+                               glob(os.path.join(self.tw_dir, 'bible', '*', '*.md')))
+        self.logger.info('Rendering {0} tA and tW articles...'.format(len(article_files)))
+        with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+            article_html = list(executor.map(markdown2.markdown_path, article_files, chunksize=ARTICLES_PER_TASK))
+        self.article_html = dict(zip(article_files, article_html))
+
+    def get_article_html(self, article_file):
+        if article_file not in self.article_html:
+            self.article_html[article_file] = markdown2.markdown_path(article_file)
+        return self.article_html[article_file]
 
     def get_cover(self):
         cover_html = '''
@@ -421,16 +499,17 @@ class TnConverter(object):
                             self.logger.error('{0} not in verse_usfm!!!'.format(resource))
                             self.logger.error(self.verse_usfm)
                             exit(1)
-                        if chapter not in self.verse_usfm[resource]:
+                        if chapter not in self.verse_usfm[resource].chapters:
                             self.logger.error('Chapter {0} not in {1}!!!'.format(chapter, resource))
                             exit(1)
-                        if verse not in self.verse_usfm[resource][chapter]:
+                        verse_usfm = self.verse_usfm[resource].get_verse_usfm2(chapter, verse)
+                        if verse_usfm is None:
                             self.logger.error('{0}:{1} not in {2}!!!'.format(chapter, verse, resource))
                             if len(verses_in_chunk) or resource != self.ult_id:
-                                self.verse_usfm[resource][chapter][verse] = ''
+                                verse_usfm = ''
                             else:
                                 exit(1)
-                        verses_in_chunk.append(self.verse_usfm[resource][chapter][verse])
+                        verses_in_chunk.append(verse_usfm)
                     chunk_usfm = '\n'.join(verses_in_chunk)
                     if resource not in chunks_text[str(chapter)][str(first_verse)]:
                         chunks_text[str(chapter)][str(first_verse)][resource] = {}
@@ -487,6 +566,11 @@ class TnConverter(object):
         write_file(save_file, self.bad_links)
         save_file = os.path.join(save_dir, '{0}_bad_notes.json'.format(self.book_file_id))
         write_file(save_file, self.bad_notes)
+
+    def save_generation_info(self):
+        save_dir = os.path.join(self.output_dir, 'save')
+        if not os.path.exists(save_dir):
+            os.makedirs(save_dir)
         save_file = os.path.join(save_dir, '{0}_generation_info.json'.format(self.file_id))
         write_file(save_file, self.generation_info)
 
@@ -648,42 +732,16 @@ class TnConverter(object):
         self.populate_verse_usfm_ust()
 
     def populate_verse_usfm_ust(self):
-        book_data = {}
-        book_file = os.path.join(self.ust_dir, '{0}-{1}.usfm'.format(self.book_number, self.book_id.upper()))
-        usfm3 = read_file(book_file)
-        usfm2 = usfm3_to_usfm2(usfm3)
-        chapters = usfm2.split(r'\c ')
-        for chapter_usfm in chapters[1:]:
-            chapter = int(re.findall('(\d+)', chapter_usfm)[0])
-            book_data[chapter] = {}
-            chapter_usfm = r'\c '+chapter_usfm
-            verses = chapter_usfm.split(r'\v ')
-            for verseUsfm in verses[1:]:
-                verse = int(re.findall('(\d+)', verseUsfm)[0])
-                verseUsfm = r'\v '+verseUsfm
-                if re.match(r'^\\v \d+\s*$', verseUsfm, flags=re.MULTILINE):
-                    verseUsfm = ''
-                book_data[chapter][verse] = verseUsfm
-        self.verse_usfm[self.ust_id] = book_data
+        self.populate_verse_usfm_for_resource(self.ust_id, self.ust_dir)
 
     def populate_verse_usfm_ult(self):
-        bookData = {}
-        book_file = os.path.join(self.ult_dir, '{0}-{1}.usfm'.format(self.book_number, self.book_id.upper()))
+        self.populate_verse_usfm_for_resource(self.ult_id, self.ult_dir)
+
+    def populate_verse_usfm_for_resource(self, resource_id, resource_dir):
+        book_file = os.path.join(resource_dir, '{0}-{1}.usfm'.format(self.book_number, self.book_id.upper()))
         usfm3 = read_file(book_file)
-        usfm2 = usfm3_to_usfm2(usfm3)
-        chapters = usfm2.split(r'\c ')
-        for chapterUsfm in chapters[1:]:
-            chapter = int(re.findall('(\d+)', chapterUsfm)[0])
-            bookData[chapter] = {}
-            chapterUsfm = r'\c '+chapterUsfm
-            verses = chapterUsfm.split(r'\v ')
-            for verseUsfm in verses[1:]:
-                verse = int(re.findall('(\d+)', verseUsfm)[0])
-                verseUsfm = r'\v '+verseUsfm
-                if re.match(r'^\\v \d+\s*$', verseUsfm, flags=re.MULTILINE):
-                    verseUsfm = ''
-                bookData[chapter][verse] = verseUsfm
-        self.verse_usfm[self.ult_id] = bookData
+        # Chapters are converted to USFM 2 only when one of their verses is looked up with get_verse_usfm2()
+        self.verse_usfm[resource_id] = get_usfm_book_index(usfm3)
 
     def populate_chapters_and_verses(self):
         versification_file = os.path.join(self.versification_dir, '{0}.json'.format(self.book_id))
@@ -1301,7 +1359,7 @@ class TnConverter(object):
                         self.bad_links[source_rc] = {}
                     self.bad_links[source_rc][rc] = fix
                 if not rc in self.resource_data:
-                    t = markdown2.markdown_path(file_path)
+                    t = self.get_article_html(file_path)
                     alt_title = ''
                     if resource == 'ta':
                         title_file = os.path.join(os.path.dirname(file_path), 'title.md')
@@ -1494,7 +1552,7 @@ class TnConverter(object):
 
 
 def main(ta_tag, tn_tag, tw_tag, ust_tag, ult_tag, ust_id, ult_id, tn_id,
-         lang_codes, books, working_dir, output_dir, owner, regenerate, regenerate_all):
+         lang_codes, books, working_dir, output_dir, owner, regenerate, regenerate_all, jobs=DEFAULT_JOBS):
     lang_codes = lang_codes
     if not lang_codes:
         lang_codes = [DEFAULT_LANG]
@@ -1519,7 +1577,8 @@ def main(ta_tag, tn_tag, tw_tag, ust_tag, ult_tag, ust_id, ult_id, tn_id,
     for lang_code in lang_codes:
         logger.info('Starting TN Converter for {0}...'.format(lang_code))
         tn_converter = TnConverter(ta_tag, tn_tag, tw_tag, ust_tag, ult_tag, ust_id, ult_id, tn_id,
-                                   working_dir, output_dir, lang_code, books, owner, regenerate, regenerate_all, logger)
+                                   working_dir, output_dir, lang_code, books, owner, regenerate, regenerate_all, logger,
+                                   jobs)
         tn_converter.run()
 
 
@@ -1542,7 +1601,9 @@ if __name__ == '__main__':
                         help='Regenerate even if exists')
     parser.add_argument('--regenerate-all', dest='regenerate_all', default=False, action='store_true',
                         help='Regenerate all things even scripture html even if exists')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=DEFAULT_JOBS, required=False,
+                        help='Number of books to generate at the same time')
     args = parser.parse_args(sys.argv[1:])
     main(args.ta, args.tn, args.tw, args.ust, args.ult, args.ust_id, args.ult_id, args.tn_id,
          args.lang_codes, args.books, args.working_dir, args.output_dir, args.owner, args.regenerate,
-         args.regenerate_all)
+         args.regenerate_all, args.jobs)
@@ -1,7 +1,7 @@
 import logging
 
 from .books import loadBooks, silNames
-from .parseUsfm import parseString
+from .parseUsfm import iterTokens
 
 
 
@@ -30,7 +30,7 @@ class AbstractRenderer:
             bookName = self.renderBook # This gives an AttributeError for USFM
             if bookName in self.booksUsfm:
                 self.writeLog('     (' + bookName + ')')
-                tokens = parseString(self.booksUsfm[bookName])
+                tokens = iterTokens(self.booksUsfm[bookName])
                 for t in tokens:
                     try:
                         t.renderOn(self)
@@ -42,7 +42,7 @@ class AbstractRenderer:
                 if bookName in self.booksUsfm:
                     # logging.debug(f"AbstractRenderer.run() converting {bookName}…")
                     self.writeLog('     (' + bookName + ')')
-                    tokens = parseString(self.booksUsfm[bookName])
+                    tokens = iterTokens(self.booksUsfm[bookName])
                     for t in tokens:
                         try:
                             t.renderOn(self)
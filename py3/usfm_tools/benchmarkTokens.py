@@ -0,0 +1,118 @@
+# benchmarkTokens.py
+
+# Measures the time and memory the USFM linter spends per token.
+# Tokenizes and verifies every book given, or a generated New Testament if none is given, e.g.
+#   python -m py3.usfm_tools.benchmarkTokens
+#   python -m py3.usfm_tools.benchmarkTokens path/to/en_ult
+
+import time
+import random
+import argparse
+import tracemalloc
+
+from . import parseUsfm, usfm_verses, verifyUSFM
+
+
+NT_BOOKS = ('MAT', 'MRK', 'LUK', 'JHN', 'ACT', 'ROM', '1CO', '2CO', 'GAL', 'EPH', 'PHP', 'COL', '1TH', '2TH',
+            '1TI', '2TI', 'TIT', 'PHM', 'HEB', 'JAS', '1PE', '2PE', '1JN', '2JN', '3JN', 'JUD', 'REV')
+
+WORDS = ('and', 'the', 'of', 'to', 'he', 'said', 'them', 'for', 'God', 'in', 'was', 'that', 'with', 'people',
+         'Jesus', 'his', 'disciples', 'because', 'they', 'heard', 'spoke', 'went', 'into', 'city', 'Lord')
+
+
+def generateBook(book_code, seed=0):
+    """
+    Returns a book of the same shape as a translated USFM 2 book: one verse per line, with section headings,
+        paragraphs, poetry, footnotes and character markers in about the proportions of the ULT.
+    :param book_code: book to generate, with the chapters and verses given in usfm_verses
+    :param seed:
+    :return: USFM text
+    """
+    rand = random.Random(f"{book_code}{seed}")
+    name = usfm_verses.verses[book_code]['en_name']
+    lines = [f"\\id {book_code} EN_ULT en_English_ltr", "\\usfm 3.0", "\\ide UTF-8", f"\\h {name}",
+             f"\\toc1 The Book of {name}", f"\\toc2 {name}", f"\\toc3 {book_code.title()}", f"\\mt {name}", ""]
+    for chapter, nVerses in enumerate(usfm_verses.verses[book_code]['verses'], 1):
+        lines += [f"\\c {chapter}", "\\p"]
+        for verse in range(1, nVerses + 1):
+            if rand.random() < 0.05:
+                lines += ["\\s5", "\\p"]
+            text = ' '.join(rand.choice(WORDS) for i in range(rand.randint(8, 30)))
+            if rand.random() < 0.1:
+                text += f" \\wj {' '.join(rand.choice(WORDS) for i in range(6))}\\wj*"
+            if rand.random() < 0.05:
+                text += f" \\add {rand.choice(WORDS)}\\add*"
+            if rand.random() < 0.08:
+                text += f"\\f + \\fr {chapter}:{verse} \\ft Some versions read {rand.choice(WORDS)}.\\f*"
+            if rand.random() < 0.05:
+                lines += ["\\q1", f"\\v {verse} {text}", f"\\q2 {' '.join(rand.choice(WORDS) for i in range(8))}"]
+            else:
+                lines.append(f"\\v {verse} {text}.")
+        lines.append("")
+    return '\n'.join(lines)
+
+
+def readBooks(sources):
+    """
+    :param sources: USFM files or folders containing them
+    :return: list of (book code, USFM text)
+    """
+    books = []
+    for source in sources:
+        for path in verifyUSFM.findUsfmFiles(source):
+            with open(path, 'rt', encoding='utf-8-sig') as input:
+                books.append((verifyUSFM.bookCodeForFile(path), input.read()))
+    return books
+
+
+def timeBest(function, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(books, repeat=3):
+    """
+    :param books: list of (book code, USFM text)
+    :param repeat: each timing is the best of this many runs
+    :return: dictionary of measurements
+    """
+    cleaned = [parseUsfm.clean(text) for book_code, text in books]
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tokens = [parseUsfm.tokenize(text) for text in cleaned]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = after.compare_to(before, 'filename')
+    nTokens = sum(len(bookTokens) for bookTokens in tokens)
+    retained = sum(stat.size_diff for stat in stats)
+    blocks = sum(stat.count_diff for stat in stats)
+    del tokens
+
+    tokenizeTime = timeBest(lambda: [parseUsfm.tokenize(text) for text in cleaned], repeat)
+    verifyTime = timeBest(lambda: [verifyUSFM.verify_contents_quiet(text, book_code, book_code, None)
+                                   for book_code, text in books], repeat)
+    return {
+        'books': len(books),
+        'tokens': nTokens,
+        'retained bytes per token': retained / nTokens,
+        'retained blocks per token': blocks / nTokens,
+        'tokenize us per token': tokenizeTime * 1e6 / nTokens,
+        'verify us per token': verifyTime * 1e6 / nTokens,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measures the USFM tokenizer and verifier per token.")
+    parser.add_argument('sources', nargs='*', help="USFM files or folders containing them (default: a generated NT)")
+    parser.add_argument('-r', '--repeat', type=int, default=3, help="Best of this many runs of each timing")
+    args = parser.parse_args()
+
+    books = readBooks(args.sources) if args.sources else [(book_code, generateBook(book_code)) for book_code in NT_BOOKS]
+    for name, value in run(books, args.repeat).items():
+        print(f"{name}: {value:.2f}" if isinstance(value, float) else f"{name}: {value}")
@@ -2,11 +2,13 @@
 This version of parseUsfm.py appears to be used by verifyUSFM.py
     i.e., used by the USFM linter.
 """
+import io
+import re
 import sys
 import logging
 
 from pyparsing import Word, OneOrMore, nums, Literal, White, Group, \
-        Suppress, NoMatch, Optional, CharsNotIn, MatchFirst
+        Suppress, NoMatch, Optional, CharsNotIn, MatchFirst, ParseException
 
 
 __logger = logging.getLogger('usfm_tools')
@@ -335,6 +337,53 @@ usfm    = OneOrMore(element)
 #         sys.exit()
 #     return [createToken(t) for t in tokens]
 
+# Set to True to fall back to the (much slower) pyparsing grammar above
+USE_PYPARSING = False
+
+# Approximate number of characters iterTokens() tokenizes at a time
+CHUNK_SIZE = 65536
+
+
+# The hand-written tokenizer below looks markers up in these tables instead of
+#   trying each alternative of `element` in turn.
+# They must be kept in step with `element` (and with tokenClasses).
+valueMarkers = ('id', 'ide', 'usfm', 'h', 'toc', 'toc1', 'toc2', 'toc3',
+                'mt', 'mt1', 'mt2', 'mt3', 'ms', 'ms1', 'ms2', 'mr', 'd',
+                's', 's1', 's2', 's3', 's4', 's5', 'sr', 'sts', 'r', 'cl',
+                'fr', 'fk', 'ft', 'fq', 'fqa', 'fqb', 'fv', 'fdc', 'xo', 'xt',
+                'sp', 'is', 'is1', 'imt', 'imt1', 'imt2', 'imt3', 'rem')
+plusMarkers = ('f', 'fe', 'x')
+numberMarkers = ('c', 'v')
+plainMarkers = ('p', 'pc', 'pi', 'pi1', 'pi2', 'mi', 'b', 'ca', 'va',
+                'q', 'q1', 'q2', 'q3', 'q4', 'qa', 'qac', 'qc', 'qm', 'qm1', 'qm2', 'qm3', 'qr',
+                'qs', 'qt', 'nb', 'm', 'fp', 'xdc', 'it', 'wj', 'nd', 'bd', 'bdit',
+                'li', 'li1', 'li2', 'li3', 'li4', 'add', 'tl', 'is2', 'is3',
+                'ip', 'im', 'imi', 'iot', 'io1', 'io', 'io2', 'ior', 'ie', 'bk', 'sc',
+                'tr', 'th1', 'th2', 'th3', 'th4', 'th5', 'th6', 'thr1', 'thr2', 'thr3', 'thr4', 'thr5', 'thr6',
+                'tc1', 'tc2', 'tc3', 'tc4', 'tc5', 'tc6', 'tcr1', 'tcr2', 'tcr3', 'tcr4', 'tcr5', 'tcr6')
+endMarkers = ('ca*', 'va*', 'qs*', 'qt*', 'fr*', 'ft*', 'fq*', 'fqa*', 'f*', 'fe*', 'fv*', 'fdc*',
+              'xdc*', 'xt*', 'x*', 'it*', 'wj*', 'nd*', 'bd*', 'bdit*', 'add*', 'tl*', 'ior*', 'bk*', 'sc*')
+
+# pyparsing's default whitespace is ' \t\r\n', so that is what we skip between tokens.
+# White() (as used after a marker) also quietly skips other unicode spaces (pyparsing 3)
+#   before it insists on one of ' \t\r\n', hence the leading [other_white]* below.
+other_white = '\x0c\xa0\u1680\u180e\u2000-\u200b\u202f\u205f\u3000'
+token_re   = re.compile(r'[ \t\r\n]*(?:\\([^ \t\r\n\\*' + other_white + r']*)(\*?)|([^ \t\r\n\\][^\n\\]*))')
+white_re   = re.compile('[' + other_white + r']*[ \t\r\n]+')
+value_re   = re.compile('[' + other_white + r']*[ \t\r\n]+([^\n\\]*)')
+plus_re    = re.compile('[' + other_white + r']*[ \t\r\n]+(\+?)')
+number_re  = re.compile('[' + other_white + r']*[ \t\r\n]+([0-9()-]+)[' + other_white + r']*[ \t\r\n]+')
+unknown_re = re.compile(r'[^ \n\t\\]+')
+line_break_re = re.compile(r'\r\n?|\n')  # as splitlines() counts them
+
+# marker -> regex for whatever must follow it
+markerPatterns = dict([(marker, value_re) for marker in valueMarkers]
+                      + [(marker, plus_re) for marker in plusMarkers]
+                      + [(marker, number_re) for marker in numberMarkers]
+                      + [(marker, white_re) for marker in plainMarkers])
+endMarkerSet = frozenset(endMarkers)
+
+
 def parseString(unicodeString):
     """
     version of parseString for use in libraries
@@ -342,10 +391,184 @@ def parseString(unicodeString):
     :return:
     """
     cleaned = clean(unicodeString)
+    if USE_PYPARSING:
+        return parsePyparsing(cleaned)
+    return tokenize(cleaned)
+
+
+def parsePyparsing(cleaned):
+    """
+    Original pyparsing version of the tokenizer, kept for comparison
+    :param cleaned: USFM text that has been through clean()
+    :return: list of UsfmTokens
+    """
     tokens = usfm.parseString(cleaned, parseAll=True)
     return [createToken(t) for t in tokens]
 
 
+def iterTokens(source, chunkSize=CHUNK_SIZE):
+    """
+    Generator version of parseString() which yields the same tokens, but only ever
+        holds about chunkSize characters' worth of them, so a whole Bible can be processed.
+    :param source: USFM text, or a file object opened in text mode
+    :param chunkSize:
+    :return: generator of UsfmTokens
+    """
+    lines = io.StringIO(source, newline='') if isinstance(source, str) else source
+    found = False
+    line = 1
+    for chunk in readChunks(lines, chunkSize):
+        cleaned = clean(chunk)
+        if USE_PYPARSING:
+            tokens = parsePyparsing(cleaned) if cleaned.strip(' \t\r\n') else []
+        else:
+            tokens = scanTokens(cleaned, line)
+        for token in tokens:
+            found = True
+            yield token
+        line += countLineBreaks(chunk, 0, len(chunk))
+    if not found:
+        raise ParseException('', 0, 'Expected USFM token')
+
+
+def readChunks(lines, chunkSize):
+    """
+    Joins lines into chunks of at least chunkSize characters (except the last) that can be tokenized separately.
+    A chunk only ends before a line starting with a backslash: no token can span that break,
+        and tabs are still expanded the same way because the break is at the start of a line.
+    :param lines: iterable of lines, each including its line ending
+    :param chunkSize:
+    :return: generator of strings
+    """
+    chunk = []
+    length = 0
+    for line in lines:
+        if length >= chunkSize and line.startswith('\\'):
+            yield ''.join(chunk)
+            chunk = []
+            length = 0
+        chunk.append(line)
+        length += len(line)
+    if chunk:
+        yield ''.join(chunk)
+
+
+def tokenize(cleaned):
+    """
+    Single pass replacement for usfm.parseString() which gives the same tokens.
+    :param cleaned: USFM text that has been through clean()
+    :return: list of UsfmTokens
+    """
+    tokens = list(scanTokens(cleaned))
+    if not tokens:
+        raise ParseException(cleaned, 0, 'Expected USFM token')
+    return tokens
+
+
+def scanTokens(cleaned, line=1):
+    """
+    Does the work for tokenize() and iterTokens().
+    Relies on clean() having escaped every backslash that is followed by whitespace
+        or that ends the text, so a backslash always starts a marker or a '\\\\' pair.
+    :param cleaned: USFM text that has been through clean()
+    :param line: line number of the start of cleaned
+    :return: generator of UsfmTokens
+    """
+    # pyparsing does this to the input unless told not to
+    text = cleaned.expandtabs()
+    pos = 0
+    lineStart = 0  # position of the start of line number `line`
+    lineStarts = findLineStarts(text)
+    nextLine = next(lineStarts)  # position of the start of the line after that
+    while True:
+        match = token_re.match(text, pos)
+        if not match:
+            break  # nothing but whitespace left
+        pos = match.end()
+        marker, star, value = match.groups()
+        if value is not None:
+            start = match.start(3)
+            key = 'text'
+        else:
+            start = match.start(1) - 1  # the backslash
+            key, value, pos = readMarker(text, marker + star, start, pos)
+
+        while start >= nextLine:
+            line += 1
+            lineStart = nextLine
+            nextLine = next(lineStarts)
+        token = tokenClasses[key](value, line, start - lineStart, key)
+        yield token
+
+
+def findLineStarts(text):
+    """
+    Finds the lines of text as scanTokens() needs them, splitting on '\n' with str.find()
+        unless the text has a '\r' in it.
+    :param text:
+    :return: generator of the position of the start of each line after the first, then a position past the end
+    """
+    if '\r' in text:
+        for lineBreak in line_break_re.finditer(text):
+            yield lineBreak.end()
+    else:
+        pos = text.find('\n') + 1
+        while pos:
+            yield pos
+            pos = text.find('\n', pos) + 1
+    yield len(text) + 1
+
+
+def countLineBreaks(text, start, end):
+    """
+    Counts the line breaks in text[start:end] the way splitlines() does for '\r\n', '\r' and '\n',
+        so files with any of those line endings get the same line numbers.
+        Neither end may fall between the two characters of a '\r\n'.
+    :param text:
+    :param start:
+    :param end:
+    :return: number of line breaks
+    """
+    return text.count('\n', start, end) + text.count('\r', start, end) - text.count('\r\n', start, end)
+
+
+def readMarker(text, key, start, pos):
+    """
+    Works out which token the backslash at text[start] begins
+    :param text: cleaned and tab expanded USFM text
+    :param key: the marker name (and '*') following the backslash
+    :param start: position of the backslash
+    :param pos: position just after key
+    :return: (token type, value, position after the token)
+    """
+    value = ''
+    pattern = markerPatterns.get(key)
+    if pattern is not None:
+        following = pattern.match(text, pos)
+        if following:
+            pos = following.end()
+            if following.lastindex:
+                value = following.group(1)
+        else:
+            key = None  # e.g. '\\v' without a valid verse number
+    elif key in endMarkerSet:
+        pass
+    elif not key and text.startswith('\\\\', start):
+        key = '\\\\'
+        pos = start + 2
+    else:
+        key = None
+
+    if key is None:
+        following = unknown_re.match(text, start + 1)
+        if not following:
+            raise ParseException(text, start, 'Expected USFM marker')
+        key = 'unknown'
+        value = following.group()
+        pos = following.end()
+    return key, value, pos
+
+
 def clean(unicodeString):
     # We need to clean the input a bit. For a start, until
     # we work out what to do, non breaking spaces will be ignored
@@ -368,179 +591,29 @@ def clean(unicodeString):
 
 
 def createToken(t):
-    options = {
-        'id':   IDToken,
-        'ide':  IDEToken,
-        'usfm': USFMVersionToken,
-        'h':    HToken,
-
-        'mt':   MTToken,
-        'mt1':  MT1Token,
-        'mt2':  MT2Token,
-        'mt3':  MT3Token,
-
-        'ms':   MSToken,
-        'ms1':  MS1Token,
-        'ms2':  MS2Token,
-
-        'mr':   MRToken,
-        'p':    PToken,
-        'pc':   PCToken,
-
-        'pi':   PIToken,
-        'pi1':  PI1Token,
-        'pi2':  PI2Token,
-
-        'b':    BToken,
-
-        's':    SToken,
-        's1':   S1Token,
-        's2':   S2Token,
-        's3':   S3Token,
-        's4':   S4Token,
-
-        's5':   S5Token,
-
-        'sr':   SRToken,
-        'sts':  STSToken,
-        'mi':   MIToken,
-        'r':    RToken,
-        'c':    CToken,
-        'ca':   CAStartToken, 'ca*':  CAEndToken,
-        'cl':   CLToken,
-        'v':    VToken,
-        'va':   VAStartToken, 'va*':  VAEndToken,
-
-        'q':    QToken,
-        'q1':   Q1Token,
-        'q2':   Q2Token,
-        'q3':   Q3Token,
-        'q4':   Q4Token,
-
-        'qa':   QAToken,
-        'qac':  QACToken,
-        'qc':   QCToken,
-        'qm':   QMToken,
-        'qm1':  QM1Token,
-        'qm2':  QM2Token,
-        'qm3':  QM3Token,
-        'qr':   QRToken,
-        'qs':   QSStartToken,
-        'qs*':  QSEndToken,
-        'qt':   QTStartToken,
-        'qt*':  QTEndToken,
-        'nb':   NBToken,
-        'f':    FStartToken,
-        'fe':   FEStartToken,  # Footnote intended as an end note
-        'fr':   FRToken, 'fr*':  FREndToken,
-        'fk':   FKToken,
-        'ft':   FTToken, 'ft*':  FTEndToken,
-        'fq':   FQToken, 'fq*':  FQEndToken,
-        'fqa':  FQAToken, 'fqa*': FQAEndToken,
-        'fqb':  FQAEndToken,
-        'f*':   FEndToken,
-        'fe*':  FEEndToken,
-        'fv':   FVStartToken, 'fv*':  FVEndToken,
-        'fdc':  FDCStartToken, 'fdc*': FDCEndToken,
-        'fp':   FPToken,
-        'x':    XStartToken,
-        'xdc':  XDCStartToken, 'xdc*': XDCEndToken,
-        'xo':   XOToken,
-        'xt':   XTToken, 'xt*': XTEndToken,
-        'x*':   XEndToken,
-        'it':   ITStartToken, 'it*':  ITEndToken,
-        'bd':   BDStartToken, 'bd*':  BDEndToken,
-        'bdit': BDITStartToken, 'bdit*': BDITEndToken,
-
-        'li':   LIToken,
-        'li1':  LI1Token,
-        'li2':  LI2Token,
-        'li3':  LI3Token,
-        'li4':  LI4Token,
-
-        'd':    DToken,
-        'sp':   SPToken,
-        # 'i*':   IEndToken,
-        'add':  ADDStartToken, 'add*': ADDEndToken,
-        'nd':   NDStartToken, 'nd*':  NDEndToken,
-        'sc':   SCStartToken, 'sc*':  SCEndToken,
-        'wj':   WJStartToken, 'wj*':  WJEndToken,
-        'm':    MToken,
-        'tl':   TLStartToken, 'tl*':  TLEndToken,
-        '\\\\': EscapedToken,
-        'rem':  REMToken,
-
-        'tr':   TRToken,
-        'th1':  TH1Token,
-        'th2':  TH2Token,
-        'th3':  TH3Token,
-        'th4':  TH4Token,
-        'th5':  TH5Token,
-        'th6':  TH6Token,
-        'thr1': THR1Token,
-        'thr2': THR2Token,
-        'thr3': THR3Token,
-        'thr4': THR4Token,
-        'thr5': THR5Token,
-        'thr6': THR6Token,
-        'tc1':  TC1Token,
-        'tc2':  TC2Token,
-        'tc3':  TC3Token,
-        'tc4':  TC4Token,
-        'tc5':  TC5Token,
-        'tc6':  TC6Token,
-        'tcr1': TCR1Token,
-        'tcr2': TCR2Token,
-        'tcr3': TCR3Token,
-        'tcr4': TCR4Token,
-        'tcr5': TCR5Token,
-        'tcr6': TCR6Token,
-
-        'toc1': TOC1Token,
-        'toc2': TOC2Token,
-        'toc3': TOC3Token,
-
-        'is':   ISToken,
-        'is1':  IS1Token,
-        'is2':  IS2Token,
-        'is3':  IS3Token,
-
-        'imt':  IMTToken,
-        'imt1': IMT1Token,
-        'imt2': IMT2Token,
-        'imt3': IMT3Token,
-
-        'ie':   IEToken,
-        'ip':   IPToken,
-        'ipi':  IPIToken,
-        'im':   IMToken,
-        'imi':  IMIToken,
-        'iot':  IOTToken,
-        'io':   IOToken,
-        'io1':  IO1Token,
-        'io2':  IO2Token,
-        'ior':  IORStartToken, 'ior*': IOREndToken,
-        'bk':   BKStartToken, 'bk*':  BKEndToken,
-        'text': TEXTToken,
-        'unknown': UnknownToken
-    }
-    for k, v in options.items():
-        if t[0] == k:
-            if len(t) == 1:
-                token = v()
-            else:
-                token = v(t[1])
-            token.type = k
-            return token
-    raise Exception(t[0])
+    tokenClass = tokenClasses.get(t[0])
+    if tokenClass is None:
+        raise Exception(t[0])
+    if len(t) == 1:
+        token = tokenClass()
+    else:
+        token = tokenClass(t[1])
+    token.type = t[0]
+    return token
 
 
 
 # noinspection PyMethodMayBeStatic
 class UsfmToken:
-    def __init__(self, value=''):
+    # Every subclass sets __slots__ = () too, so tokens carry no per-instance __dict__
+    __slots__ = ('value', 'type', 'line', 'column')
+    kind = None  # small integer identifying the subclass, set at the end of this module
+
+    def __init__(self, value='', line=None, column=None, type=None):
         self.value = value
-        self.type = None
+        self.type = type
+        self.line = line  # 1-based line number, as found by scanTokens()
+        self.column = column  # 0-based column within the cleaned line
 
     def getType(self):  return self.type
     def getValue(self): return self.value
@@ -705,11 +778,13 @@ class UsfmToken:
 
 
 class UnknownToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderUnknown(self)
     def isUnknown(self):     return True
 
 
 class EscapedToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer):
         self.value = '\\'
         return printer.renderText(self)
@@ -717,609 +792,978 @@ class EscapedToken(UsfmToken):
 
 
 class IDToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderID(self)
     def isID(self):     return True
 class IDEToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderIDE(self)
     def isIDE(self):    return True
 
 class USFMVersionToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderUSFMV(self)
     def isUSFM(self):    return True
 
 class HToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderH(self)
     def isH(self):      return True
 
 class TOC1Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderTOC1(self)
     def isTOC1(self):     return True
 class TOC2Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderTOC2(self)
     def isTOC2(self):     return True
 class TOC3Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderTOC3(self)
     def isTOC3(self):     return True
 
 class MTToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderMT(self)
     def isMT(self):     return True
 class MT1Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderMT1(self)
     def isMT1(self):     return True
 class MT2Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderMT2(self)
     def isMT2(self):     return True
 class MT3Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderMT3(self)
     def isMT3(self):    return True
 
 class MSToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderMS(self)
     def isMS(self):     return True
 class MS1Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderMS1(self)
     def isMS1(self):     return True
 class MS2Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderMS2(self)
     def isMS2(self):    return True
 
 class MRToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderMR(self)
     def isMR(self):    return True
 
 class MIToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderMI(self)
     def isMI(self):     return True
 
 class RToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderR(self)
     def isR(self):    return True
 
 class PToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderP(self)
     def isP(self):      return True
 
 class BToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderB(self)
     def isB(self):      return True
 
 class CToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderC(self)
     def isC(self):      return True
 
 class CAStartToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderCA_S(self)
     def isCAS(self):    return True
 class CAEndToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderCA_E(self)
     def isCAE(self):    return True
 
 class CLToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderCL(self)
     def isCL(self):     return True
 
 class VToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderV(self)
     def isV(self):      return True
 
 class VAStartToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderVA_S(self)
     def isVAS(self):    return True
 class VAEndToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderVA_E(self)
     def isVAE(self):    return True
 
 class TEXTToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderText(self)
     def isTEXT(self):   return True
 
 class WJStartToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderWJ_S(self)
     def isWJS(self):    return True
 class WJEndToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderWJ_E(self)
     def isWJE(self):    return True
 
 class SToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderS(self)
     def isS(self):      return True
 class S1Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderS1(self)
     def isS(self):      return True
 class S2Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderS2(self)
     def isS2(self):      return True
 class S3Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderS3(self)
     def isS3(self):      return True
 class S4Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderS4(self)
     def isS4(self):      return True
 
 class S5Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderS5(self)
     def isS5(self):      return True
 
 class SRToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderSR(self)
     def isSR(self):    return True
 
 class STSToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderSTS(self)
     def isSTS(self):    return True
 
 class QToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderQ(self)
     def isQ(self):      return True
 
 class Q1Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderQ1(self)
     def isQ1(self):      return True
 
 class Q2Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderQ2(self)
     def isQ2(self):      return True
 
 class Q3Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderQ3(self)
     def isQ3(self):      return True
 
 class Q4Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderQ4(self)
     def isQ4(self):      return True
 
 class QAToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderQA(self)
     def isQA(self):      return True
 
 class QACToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderQAC(self)
     def isQAC(self):     return True
 
 class QCToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderQC(self)
     def isQC(self):      return True
 
 class QMToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderQM(self)
     def isQM(self):      return True
 
 class QM1Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderQM1(self)
     def isQM1(self):     return True
 
 class QM2Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderQM2(self)
     def isQM2(self):     return True
 
 class QM3Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderQM3(self)
     def isQM3(self):     return True
 
 class QRToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderQR(self)
     def isQR(self):      return True
 
 class QSStartToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderQS_S(self)
     def isQSS(self):     return True
 
 class QSEndToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderQS_E(self)
     def isQSE(self):     return True
 
 class QTStartToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderQT_S(self)
     def isQTS(self):     return True
 
 class QTEndToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderQT_E(self)
     def isQTE(self):     return True
 
 class NBToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderNB(self)
     def isNB(self):      return True
 
 class FStartToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderF_S(self)
     def isF_S(self):      return True
 
 class FEStartToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderFE_S(self)
     def isFE_S(self):      return True
 
 class FRToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderFR(self)
     def isFR(self):      return True
 class FREndToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderFR_E(self)
     def isFR_E(self):      return True
 
 class FKToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderFK(self)
     def isFK(self):      return True
 
 class FTToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderFT(self)
     def isFT(self):      return True
 class FTEndToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderFT_E(self)
     def isFT_E(self):      return True
 
 class FQToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderFQ(self)
     def isFQ(self):      return True
 class FQEndToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderFQ_E(self)
     def isFQ_E(self):      return True
 
 class FQAToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderFQA(self)
     def isFQA(self):     return True
 class FQAEndToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderFQA_E(self)
     def isFQA_E(self):    return True
 
 class FQBToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderFQA_E(self)
     def isFQB(self):     return True
 
 class FEndToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderF_E(self)
     def isF_E(self):      return True
 
 class FEEndToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderFE_E(self)
     def isFE_E(self):      return True
 
 class FVStartToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderFV_S(self)
     def isFVS(self):      return True
 
 class FVEndToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderFV_E(self)
     def isFVE(self):      return True
 
 class FDCStartToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderFDC_S(self)
     def isFDCS(self):      return True
 
 class FDCEndToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderFDC_E(self)
     def isFDCE(self):      return True
 
 class FPToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderFP(self)
     def isFP(self):      return True
 
 class ITStartToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderIT_S(self)
     def isIS(self):      return True
 
 class ITEndToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderIT_E(self)
     def isIE(self):      return True
 
 class BDStartToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderBD_S(self)
     def isBDS(self):      return True
 
 class BDEndToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderBD_E(self)
     def isBDE(self):      return True
 
 class BDITStartToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderBDIT_S(self)
     def isBDITS(self):     return True
 
 class BDITEndToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderBDIT_E(self)
     def isBDITE(self):      return True
 
 class LIToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderLI(self)
     def isLI(self):      return True
 
 class LI1Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderLI1(self)
     def isLI1(self):     return True
 
 class LI2Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderLI2(self)
     def isLI1(self):     return True
 
 class LI3Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderLI3(self)
     def isLI1(self):     return True
 
 class LI4Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderLI4(self)
     def isLI1(self):     return True
 
 class DToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderD(self)
     def isD(self):      return True
 
 class SPToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderSP(self)
     def isSP(self):      return True
 
 class ADDStartToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderADD_S(self)
     def isADDS(self):    return True
 
 class ADDEndToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderADD_E(self)
     def isADDE(self):    return True
 
 class NDStartToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderND_S(self)
     def isNDS(self):    return True
 
 class NDEndToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderND_E(self)
     def isNDE(self):    return True
 
 class PBRToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderPBR(self)
     def isPBR(self):    return True
 
 
 # Cross References
 class XStartToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderX_S(self)
     def isX_S(self):      return True
 
 class XDCStartToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderXDC_S(self)
     def isXDCS(self):      return True
 
 class XDCEndToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderXDC_E(self)
     def isXDCE(self):      return True
 
 class XOToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderXO(self)
     def isXO(self):      return True
 
 class XTToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderXT(self)
     def isXT(self):      return True
 
 class XTSToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderXT_S(self)
     def isXTS(self):      return True
 
 class XTEndToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderXT_E(self)
     def isXTE(self):      return True
 
 class XEndToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderX_E(self)
     def isX_E(self):      return True
 
 class MToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderM(self)
     def isM(self):      return True
 
 # Transliterated Words
 class TLStartToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderTL_S(self)
     def isTLS(self):      return True
 
 class TLEndToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderTL_E(self)
     def isTLE(self):      return True
 
 # Formatted paragraphs, like pc, pi, etc.
 class PCToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderPC(self)
     def isPC(self):      return True
 
 # Indenting paragraphs
 class PIToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderPI(self)
     def isPI(self):      return True
 class PI1Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderPI1(self)
     def isPI1(self):      return True
 class PI2Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderPI2(self)
     def isPI2(self): return True
 
 # Small caps
 class SCStartToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderSC_S(self)
     def isSCS(self):      return True
 
 class SCEndToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderSC_E(self)
     def isSCE(self):      return True
 
 # REMarks
 class REMToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer):  return printer.renderREM(self)
     def isREM(self):              return True
 
 # Tables
 class TRToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderTR(self)
     def isTR(self):     return True
 
 class TH1Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderTH1(self)
     def isTH1(self):    return True
 
 class TH2Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderTH2(self)
     def isTH2(self):    return True
 
 class TH3Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderTH3(self)
     def isTH3(self):    return True
 
 class TH4Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderTH4(self)
     def isTH4(self):    return True
 
 class TH5Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderTH5(self)
     def isTH5(self):    return True
 
 class TH6Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderTH6(self)
     def isTH6(self):    return True
 
 class THR1Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderTHR1(self)
     def isTHR1(self):   return True
 
 class THR2Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderTHR2(self)
     def isTHR2(self):   return True
 
 class THR3Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderTHR3(self)
     def isTHR3(self):   return True
 
 class THR4Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderTHR4(self)
     def isTHR4(self):   return True
 
 class THR5Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderTHR5(self)
     def isTHR5(self):   return True
 
 class THR6Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderTHR6(self)
     def isTHR6(self):   return True
 
 class TC1Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderTC1(self)
     def isTC1(self):    return True
 
 class TC2Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderTC2(self)
     def isTC2(self):    return True
 
 class TC3Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderTC3(self)
     def isTC3(self):    return True
 
 class TC4Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderTC4(self)
     def isTC4(self):    return True
 
 class TC5Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderTC5(self)
     def isTC5(self):    return True
 
 class TC6Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderTC6(self)
     def isTC6(self):    return True
 
 class TCR1Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderTCR1(self)
     def isTCR1(self):   return True
 
 class TCR2Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderTCR2(self)
     def isTCR2(self):   return True
 
 class TCR3Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderTCR3(self)
     def isTCR3(self):   return True
 
 class TCR4Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderTCR4(self)
     def isTCR4(self):   return True
 
 class TCR5Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderTCR5(self)
     def isTCR5(self):   return True
 
 class TCR6Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.renderTCR6(self)
     def isTCR6(self):   return True
 
 # Introductions
 class ISToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer):  return printer.render_is(self)
     def is_is1(self):             return True
 
 class IS1Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer):  return printer.render_is1(self)
     def is_is1(self):             return True
 
 class IS2Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer):  return printer.render_is2(self)
     def is_is3(self):             return True
 
 class IS3Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer):  return printer.render_is3(self)
     def is_is3(self):             return True
 
 class IMTToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.render_imt(self)
     def is_imt(self): return True
 class IMT1Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.render_imt1(self)
     def is_imt1(self): return True
 class IMT2Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.render_imt2(self)
     def is_imt2(self): return True
 class IMT3Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer): return printer.render_imt3(self)
     def is_imt3(self): return True
 
 class IEToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer):  return printer.render_ie(self)
     def is_ie(self):              return True
 
 class IPToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer):  return printer.render_ip(self)
     def is_ip(self):              return True
 
 class IPIToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer):  return printer.render_ipi(self)
     def is_ipi(self):              return True
 
 class IMToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer):  return printer.render_im(self)
     def is_im(self):              return True
 
 class IMIToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer):  return printer.render_imi(self)
     def is_imi(self):              return True
 
 class IOTToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer):  return printer.render_iot(self)
     def is_iot(self):             return True
 
 class IOToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer):  return printer.render_io(self)
     def is_io(self):             return True
 class IO1Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer):  return printer.render_io1(self)
     def is_io1(self):             return True
 class IO2Token(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer):  return printer.render_io2(self)
     def is_io2(self):             return True
 
 class IORStartToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer):  return printer.render_ior_s(self)
     def is_ior_s(self):           return True
 
 class IOREndToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer):  return printer.render_ior_e(self)
     def is_ior_e(self):           return True
 
 # Quoted book title
 class BKStartToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer):  return printer.render_bk_s(self)
     def is_bk_s(self):            return True
 
 class BKEndToken(UsfmToken):
+    __slots__ = ()
     def renderOn(self, printer):  return printer.render_bk_e(self)
     def is_bk_e(self):            return True
+
+
+# Maps the marker (or pseudo-marker, e.g. "text") of a parsed element to its token class
+tokenClasses = {
+    'id':   IDToken,
+    'ide':  IDEToken,
+    'usfm': USFMVersionToken,
+    'h':    HToken,
+
+    'mt':   MTToken,
+    'mt1':  MT1Token,
+    'mt2':  MT2Token,
+    'mt3':  MT3Token,
+
+    'ms':   MSToken,
+    'ms1':  MS1Token,
+    'ms2':  MS2Token,
+
+    'mr':   MRToken,
+    'p':    PToken,
+    'pc':   PCToken,
+
+    'pi':   PIToken,
+    'pi1':  PI1Token,
+    'pi2':  PI2Token,
+
+    'b':    BToken,
+
+    's':    SToken,
+    's1':   S1Token,
+    's2':   S2Token,
+    's3':   S3Token,
+    's4':   S4Token,
+
+    's5':   S5Token,
+
+    'sr':   SRToken,
+    'sts':  STSToken,
+    'mi':   MIToken,
+    'r':    RToken,
+    'c':    CToken,
+    'ca':   CAStartToken, 'ca*':  CAEndToken,
+    'cl':   CLToken,
+    'v':    VToken,
+    'va':   VAStartToken, 'va*':  VAEndToken,
+
+    'q':    QToken,
+    'q1':   Q1Token,
+    'q2':   Q2Token,
+    'q3':   Q3Token,
+    'q4':   Q4Token,
+
+    'qa':   QAToken,
+    'qac':  QACToken,
+    'qc':   QCToken,
+    'qm':   QMToken,
+    'qm1':  QM1Token,
+    'qm2':  QM2Token,
+    'qm3':  QM3Token,
+    'qr':   QRToken,
+    'qs':   QSStartToken,
+    'qs*':  QSEndToken,
+    'qt':   QTStartToken,
+    'qt*':  QTEndToken,
+    'nb':   NBToken,
+    'f':    FStartToken,
+    'fe':   FEStartToken,  # Footnote intended as an end note
+    'fr':   FRToken, 'fr*':  FREndToken,
+    'fk':   FKToken,
+    'ft':   FTToken, 'ft*':  FTEndToken,
+    'fq':   FQToken, 'fq*':  FQEndToken,
+    'fqa':  FQAToken, 'fqa*': FQAEndToken,
+    'fqb':  FQAEndToken,
+    'f*':   FEndToken,
+    'fe*':  FEEndToken,
+    'fv':   FVStartToken, 'fv*':  FVEndToken,
+    'fdc':  FDCStartToken, 'fdc*': FDCEndToken,
+    'fp':   FPToken,
+    'x':    XStartToken,
+    'xdc':  XDCStartToken, 'xdc*': XDCEndToken,
+    'xo':   XOToken,
+    'xt':   XTToken, 'xt*': XTEndToken,
+    'x*':   XEndToken,
+    'it':   ITStartToken, 'it*':  ITEndToken,
+    'bd':   BDStartToken, 'bd*':  BDEndToken,
+    'bdit': BDITStartToken, 'bdit*': BDITEndToken,
+
+    'li':   LIToken,
+    'li1':  LI1Token,
+    'li2':  LI2Token,
+    'li3':  LI3Token,
+    'li4':  LI4Token,
+
+    'd':    DToken,
+    'sp':   SPToken,
+    # 'i*':   IEndToken,
+    'add':  ADDStartToken, 'add*': ADDEndToken,
+    'nd':   NDStartToken, 'nd*':  NDEndToken,
+    'sc':   SCStartToken, 'sc*':  SCEndToken,
+    'wj':   WJStartToken, 'wj*':  WJEndToken,
+    'm':    MToken,
+    'tl':   TLStartToken, 'tl*':  TLEndToken,
+    '\\\\': EscapedToken,
+    'rem':  REMToken,
+
+    'tr':   TRToken,
+    'th1':  TH1Token,
+    'th2':  TH2Token,
+    'th3':  TH3Token,
+    'th4':  TH4Token,
+    'th5':  TH5Token,
+    'th6':  TH6Token,
+    'thr1': THR1Token,
+    'thr2': THR2Token,
+    'thr3': THR3Token,
+    'thr4': THR4Token,
+    'thr5': THR5Token,
+    'thr6': THR6Token,
+    'tc1':  TC1Token,
+    'tc2':  TC2Token,
+    'tc3':  TC3Token,
+    'tc4':  TC4Token,
+    'tc5':  TC5Token,
+    'tc6':  TC6Token,
+    'tcr1': TCR1Token,
+    'tcr2': TCR2Token,
+    'tcr3': TCR3Token,
+    'tcr4': TCR4Token,
+    'tcr5': TCR5Token,
+    'tcr6': TCR6Token,
+
+    'toc1': TOC1Token,
+    'toc2': TOC2Token,
+    'toc3': TOC3Token,
+
+    'is':   ISToken,
+    'is1':  IS1Token,
+    'is2':  IS2Token,
+    'is3':  IS3Token,
+
+    'imt':  IMTToken,
+    'imt1': IMT1Token,
+    'imt2': IMT2Token,
+    'imt3': IMT3Token,
+
+    'ie':   IEToken,
+    'ip':   IPToken,
+    'ipi':  IPIToken,
+    'im':   IMToken,
+    'imi':  IMIToken,
+    'iot':  IOTToken,
+    'io':   IOToken,
+    'io1':  IO1Token,
+    'io2':  IO2Token,
+    'ior':  IORStartToken, 'ior*': IOREndToken,
+    'bk':   BKStartToken, 'bk*':  BKEndToken,
+    'text': TEXTToken,
+    'unknown': UnknownToken,
+}
+
+# Every token class, indexed by its kind, so callers can dispatch with a list lookup
+#   instead of a chain of isXxx() calls (see verifyUSFM.take())
+tokenKinds = tuple(UsfmToken.__subclasses__())
+for kind, tokenClass in enumerate(tokenKinds):
+    tokenClass.kind = kind
+
+
+def compareParsers(unicodeString):
+    """
+    Tokenizes the same text with the pyparsing grammar and with tokenize()
+    :param unicodeString:
+    :return: (number of tokens, index of first differing token or -1, pyparsing seconds, tokenize seconds)
+    """
+    import time
+
+    cleaned = clean(unicodeString)
+    start = time.perf_counter()
+    old_tokens = parsePyparsing(cleaned)
+    middle = time.perf_counter()
+    new_tokens = tokenize(cleaned)
+    finish = time.perf_counter()
+
+    old_keys = [(t.__class__, t.type, t.value) for t in old_tokens]
+    new_keys = [(t.__class__, t.type, t.value) for t in new_tokens]
+    mismatch = -1
+    if old_keys != new_keys:
+        mismatch = next((i for i, (a, b) in enumerate(zip(old_keys, new_keys)) if a != b),
+                        min(len(old_keys), len(new_keys)))
+    return len(old_keys), mismatch, middle - start, finish - middle
+
+
+if __name__ == "__main__":
+    # Checks that tokenize() gives the same tokens as the pyparsing grammar, e.g.
+    #   python parseUsfm.py path/to/en_ult
+    import os
+
+    paths = []
+    for source in sys.argv[1:]:
+        if os.path.isdir(source):
+            for dirpath, dirnames, filenames in os.walk(source):
+                paths += [os.path.join(dirpath, f) for f in sorted(filenames) if f.lower().endswith('sfm')]
+        else:
+            paths.append(source)
+
+    failures = 0
+    for path in paths:
+        with open(path, 'r', encoding='utf-8-sig') as f:
+            count, mismatch, old_time, new_time = compareParsers(f.read())
+        if mismatch >= 0:
+            failures += 1
+        print(f"{os.path.basename(path)}: {count} tokens, pyparsing {old_time:.3f}s, tokenize {new_time:.3f}s"
+              f" ({old_time / max(new_time, 1e-9):.0f}x)" + (f" MISMATCH at token {mismatch}" if mismatch >= 0 else ''))
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,87 @@
+# test_parseUsfm.py
+
+# Checks that the single pass tokenizer gives the same tokens as the pyparsing grammar it replaced, e.g.
+#   python -m unittest py3.usfm_tools.test_parseUsfm
+
+import unittest
+
+from pyparsing import ParseException
+
+from . import parseUsfm
+
+
+SAMPLES = {
+    'headers and paragraphs': (
+        "\\id ROM EN_ULT en_English_ltr\n\\usfm 3.0\n\\ide UTF-8\n\\h Romans\n\\toc1 The Letter of Paul to the Romans\n"
+        "\\toc2 Romans\n\\toc3 Rom\n\\mt Romans\n\n\\c 1\n\\p\n\\v 1 Paul, a servant of \\nd Christ\\nd* Jesus,\n"
+        "\\v 2 which he promised beforehand.\n\\s5\n\\q1 \\v 3 about his Son,\n\\q2 who was born\n"
+    ),
+    'footnotes and cross references': (
+        "\\c 1\n\\p\n\\v 1 a\\f + \\fr 1:1 \\ft Some versions read \\fqa other words\\fqa* here.\\f* b\n"
+        "\\v 2 c\\x - \\xo 1:2 \\xt Gen 1:1\\x* d\n\\v 3 \\fe + \\ft an endnote\\fe*\n"
+    ),
+    'aligned USFM 3': (
+        "\\c 1\n\\p\n\\v 1 \\zaln-s |x-strong=\"G39720\" x-lemma=\"Παῦλος\" x-occurrence=\"1\"\\*"
+        "\\w Paul|x-occurrence=\"1\" x-occurrences=\"1\"\\w*\\zaln-e\\*,\n"
+        "\\k-s | x-tw=\"rc://*/tw/dict/bible/kt/god\"\\*\\w God\\w*\\k-e\\*\n\\ts\\*\n"
+        "\\qt-s |who=\"Paul\"\\*\\+w nested\\+w*\\qt-e\\*\n"
+    ),
+    'character markers': (
+        "\\c 3\n\\pi2 \\li1 \\li \\m \\nb \\b \\d A psalm \\sp Speaker \\ca 2\\ca* \\va 3\\va* \\bk Book\\bk*\n"
+        "\\wj Jesus said\\wj* \\add x\\add* \\tl y\\tl* \\sc s\\sc* \\it i\\it* \\bd b\\bd* \\em e\\em*\n"
+    ),
+    'malformed markers': (
+        "\\c\n\\v\n\\v 1text\n\\p\\v 2 x\n\\zz unknown\\zz* \\nd* stray end marker\n\\v 3 \\\\ escaped\n"
+        "\\v 4 ends with a backslash\\"
+    ),
+    'verse numbers and other scripts': (
+        "\\c 2\n\\p\n\\v 1 «Ἰησοῦς» — ইন্ডিয়া 日本\n\\v 2-3 a verse range\n\\v 4a part of a verse\n\\v 5 \tafter a tab\n"
+    ),
+}
+
+LINE_ENDINGS = {'LF': '\n', 'CRLF': '\r\n', 'CR': '\r'}
+
+
+def tokenPositions(tokens):
+    return [(token.__class__, token.type, token.line, token.column) for token in tokens]
+
+
+def tokenKeys(tokens):
+    return [(token.__class__, token.type, token.value, token.line, token.column) for token in tokens]
+
+
+class TestTokenize(unittest.TestCase):
+
+    def test_same_tokens_as_pyparsing(self):
+        for name, text in SAMPLES.items():
+            for ending_name, ending in LINE_ENDINGS.items():
+                with self.subTest(sample=name, line_ending=ending_name):
+                    count, mismatch, _, _ = parseUsfm.compareParsers(text.replace('\n', ending))
+                    self.assertGreater(count, 0)
+                    self.assertEqual(mismatch, -1)
+
+    def test_line_endings_give_same_positions(self):
+        for name, text in SAMPLES.items():
+            expected = tokenPositions(parseUsfm.tokenize(parseUsfm.clean(text)))
+            for ending_name, ending in LINE_ENDINGS.items():
+                with self.subTest(sample=name, line_ending=ending_name):
+                    tokens = parseUsfm.tokenize(parseUsfm.clean(text.replace('\n', ending)))
+                    self.assertEqual(tokenPositions(tokens), expected)
+
+    def test_chunks_give_same_tokens(self):
+        for name, text in SAMPLES.items():
+            for ending_name, ending in LINE_ENDINGS.items():
+                with self.subTest(sample=name, line_ending=ending_name):
+                    source = text.replace('\n', ending)
+                    expected = tokenKeys(parseUsfm.tokenize(parseUsfm.clean(source)))
+                    self.assertEqual(tokenKeys(parseUsfm.iterTokens(source, chunkSize=16)), expected)
+
+    def test_no_tokens(self):
+        for text in ('', ' \n\t\r\n'):
+            with self.subTest(text=text):
+                self.assertRaises(ParseException, parseUsfm.tokenize, parseUsfm.clean(text))
+                self.assertRaises(ParseException, parseUsfm.parsePyparsing, parseUsfm.clean(text))
+
+
+if __name__ == '__main__':
+    unittest.main()
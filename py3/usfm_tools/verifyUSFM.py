@@ -4,17 +4,20 @@
 # Uses parseUsfm module.
 # Place this script in the USFM-Tools folder.
 
+import os
 import re
 import sys
+import json
+import hashlib
 import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 
-from . import parseUsfm, usfm_verses
+from . import books, parseUsfm, usfm_verses
 
 
 # Global variables
-lastToken = None
 vv_re = re.compile(r'([0-9]+)-([0-9]+)')
-error_log = None
 
 chapter_marker_re = re.compile(r'\\c(?!a)') # Don't match on \ca
 verse_marker_re = re.compile(r'\\v(?!a)') # Don't match on \va
@@ -25,134 +28,120 @@ NON_CHAPTER_BOOK_CODES = ('FRT','BAK','OTH','INT','CNC','GLO','TDX','NDX')
 
 
 class State:
-    IDs = []
-    ID = ''
-    IDE = ''
-    usfm = ''
-    toc1 = ''
-    toc2 = ''
-    toc3 = ''
-    mt = ''
-    heading = ''
-    master_chapter_label = ''
-    chapter_label = ''
-    chapter = 0
-    nParagraphs = 0
-    nMargin = 0
-    nQuotes = 0
-    verse = 0
-    lastVerse = 0
-    needVerseText = False
-    textOkayHere = False
-    referenceString = ''
-    lastReferenceString = ''
-    chapters = set()
+    """
+    Everything the verifier knows about the book it is checking.
+    Each verification gets its own State, so books can be checked concurrently.
+    """
+    englishWords = []   # caches shared by all instances; they never change once loaded
     verseCounts = {}
-    errorRefs = set()
-    englishWords = []
-    lang_code = None
-    book_code = None
+
+    def __init__(self):
+        self.lang_code = None
+        self.error_log = None
+        self.lastToken = None
+        self.lastChapter = 0
+        self.reset_all()
 
     def reset_all(self):
         self.reset_book()
-        State.IDs = []
-        State.errorRefs = set()
+        self.IDs = []
+        self.errorRefs = set()
 
     def reset_book(self):
-        State.ID = ''
-        State.IDE = ''
-        State.usfm = ''
-        State.toc1 = ''
-        State.toc2 = ''
-        State.toc3 = ''
-        State.mt = ''
-        State.heading = ''
-        State.master_chapter_label = ''
-        State.chapter_label = ''
-        State.chapter = 0
-        State.lastVerse = 0
-        State.verse = 0
-        State.needVerseText = False
-        State.textOkayHere = False
-        State.chapters = set()
-        State.nParagraphs = 0
-        State.nMargin = 0
-        State.nQuotes = 0
-        State.lastReferenceString = ''
-        State.referenceString = ''
-        State.book_code = None
+        self.ID = ''
+        self.IDE = ''
+        self.usfm = ''
+        self.toc1 = ''
+        self.toc2 = ''
+        self.toc3 = ''
+        self.mt = ''
+        self.heading = ''
+        self.master_chapter_label = ''
+        self.chapter_label = ''
+        self.chapter = 0
+        self.lastVerse = 0
+        self.verse = 0
+        self.needVerseText = False
+        self.textOkayHere = False
+        self.chapters = set()
+        self.nParagraphs = 0
+        self.nMargin = 0
+        self.nQuotes = 0
+        self.lastReferenceString = ''
+        self.referenceString = ''
+        self.book_code = None
 
     def set_book_code(self, book):
-        State.book_code = book
-        State.referenceString = book  # default
+        self.book_code = book
+        self.referenceString = book  # default
 
     def setLanguageCode(self, code):
-        State.lang_code = code
+        self.lang_code = code
 
     def addID(self, id):
         self.reset_book()
-        State.IDs.append(id)
-        State.ID = id
-        State.lastReferenceString = State.referenceString
-        State.referenceString = id
+        self.IDs.append(id)
+        self.ID = id
+        self.lastReferenceString = self.referenceString
+        self.referenceString = id
 
     def getIDs(self):
-        return State.IDs
+        return self.IDs
 
     def addHeading(self, heading):
-        State.heading = heading
+        self.heading = heading
 
     def addIDE(self, ide):
-        State.IDE = ide
+        self.IDE = ide
 
     def addUSFM(self, usfm):
-        State.usfm = usfm
+        self.usfm = usfm
 
     def addTOC1(self, toc):
-        State.toc1 = toc
+        self.toc1 = toc
 
     def addTOC2(self, toc):
-        State.toc2 = toc
+        self.toc2 = toc
 
     def addTOC3(self, toc):
-        State.toc3 = toc
+        self.toc3 = toc
 
     def addMT(self, mt):
-        State.mt = mt
+        self.mt = mt
 
     def addChapterLabel(self, text):
-        if State.chapter == 0:
-            State.master_chapter_label = text
+        if self.chapter == 0:
+            self.master_chapter_label = text
         else:
-            State.chapter_label = text
+            self.chapter_label = text
 
     def addChapter(self, c):
-        State.lastChapter = State.chapter
-        State.chapter = int(c)
-        State.chapters.add(State.chapter)
-        State.lastVerse = 0
-        State.nParagraphs = 0
-        State.nMargin = 0
-        State.nQuotes = 0
-        State.verse = 0
-        State.needVerseText = False
-        State.textOkayHere = False
-        State.lastReferenceString = State.referenceString
-        State.referenceString = self.get_id() + ' ' + str(State.chapter)
+        self.lastChapter = self.chapter
+        self.chapter = int(c)
+        self.chapters.add(self.chapter)
+        self.lastVerse = 0
+        self.nParagraphs = 0
+        self.nMargin = 0
+        self.nQuotes = 0
+        self.verse = 0
+        self.needVerseText = False
+        self.textOkayHere = False
+        self.lastReferenceString = self.referenceString
+        self.referenceString = self.get_id() + ' ' + str(self.chapter)
 
     def get_id(self):
-        id = State.ID
-        if not State.ID:
-            id = State.book_code  # use book code if no ID given
+        id = self.ID
+        if not self.ID:
+            id = self.book_code  # use book code if no ID given
         return id
 
     def addParagraph(self):
-        State.nParagraphs += 1
-        State.textOkayHere = True
+        self.nParagraphs += 1
+        self.textOkayHere = True
 
     def addMargin(self):
-        State.nMargin += State.nMargin + 1
-        State.textOkayHere = True
+        self.nMargin += self.nMargin + 1
+        self.textOkayHere = True
 
     # supports a span of verses, e.g. 3-4, if needed. Passes the verse(s) on to addVerse()
     def addVerses(self, vv):
@@ -171,33 +160,33 @@ class State:
             self.addVerse(str(vn))
 
     def addVerse(self, v):
-        State.lastVerse = State.verse
-        State.verse = int(v)
-        State.needVerseText = True
-        State.textOkayHere = True
-        State.lastReferenceString = State.referenceString
-        State.referenceString = self.get_id() + ' ' + str(State.chapter) + ':' + v
+        self.lastVerse = self.verse
+        self.verse = int(v)
+        self.needVerseText = True
+        self.textOkayHere = True
+        self.lastReferenceString = self.referenceString
+        self.referenceString = self.get_id() + ' ' + str(self.chapter) + ':' + v
 
     def textOkay(self):
-        return State.textOkayHere
+        return self.textOkayHere
 
     def needText(self):
-        return State.needVerseText
+        return self.needVerseText
 
     def addText(self):
-        State.needVerseText = False
-        State.textOkayHere = True
+        self.needVerseText = False
+        self.textOkayHere = True
 
     def addQuote(self):
-        State.nQuotes += State.nQuotes + 1
-        State.textOkayHere = True
+        self.nQuotes += self.nQuotes + 1
+        self.textOkayHere = True
 
     # Adds the specified reference to the set of error references
     # Returns True if reference can be added
     # Returns False if reference was previously added
     def addError(self, ref):
         success = False
-        if ref not in State.errorRefs:
+        if ref not in self.errorRefs:
             self.errorRefs.add(ref)
             success = True
         return success
@@ -205,14 +194,16 @@ class State:
 
     def getEnglishWords(self):
         if not State.englishWords:
+            englishWords = []
             for book in usfm_verses.verses:
                 book_data = usfm_verses.verses[book]
                 english_name = book_data['en_name'].lower()
                 english_words = english_name.split(' ')
                 for word in english_words:
                     if word and not isNumber(word):
-                        State.englishWords.append(word)
-            State.englishWords.sort()
+                        englishWords.append(word)
+            englishWords.sort()
+            State.englishWords = englishWords
         return State.englishWords
 
 
@@ -243,15 +234,14 @@ class State:
 
 
 
-def report_error(msg):
-    if error_log is None:  # if error logging is enabled then don't print
+def report_error(state, msg):
+    if state.error_log is None:  # if error logging is enabled then don't print
         sys.stderr.write(msg)
     else:
-        error_log.append(msg.rstrip(' \t\n\r'))
+        state.error_log.append(msg.rstrip(' \t\n\r'))
 
 
-def verifyVerseCount():
-    state = State()
+def verifyVerseCount(state):
     if not state.ID:
         return -1
 
@@ -259,44 +249,42 @@ def verifyVerseCount():
         # Revelation 12 may have 17 or 18 verses
         # 3 John may have 14 or 15 verses
         if state.referenceString != 'REV 12:18' and state.referenceString != '3JN 1:15':
-            report_error(f"{state.referenceString} - Should have {state.nVerses(state.ID, state.chapter)} verses\n")
+            report_error(state, f"{state.referenceString} - Should have {state.nVerses(state.ID, state.chapter)} verses\n")
 
 
-def verifyNotEmpty(filename, book_code):
-    state = State()
+def verifyNotEmpty(state, filename, book_code):
     if not state.ID \
     or (state.chapter==0 and book_code not in NON_CHAPTER_BOOK_CODES):
-        report_error(f"{filename} - File may be empty.")
+        report_error(state, f"{filename} - File may be empty.")
 
 
-def verifyIdentification(book_code):
-    state = State()
+def verifyIdentification(state, book_code):
     if not state.ID:
-        report_error(f"{book_code} - Missing \\id tag")
+        report_error(state, f"{book_code} - Missing \\id tag")
     elif (book_code is not None) and (book_code != state.ID):
-        report_error(f"{state.ID} - Found in \\id tag does not match code '{book_code}' found in filename")
+        report_error(state, f"{state.ID} - Found in \\id tag does not match code '{book_code}' found in filename")
 
     if not state.IDE:
-        report_error(f"{book_code} - Missing \\ide tag")
+        report_error(state, f"{book_code} - Missing \\ide tag")
 
     if state.heading:
         if state.heading.isupper():
-            report_error(f"{book_code} - \\h '{state.heading}' shouldn't be UPPERCASE")
+            report_error(state, f"{book_code} - \\h '{state.heading}' shouldn't be UPPERCASE")
     else:
-        report_error(f"{book_code} - Missing \\h tag")
+        report_error(state, f"{book_code} - Missing \\h tag")
 
     if not state.toc1:
-        report_error(f"{book_code} - Missing \\toc1 tag")
+        report_error(state, f"{book_code} - Missing \\toc1 tag")
 
     if not state.toc2:
-        report_error(f"{book_code} - Missing \\toc2 tag")
+        report_error(state, f"{book_code} - Missing \\toc2 tag")
 
     if not state.toc3:
-        report_error(f"{book_code} - Missing \\toc3 tag")
+        report_error(state, f"{book_code} - Missing \\toc3 tag")
 
     if not state.mt:
         if book_code not in NON_CHAPTER_BOOK_CODES:
-            report_error(f"{book_code} - Missing \\mt or \\mt1 tag")
+            report_error(state, f"{book_code} - Missing \\mt or \\mt1 tag")
 # end of verifyIdentification function
 
 
@@ -308,7 +296,7 @@ def make_reference_string(book, chapter, verse=None):
 # end of make_reference_string function
 
 
-def verifyChapterAndVerseMarkers(text, book):
+def verifyChapterAndVerseMarkers(state, text, book):
     pos = 0
     last_ch = 1
     for chapter_current in chapter_marker_re.finditer(text):
@@ -322,30 +310,30 @@ def verifyChapterAndVerseMarkers(text, book):
             end_index += 1
         previous_char = text[start_index - 1]
         newline_before = (previous_char == '\n') or (previous_char == '\r')
-        ch_num, has_space_after = get_chapter_number(text, end_index)
+        ch_num, has_space_after = get_chapter_number(state, text, end_index)
         if ch_num >= 0:
             if not has_space:
-                add_error(text, book, "Missing space before chapter number: '{0}'", start_index, last_ch)
+                add_error(state, text, book, "Missing space before chapter number: '{0}'", start_index, last_ch)
             elif not has_space_after:
-                add_error(text, book, "Missing new line after chapter number: '{0}'", start_index, last_ch)
+                add_error(state, text, book, "Missing new line after chapter number: '{0}'", start_index, last_ch)
             elif not newline_before:
-                add_error(text, book, "Missing new line before chapter marker: '{0}'", start_index-4, last_ch)
-            check_chapter(text, book, last_ch, pos, start_index)
+                add_error(state, text, book, "Missing new line before chapter marker: '{0}'", start_index-4, last_ch)
+            check_chapter(state, text, book, last_ch, pos, start_index)
             last_ch = ch_num
             pos = end_index
         else:
-            add_error(text, book, "Invalid chapter number format: '{0}'", start_index, last_ch)
+            add_error(state, text, book, "Invalid chapter number format: '{0}'", start_index, last_ch)
 
-    check_chapter(text, book, last_ch, pos, len(text))  # check last chapter
+    check_chapter(state, text, book, last_ch, pos, len(text))  # check last chapter
 
 
-def add_error(text, book, message, pos, chapter, verse=None):
+def add_error(state, text, book, message, pos, chapter, verse=None):
     length = 8
     example = text[pos: pos + length]
-    report_error(make_reference_string(book, chapter, verse) + " - " + message.format(example))
+    report_error(state, make_reference_string(book, chapter, verse) + " - " + message.format(example))
 
 
-def check_chapter(text, book, chapter_num, start, end):
+def check_chapter(state, text, book, chapter_num, start, end):
     last_vs_range = '1'
     for verse_current in verse_marker_re.finditer(text, start, end):
         start = verse_current.start()
@@ -356,26 +344,26 @@ def check_chapter(text, book, chapter_num, start, end):
             end += 1
         char = text[start - 1]
         space_before = char in WHITE_SPACE
-        vs_range, has_space_after = get_verse_range(text, end)
+        vs_range, has_space_after = get_verse_range(state, text, end)
         if vs_range != '':
             if not has_space:
-                add_error(text, book, "Missing space before verse number: '{0}'", start, chapter_num, vs_range)
+                add_error(state, text, book, "Missing space before verse number: '{0}'", start, chapter_num, vs_range)
             elif not has_space_after:
-                add_error(text, book, "Missing space after verse number: '{0}'", start, chapter_num, vs_range)
+                add_error(state, text, book, "Missing space after verse number: '{0}'", start, chapter_num, vs_range)
             elif not space_before:
-                add_error(text, book, "Missing space before verse marker: '{0}'", start-1, chapter_num, vs_range)
+                add_error(state, text, book, "Missing space before verse marker: '{0}'", start-1, chapter_num, vs_range)
             last_vs_range = vs_range
         else:
             # print("book", book, "chapter", chapter_num, "verse_current", verse_current)
             # print(f"start='{start}' end='{end}'")
             # print(f"char='{char}'")
             # print(f"space_before={space_before} vs_range={vs_range} has_space_after={has_space_after}")
-            add_error(text, book, "Invalid verse number: '{0}'", start, chapter_num, last_vs_range)
+            add_error(state, text, book, "Invalid verse number: '{0}'", start, chapter_num, last_vs_range)
 
 
-def get_verse_range(text, start):
+def get_verse_range(state, text, start):
     pos = start
-    verse, c, end = get_number(text, pos)
+    verse, c, end = get_number(state, text, pos)
     if verse == '':
         return verse, False
 
@@ -383,7 +371,7 @@ def get_verse_range(text, start):
         has_white_space = (c in WHITE_SPACE)
         return verse, has_white_space
 
-    second_vs, c, end = get_number(text, end+1)
+    second_vs, c, end = get_number(state, text, end+1)
     if second_vs == '':
         return '', False
 
@@ -392,16 +380,16 @@ def get_verse_range(text, start):
     return verse, has_white_space
 
 
-def get_chapter_number(text, start):
+def get_chapter_number(state, text, start):
     pos = start
-    digits, c, _end = get_number(text, pos)
+    digits, c, _end = get_number(state, text, pos)
     has_white_space = (c in WHITE_SPACE)
     if digits:
         return int(digits), has_white_space
     return -1, has_white_space
 
 
-def get_number(text, start_index):
+def get_number(state, text, start_index):
     """
     Called by get_verse_range() and get_chapter_number()
     """
@@ -411,8 +399,7 @@ def get_number(text, start_index):
     for pos in range(start_index, len(text)):
         c = text[pos]
         if c=='0' and not digits:
-            state = State()
-            report_error(f"{state.referenceString} has leading zero in following chapter/verse number")
+            report_error(state, f"{state.referenceString} has leading zero in following chapter/verse number")
         if (c >= '0') and (c <= '9'):
             digits += c
             continue
@@ -420,24 +407,22 @@ def get_number(text, start_index):
         break
     return digits, c, end_index
 
-def verifyChapterCount():
-    state = State()
+def verifyChapterCount(state):
     if state.ID:
         expected_chapters = state.nChapters(state.ID)
         if len(state.chapters) != expected_chapters:
             for i in range(1, expected_chapters + 1):
                 if i not in state.chapters:
-                    report_error(f"{state.ID} {i} - Missing chapter\n")
+                    report_error(state, f"{state.ID} {i} - Missing chapter\n")
 
 
-def verifyTextTranslated(text, token):
-    found, word = needsTranslation(text)
+def verifyTextTranslated(state, text, token):
+    found, word = needsTranslation(state, text)
     if found:
-        report_error(f"Token '\\{token}' has possible untranslated word '{word}'")
+        report_error(state, f"Token '\\{token}' has possible untranslated word '{word}'")
 
 
-def needsTranslation(text):
-    state = State()
+def needsTranslation(state, text):
     if state.lang_code and state.lang_code[0:2]!='en':  # no need to translate english
         english = state.getEnglishWords()
         words = text.split(' ')
@@ -476,53 +461,44 @@ def isNumber(s):
     return False
 
 
-def takeCL(text):
-    state = State()
+def takeCL(state, text):
     state.addChapterLabel(text)
-    verifyTextTranslated(text, 'cl')
+    verifyTextTranslated(state, text, 'cl')
 
-def takeTOC1(text):
-    state = State()
+def takeTOC1(state, text):
     state.addTOC1(text)
-    verifyTextTranslated(text, 'toc1')
+    verifyTextTranslated(state, text, 'toc1')
 
-def takeTOC2(text):
-    state = State()
+def takeTOC2(state, text):
     state.addTOC2(text)
-    verifyTextTranslated(text, 'toc2')
+    verifyTextTranslated(state, text, 'toc2')
 
-def takeTOC3(text):
-    state = State()
+def takeTOC3(state, text):
     state.addTOC3(text)
-    # verifyTextTranslated(text, 'toc3') # toc3 commonly has 3-letter book code, not to be translated
+    # verifyTextTranslated(state, text, 'toc3') # toc3 commonly has 3-letter book code, not to be translated
 
-def takeMT(text):
-    state = State()
+def takeMT(state, text):
     state.addMT(text)
-    verifyTextTranslated(text, 'mt')
+    verifyTextTranslated(state, text, 'mt')
 
-def takeH(heading):
-    state = State()
+def takeH(state, heading):
     state.addHeading(heading)
-    verifyTextTranslated(heading, 'h')
+    verifyTextTranslated(state, heading, 'h')
 
-def takeIDE(ide):
-    state = State()
+def takeIDE(state, ide):
     state.addIDE(ide)
 
-def takeUSFM(usfm):
-    state = State()
+def takeUSFM(state, usfm):
     state.addUSFM(usfm)
 
 
-def takeID(id):
-    state = State()
+def takeID(state, id):
     code = '' if not id else id.split(' ')[0] # Take the first token in the \id field
     if len(code) < 3:
-        report_error(f"{state.referenceString} - Invalid ID: '{id}'\n")
+        report_error(state, f"{state.referenceString} - Invalid ID: '{id}'\n")
         return
     if code in state.getIDs():
-        report_error(f"{state.referenceString} - Duplicate ID: '{id}'\n")
+        report_error(state, f"{state.referenceString} - Duplicate ID: '{id}'\n")
         return
     if code in NON_CHAPTER_BOOK_CODES: # Books without chapters/verses
         state.addID(code)
@@ -532,50 +508,46 @@ def takeID(id):
         if k == code:
             state.addID(code)
             return
-    report_error(f"{state.referenceString} - Invalid Code '{code}' in ID: '{id}'\n")
+    report_error(state, f"{state.referenceString} - Invalid Code '{code}' in ID: '{id}'\n")
 
 
-def takeC(c):
-    state = State()
+def takeC(state, c):
     state.addChapter(c)
     if not state.IDs:
-        report_error(f"{state.referenceString} - Missing ID before chapter\n")
+        report_error(state, f"{state.referenceString} - Missing ID before chapter\n")
     if state.chapter < state.lastChapter:
-        report_error(f"{state.referenceString} - Chapter out of order\n")
+        report_error(state, f"{state.referenceString} - Chapter out of order\n")
     elif state.chapter == state.lastChapter:
-        report_error(f"{state.referenceString} - Duplicate chapter\n")
+        report_error(state, f"{state.referenceString} - Duplicate chapter\n")
     elif state.chapter > state.lastChapter + 2:
-        report_error(f"{state.lastReferenceString} - Missing chapters between this and: {state.referenceString}\n")
+        report_error(state, f"{state.lastReferenceString} - Missing chapters between this and: {state.referenceString}\n")
     elif state.chapter > state.lastChapter + 1:
-        report_error(f"{state.lastReferenceString} - Missing chapter between this and: {state.referenceString}\n")
+        report_error(state, f"{state.lastReferenceString} - Missing chapter between this and: {state.referenceString}\n")
 
 
-def takeP():
-    state = State()
+def takeP(state):
     state.addParagraph()
 
-def takeM():
-    state = State()
+def takeM(state):
     state.addMargin()
 
 
-def takeV(v):
-    state = State()
+def takeV(state, v):
     state.addVerses(v)
     if state.lastVerse == 0:  # if first verse in chapter
         if not state.IDs and state.chapter == 0:
-            report_error(f"{state.referenceString} {v} - Missing ID before verse\n")
+            report_error(state, f"{state.referenceString} {v} - Missing ID before verse\n")
         if state.chapter == 0:
-            report_error(f"{state.referenceString} - Missing chapter tag\n")
+            report_error(state, f"{state.referenceString} - Missing chapter tag\n")
         if (state.nParagraphs == 0) and (state.nQuotes == 0) and (state.nMargin == 0):
-            report_error(f"{state.referenceString} - Missing paragraph marker (\\p), margin (\\m) or quote (\\q) before verse text\n")
+            report_error(state, f"{state.referenceString} - Missing paragraph marker (\\p), margin (\\m) or quote (\\q) before verse text\n")
 
     missing = ""
     if state.verse < state.lastVerse and state.addError(state.lastReferenceString):
-        report_error(f"{state.referenceString} - Verse out of order: after {state.lastReferenceString}\n")
+        report_error(state, f"{state.referenceString} - Verse out of order: after {state.lastReferenceString}\n")
         state.addError(state.referenceString)
     elif state.verse == state.lastVerse:
-        report_error(f"{state.referenceString} - Duplicated verse\n")
+        report_error(state, f"{state.referenceString} - Duplicated verse\n")
     elif state.verse == state.lastVerse + 2 and not isOptional(state.referenceString):
         missing = " - Missing verse between this and: "
     elif state.verse > state.lastVerse + 2:
@@ -583,13 +555,13 @@ def takeV(v):
 
     if missing:
         state.addError(state.lastReferenceString)
-        if not error_log is None:  # see if already warned for missing verses
+        if not state.error_log is None:  # see if already warned for missing verses
             gaps = False
             for i in range(state.lastVerse+1, state.verse):
                 ref = f"{state.ID} {state.chapter}:{i}"
                 ref_len = len(ref)
                 verse_warning_found = False
-                for error in error_log:
+                for error in state.error_log:
                     if error[:ref_len] == ref:
                         verse_warning_found = True
                         break
@@ -598,23 +570,22 @@ def takeV(v):
             if not gaps:
                 return
 
-        report_error(state.lastReferenceString + missing + state.referenceString + '\n')
+        report_error(state, state.lastReferenceString + missing + state.referenceString + '\n')
 
 
-def takeText(t):
-    state = State()
-    global lastToken
-    if not state.textOkay() and not isTextCarryingToken(lastToken):
+def takeText(state, t):
+    lastToken = state.lastToken
+    if not state.textOkay() and not (lastToken is not None and textCarryingKinds[lastToken.kind]):
         if t[0] == '\\':
-            report_error(f"{state.referenceString} - Nearby uncommon or invalid marker\n")
+            report_error(state, f"{state.referenceString} - Nearby uncommon or invalid marker\n")
         else:
             # print "Missing verse marker before text: <" + t.encode('utf-8') + "> around " + state.reference
-            # report_error("Missing verse marker or extra text around " + state.referenceString + ": <" + t[0:10] + '>.\n')
-            report_error(f"{state.referenceString} - Missing verse marker or extra text nearby\n")
+            # report_error(state, "Missing verse marker or extra text around " + state.referenceString + ": <" + t[0:10] + '>.\n')
+            report_error(state, f"{state.referenceString} - Missing verse marker or extra text nearby\n")
         if lastToken:
-            report_error(f"{state.referenceString} - Preceding Token.type was '{lastToken.getType()}'\n")
+            report_error(state, f"{state.referenceString} - Preceding Token.type was '{lastToken.getType()}'\n")
         else:
-            report_error(f"{state.referenceString} - No preceding Token\n")
+            report_error(state, f"{state.referenceString} - No preceding Token\n")
     state.addText()
 
 
@@ -623,9 +594,9 @@ def takeUnknown(state, token):
     if (value == 'v') or (value == 'c'):
         return  # skip malformed chapter and verses - will be caught later
     elif value == 'p':
-        report_error(f"{state.referenceString} - Orphan paragraph marker follows")
+        report_error(state, f"{state.referenceString} - Orphan paragraph marker follows")
     else:
-        report_error(f"{state.referenceString} - Unknown USFM token: '\\{value}'")
+        report_error(state, f"{state.referenceString} - Unknown USFM token: '\\{value}'")
 
 
 # Returns True if token is part of a footnote
@@ -677,71 +648,243 @@ def isTextCarryingToken(token):
         or isCharacterFormatting(token) # RJH added this (for \wj fields, etc.)
 
 
-def take(token):
-    state = State()
-    if isFootnote(token):
-        state.addText()     # footnote suffices for verse text
-    if state.needText() and not token.isTEXT() and not isTextCarryingToken(token):
-        # print(f"EMPTY VERSE {state.referenceString}: {token}")
-        report_error(f"{state.referenceString} - Empty verse\n")
+def chooseTaker(token):
+    """
+    Returns the function that take() calls for this kind of token, or None
+    """
     if token.isID():
-        takeID(token.value)
+        return lambda state, token: takeID(state, token.value)
     elif token.isIDE():
-        takeIDE(token.value)
+        return lambda state, token: takeIDE(state, token.value)
     elif token.isUSFM():
-        takeUSFM(token.value)
+        return lambda state, token: takeUSFM(state, token.value)
     elif token.isH():
-        takeH(token.value)
+        return lambda state, token: takeH(state, token.value)
     elif token.isTOC1():
-        takeTOC1(token.value)
+        return lambda state, token: takeTOC1(state, token.value)
     elif token.isTOC2():
-        takeTOC2(token.value)
+        return lambda state, token: takeTOC2(state, token.value)
     elif token.isTOC3():
-        takeTOC3(token.value)
+        return lambda state, token: takeTOC3(state, token.value)
     elif token.isMT() or token.isMT1():
-        takeMT(token.value)
+        return lambda state, token: takeMT(state, token.value)
     elif token.isCL():
-        takeCL(token.value)
+        return lambda state, token: takeCL(state, token.value)
     elif token.isC():
-        verifyVerseCount()  # for the preceding chapter
-        takeC(token.value)
+        def takeChapter(state, token):
+            verifyVerseCount(state)  # for the preceding chapter
+            takeC(state, token.value)
+        return takeChapter
     elif token.isP() \
     or token.isPI() or token.isPI1() or token.isPI2() \
     or token.isPC() or token.isNB():
-        takeP()
+        return lambda state, token: takeP(state)
     elif token.isV():
-        takeV(token.value)
+        return lambda state, token: takeV(state, token.value)
     elif token.isTEXT():
-        takeText(token.value)
+        return lambda state, token: takeText(state, token.value)
     elif token.isQ() or token.isQ1() or token.isQ2() or token.isQ3():
-        state.addQuote()
+        return lambda state, token: state.addQuote()
     elif token.isM() or token.isMI():
-        state.addMargin()
+        return lambda state, token: state.addMargin()
     elif token.isUnknown():
-        takeUnknown(state, token)
-    global lastToken
-    lastToken = token
-# end of take(token) function
+        return takeUnknown
+    return None
+
+
+# What take() needs to know about each kind of token, indexed by token.kind.
+# Built once from the functions above, so take() does list lookups instead of
+#   running through dozens of isXxx() calls for every token.
+takers = [chooseTaker(tokenClass()) for tokenClass in parseUsfm.tokenKinds]
+footnoteKinds = [isFootnote(tokenClass()) for tokenClass in parseUsfm.tokenKinds]
+textCarryingKinds = [isTextCarryingToken(tokenClass()) for tokenClass in parseUsfm.tokenKinds]
+textKinds = [tokenClass().isTEXT() or textCarrying
+             for tokenClass, textCarrying in zip(parseUsfm.tokenKinds, textCarryingKinds)]
+
+
+def take(state, token):
+    kind = token.kind
+    if footnoteKinds[kind]:
+        state.addText()     # footnote suffices for verse text
+    if not textKinds[kind] and state.needText():
+        # print(f"EMPTY VERSE {state.referenceString}: {token}")
+        report_error(state, f"{state.referenceString} - Empty verse\n")
+    taker = takers[kind]
+    if taker:
+        taker(state, token)
+    state.lastToken = token
+# end of take(state, token) function
 
 
 def verify_contents_quiet(unicodestring, filename, book_code, lang_code):
     """
     This is called by the USFM linter.
     """
-    global error_log
-    error_log = []  # enable error logging
     state = State()
-    state.reset_all()  # clear out previous values
+    state.error_log = []  # enable error logging
     state.set_book_code(book_code)
     state.setLanguageCode(lang_code)
-    verifyChapterAndVerseMarkers(unicodestring, book_code)
-    for token in parseUsfm.parseString(unicodestring):
-        take(token)
-    verifyNotEmpty(filename, book_code)
-    verifyIdentification(book_code)
-    verifyVerseCount()  # for last chapter
-    verifyChapterCount()
-    errors = error_log
-    error_log = None  # turn error logging back off
-    return errors, state.ID
+    verifyChapterAndVerseMarkers(state, unicodestring, book_code)
+    for token in parseUsfm.iterTokens(unicodestring):
+        take(state, token)
+    verifyNotEmpty(state, filename, book_code)
+    verifyIdentification(state, book_code)
+    verifyVerseCount(state)  # for last chapter
+    verifyChapterCount(state)
+    return state.error_log, state.ID
 # end of verify_contents_quiet function
+
+
+def verify_file(path, lang_code=None):
+    """
+    Verifies one USFM file, taking the book code from the end of its name (e.g. 41-MAT.usfm).
+    :param path: USFM file to check
+    :param lang_code: language of the text, used to look for untranslated English words
+    :return: (path, list of error messages, book ID found in the file)
+    """
+    book_code = bookCodeForFile(path)
+    with open(path, 'rt', encoding='utf-8-sig') as input:
+        unicodestring = input.read()
+    errors, book_id = verify_contents_quiet(unicodestring, os.path.basename(path), book_code, lang_code)
+    return path, errors, book_id
+
+
+def failedResult(path, e):
+    """
+    The result of a file that could not be verified, which is not cached so the file is tried again next time.
+    """
+    return path, [f"{os.path.basename(path)} - Unable to verify this file: {type(e).__name__}: {e}"], None
+
+
+def bookCodeForFile(path):
+    return os.path.splitext(os.path.basename(path))[0][-3:].upper()
+
+
+def canonicalOrder(path):
+    return books.bookKeys.get(bookCodeForFile(path), '999'), path
+
+
+def verify_books(paths, lang_code=None, max_workers=None, cache_path=None):
+    """
+    Verifies many USFM files, one book per process.
+    The results are in canonical book order (files with unrecognized book codes last),
+      so the output is the same whatever order the books finish in.
+    :param paths: USFM files to check
+    :param lang_code: language of the text, used to look for untranslated English words
+    :param max_workers: number of processes; 1 checks the books one at a time in this process
+    :param cache_path: JSON file of earlier results; files whose contents have not changed are not checked again
+    :return: list of (path, list of error messages, book ID found in the file); a file that could not be verified
+      has one error message saying why, and no book ID
+    """
+    paths = sorted(paths, key=canonicalOrder)
+    cache = loadCache(cache_path, lang_code) if cache_path else None
+    results = {}
+    digests = {}
+    for path in paths:
+        if cache is not None:
+            try:
+                digests[path] = fileDigest(path)
+            except Exception as e:
+                results[path] = failedResult(path, e)
+                continue
+            entry = cache['files'].get(os.path.abspath(path))
+            if entry and entry['digest'] == digests[path]:
+                results[path] = (path, entry['errors'], entry['id'])
+    unchecked = [path for path in paths if path not in results]
+    checked = []
+    if max_workers == 1 or len(unchecked) < 2:
+        for path in unchecked:
+            try:
+                checked.append(verify_file(path, lang_code))
+            except Exception as e:
+                results[path] = failedResult(path, e)
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(verify_file, path, lang_code) for path in unchecked]
+            for path, future in zip(unchecked, futures):
+                try:
+                    checked.append(future.result())
+                except Exception as e:
+                    results[path] = failedResult(path, e)
+    for path, errors, book_id in checked:
+        results[path] = (path, errors, book_id)
+        if cache is not None:
+            cache['files'][os.path.abspath(path)] = {'digest': digests[path], 'errors': errors, 'id': book_id}
+    if cache is not None:
+        saveCache(cache_path, cache)
+    return [results[path] for path in paths]
+# end of verify_books function
+
+
+def fileDigest(path):
+    with open(path, 'rb') as input:
+        return hashlib.sha1(input.read()).hexdigest()
+
+
+def cacheSignature(lang_code):
+    """
+    Everything besides a file's contents that can change the errors found in it:
+      the source of the verifier and the modules it depends on, plus the options.
+    """
+    version = hashlib.sha1()
+    for module in (sys.modules[__name__], parseUsfm, usfm_verses):
+        with open(module.__file__, 'rb') as input:
+            version.update(input.read())
+    return version.hexdigest() + ' ' + json.dumps([lang_code])
+
+
+def loadCache(cache_path, lang_code):
+    """
+    Reads the results cache, starting a new one if it is missing, unreadable or from another version or options.
+    """
+    signature = cacheSignature(lang_code)
+    try:
+        with open(cache_path, 'rt', encoding='utf-8') as input:
+            cache = json.load(input)
+        if cache.get('signature') == signature:
+            return cache
+    except (OSError, ValueError) as e:
+        logging.debug(f"verifyUSFM: not using cache {cache_path}: {e}")
+    return {'signature': signature, 'files': {}}
+
+
+def saveCache(cache_path, cache):
+    with open(cache_path, 'wt', encoding='utf-8') as output:
+        json.dump(cache, output, ensure_ascii=False)
+
+
+def findUsfmFiles(source):
+    if os.path.isfile(source):
+        return [source]
+    found = []
+    for dirpath, _dirnames, filenames in os.walk(source):
+        for f in filenames:
+            if f[-3:].lower() == 'sfm':
+                found.append(os.path.join(dirpath, f))
+    return found
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verifies USFM files, checking the books in parallel.")
+    parser.add_argument('sources', nargs='+', help="USFM files or folders containing them")
+    parser.add_argument('-l', '--lang', dest='lang_code', default=None, help="Language code of the text")
+    parser.add_argument('-j', '--jobs', dest='max_workers', type=int, default=None,
+                        help="Number of processes (default: one per CPU; 1 = serial)")
+    parser.add_argument('-c', '--cache', dest='cache_path', default=None,
+                        help="JSON file of earlier results, so unchanged files are not checked again")
+    args = parser.parse_args()
+
+    paths = []
+    for source in args.sources:
+        if not os.path.exists(source):
+            sys.stderr.write(f"File not found: {source}\n")
+            continue
+        paths += findUsfmFiles(source)
+    nErrors = 0
+    for path, errors, book_id in verify_books(paths, args.lang_code, args.max_workers, args.cache_path):
+        print(f"CHECKING {path}:")
+        for error in errors:
+            print(error)
+        nErrors += len(errors)
+    print(f"Done. {nErrors} error(s) in {len(paths)} file(s).")
+    sys.exit(1 if nErrors else 0)
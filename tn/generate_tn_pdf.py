@@ -24,13 +24,17 @@ import subprocess
 import csv
 import json
 import git
+import hashlib
+import multiprocessing
+import time
+import pkg_resources
 from glob import glob
 from bs4 import BeautifulSoup
 from usfm_tools.transform import UsfmTransform
 from ..general_tools.file_utils import write_file, read_file, load_json_object, unzip, load_yaml_object
 from ..general_tools.url_utils import download_file
 from ..general_tools.bible_books import BOOK_NUMBERS, BOOK_CHAPTER_VERSES
-from ..general_tools.usfm_utils import usfm3_to_usfm2
+from ..general_tools.usfm_utils import get_usfm_book_index
 
 _print = print
 DEFAULT_LANG = 'en'
@@ -40,6 +44,10 @@ DEFAULT_UST_ID = 'ust'
 DEFAULT_ULT_ID = 'ult'
 DEFAULT_TN_ID = 'tn'
 OWNERS = [DEFAULT_OWNER, 'STR', 'Door43-Catalog']
+CHUNK_CACHE_VERSION = 1  # Bump to throw away all cached chunk HTML
+MAX_CHUNK_WORKERS = 8  # Number of chunks to render at the same time
+DEFAULT_JOBS = 1  # Number of books to generate at the same time
+ARTICLES_PER_TASK = 50  # Number of tA/tW articles each worker renders from markdown at a time
 
 
 def print(obj):
@@ -71,11 +79,62 @@ def get_latest_version(path_to_versions):
         return path_to_versions
 
 
+def get_usfm_renderer_version():
+    try:
+        return pkg_resources.get_distribution('usfm-tools').version
+    except pkg_resources.DistributionNotFound:
+        return ''
+
+
+def render_chunk_html(chunk):
+    """
+    Renders the USFM of a chunk to HTML, dropping the book and chapter headers. This is a module level function
+    so chunks can be rendered in a multiprocessing pool.
+    :param chunk: tuple of the directory to render in, the base name of the files and the USFM of the chunk
+    :return: the HTML of the chunk
+    """
+    path, filename_base, usfm = chunk
+    html_file = os.path.join(path, '{0}.html'.format(filename_base))
+    usfm_file = os.path.join(path, '{0}.usfm'.format(filename_base))
+    if not os.path.exists(path):
+        os.makedirs(path)
+    write_file(usfm_file, usfm)
+    UsfmTransform.buildSingleHtml(path, path, filename_base)
+    html = read_file(html_file)
+    soup = BeautifulSoup(html, 'html.parser')
+    header = soup.find('h1')
+    if header:
+        header.decompose()
+    chapter = soup.find('h2')
+    if chapter:
+        chapter.decompose()
+    html = ''.join(['%s' % x for x in soup.body.contents])
+    write_file(html_file, html)
+    return html
+
+
+def render_article_html(article_file):
+    return markdown.markdown(read_file(article_file))
+
+
+book_converter = None  # The TnConverter a book worker process generates its books with
+
+
+def init_book_worker(tn_converter):
+    global book_converter
+    book_converter = tn_converter
+
+
+def run_book_in_worker(project):
+    return book_converter.run_book(project)
+
+
 class TnConverter(object):
 
     def __init__(self, ta_tag=None, tn_tag=None, tw_tag=None, ust_tag=None, ult_tag=None, ugnt_tag=None,
                  working_dir=None, output_dir=None, lang_code=DEFAULT_LANG, books=None, owner=DEFAULT_OWNER,
-                 regenerate=False, logger=None, ust_id=DEFAULT_UST_ID, ult_id=DEFAULT_ULT_ID, tn_id=DEFAULT_TN_ID):
+                 regenerate=False, logger=None, ust_id=DEFAULT_UST_ID, ult_id=DEFAULT_ULT_ID, tn_id=DEFAULT_TN_ID,
+                 jobs=DEFAULT_JOBS):
         self.ta_tag = ta_tag
         self.tn_tag = tn_tag
         self.tw_tag = tw_tag
@@ -89,7 +148,9 @@ class TnConverter(object):
         self.hash = tn_tag
         self.owner = owner
         self.regenerate = regenerate
+        self.regenerate_setup = regenerate
         self.logger = logger
+        self.jobs = jobs
         self.ust_id = ust_id
         self.ult_id = ult_id
         self.tn_id = tn_id
@@ -133,6 +194,7 @@ class TnConverter(object):
         self.bad_links = {}
         self.bad_notes = {}
         self.usfm_chunks = {}
+        self.usfm_renderer_version = get_usfm_renderer_version()
         self.version = None
         self.publisher = None
         self.contributors = None
@@ -144,11 +206,35 @@ class TnConverter(object):
         self.openQuote = False
         self.nextFollowsQuote = False
         self.generation_info = {}
+        self.article_html = {}
         _print(self.ult_id)
 
     def run(self):
+        start = time.time()
+        self.setup()
+        projects = [p for p in self.get_book_projects() or [] if int(BOOK_NUMBERS[p['identifier'].lower()]) >= 41]
+        if self.jobs > 1 and len(projects) > 1:
+            # Each worker would otherwise render the articles its books link to again
+            self.populate_article_html()
+            pool = multiprocessing.Pool(min(self.jobs, len(projects)), init_book_worker, (self,))
+            try:
+                timings = pool.map(run_book_in_worker, projects)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            timings = [self.run_book(p) for p in projects]
+        self.save_generation_info()
+        self.log_timings(timings, time.time() - start)
+
+    def setup(self):
+        """
+        Prepares what all the books share, once: the resources, manifest, header and style files
+        """
         self.setup_resource_files()
         self.determine_if_regeneration_needed()
+        # Each book starts from this, not from what the books run before it in the same process found
+        self.regenerate_setup = self.regenerate
         self.file_id = '{0}_tn_{1}_{2}'.format(self.lang_code, self.tn_tag, self.generation_info[self.tn_id]['commit'])
         self.manifest = load_yaml_object(os.path.join(self.tn_dir, 'manifest.yaml'))
         self.version = self.manifest['dublin_core']['version']
@@ -156,47 +242,85 @@ class TnConverter(object):
         self.contributors = '<br/>'.join(self.manifest['dublin_core']['contributor'])
         self.publisher = self.manifest['dublin_core']['publisher']
         self.issued = self.manifest['dublin_core']['issued']
-        projects = self.get_book_projects()
-        for p in projects:
-            self.project = p
-            self.book_id = p['identifier'].lower()
-            self.book_title = p['title'].replace(' {0}'.format(self.title), '')
-            self.book_number = BOOK_NUMBERS[self.book_id]
-            if int(self.book_number) < 41:
-                continue
-            self.book_file_id = '{0}_tn_{1}_{2}_{3}-{4}'.format(self.lang_code, self.tn_tag,
-                                                                self.generation_info[self.tn_id]['commit'],
-                                                                self.book_number.zfill(2), self.book_id.upper())
-            self.logger.info('Creating tN for {0}...'.format(self.book_file_id))
-            self.load_resource_data()
-            if self.regenerate or not os.path.exists(os.path.join(self.output_dir, '{0}.html'.format(self.book_file_id))):
-                self.resource_data = {}
-                self.rc_references = {}
-                self.populate_tn_book_data()
-                self.populate_tw_words_data()
-                self.populate_chapters_and_verses()
-                self.populate_verse_usfm()
-                self.populate_chunks_text()
-                self.logger.info("Generating Body HTML...")
-                self.generate_body_html()
-                self.logger.info("Generating Cover HTML...")
-                self.generate_cover_html()
-                self.logger.info("Generating License HTML...")
-                self.generate_license_html()
-                self.logger.info("Copying header file...")
-                header_file = os.path.join(self.my_path, 'tn_header.html')
-                shutil.copy2(header_file, self.html_dir)
-                self.logger.info("Copying style sheet file...")
-                style_file = os.path.join(self.my_path, 'tn_style.css')
-                shutil.copy2(style_file, self.html_dir)
-                self.save_resource_data()
-                self.save_bad_links()
-            if self.regenerate or \
-                    not os.path.exists(os.path.join(self.output_dir, '{0}.pdf'.format(self.book_file_id))):
-                self.logger.info("Generating PDF {0}...".format(os.path.join(self.output_dir, '{0}.pdf'.
-                                                                             format(self.book_file_id))))
-                self.generate_tn_pdf()
-            _print('PDF file can be found at {0}/{1}.pdf'.format(self.output_dir, self.book_file_id))
+        self.logger.info("Copying header file...")
+        header_file = os.path.join(self.my_path, 'tn_header.html')
+        shutil.copy2(header_file, self.html_dir)
+        self.logger.info("Copying style sheet file...")
+        style_file = os.path.join(self.my_path, 'tn_style.css')
+        shutil.copy2(style_file, self.html_dir)
+
+    def run_book(self, p):
+        """
+        Generates the HTML and PDF of a book. Only uses what setup() prepared, so books can be run in worker processes
+        :param p: the book's project from the tN manifest
+        :return: dict of the book's ID and the seconds its HTML and PDF took
+        """
+        timing = {'book': p['identifier'], 'html': 0, 'pdf': 0}
+        self.regenerate = self.regenerate_setup
+        self.project = p
+        self.book_id = p['identifier'].lower()
+        self.book_title = p['title'].replace(' {0}'.format(self.title), '')
+        self.book_number = BOOK_NUMBERS[self.book_id]
+        self.book_file_id = '{0}_tn_{1}_{2}_{3}-{4}'.format(self.lang_code, self.tn_tag,
+                                                            self.generation_info[self.tn_id]['commit'],
+                                                            self.book_number.zfill(2), self.book_id.upper())
+        self.logger.info('Creating tN for {0}...'.format(self.book_file_id))
+        self.load_resource_data()
+        if self.regenerate or not os.path.exists(os.path.join(self.output_dir, '{0}.html'.format(self.book_file_id))):
+            start = time.time()
+            self.resource_data = {}
+            self.rc_references = {}
+            self.populate_tn_book_data()
+            self.populate_tw_words_data()
+            self.populate_chapters_and_verses()
+            self.populate_verse_usfm()
+            self.populate_chunks_text()
+            self.logger.info("Generating Body HTML...")
+            self.generate_body_html()
+            self.logger.info("Generating Cover HTML...")
+            self.generate_cover_html()
+            self.logger.info("Generating License HTML...")
+            self.generate_license_html()
+            self.save_resource_data()
+            self.save_bad_links()
+            timing['html'] = time.time() - start
+        if self.regenerate or \
+                not os.path.exists(os.path.join(self.output_dir, '{0}.pdf'.format(self.book_file_id))):
+            start = time.time()
+            self.logger.info("Generating PDF {0}...".format(os.path.join(self.output_dir, '{0}.pdf'.
+                                                                         format(self.book_file_id))))
+            self.generate_tn_pdf()
+            timing['pdf'] = time.time() - start
+        _print('PDF file can be found at {0}/{1}.pdf'.format(self.output_dir, self.book_file_id))
+        return timing
+
+    def log_timings(self, timings, seconds):
+        self.logger.info('Generated {0} book(s) in {1:.1f}s with {2} job(s):'.format(len(timings), seconds,
+                                                                                   self.jobs))
+        for timing in timings:
+            self.logger.info('  {0}: HTML {1:.1f}s, PDF {2:.1f}s'.format(timing['book'], timing['html'],
+                                                                         timing['pdf']))
+
+    def populate_article_html(self):
+        """
+        Renders every tA and tW article from markdown in parallel, once for all the book worker processes. Books
+        generated in this process render only the articles they link to, with get_article_html()
+        """
+        article_files = sorted(glob(os.path.join(self.ta_dir, '*', '*', '01.md')) +
+                               glob(os.path.join(self.tw_dir, 'bible', '*', '*.md')))
+        self.logger.info('Rendering {0} tA and tW articles...'.format(len(article_files)))
+        pool = multiprocessing.Pool(self.jobs)
+        try:
+            article_html = pool.map(render_article_html, article_files, ARTICLES_PER_TASK)
+        finally:
+            pool.close()
+            pool.join()
+        self.article_html = dict(zip(article_files, article_html))
+
+    def get_article_html(self, article_file):
+        if article_file not in self.article_html:
+            self.article_html[article_file] = render_article_html(article_file)
+        return self.article_html[article_file]
 
     def save_bad_links(self):
         bad_links = "BAD LINKS:\n"
@@ -300,11 +424,12 @@ class TnConverter(object):
     def populate_chunks_text(self):
         save_dir = os.path.join(self.output_dir, 'chunks_text')
         save_file = os.path.join(save_dir, '{0}.json'.format(self.book_file_id))
-        if os.path.isfile(save_file):
-            self.chunks_text = load_json_object(save_file)
-            return
+        cache_dir = os.path.join(save_dir, 'html')
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
 
-        chunks_text = {}            
+        chunks_text = {}
+        chunks_to_render = []
         for chapter_data in self.chapters_and_verses:
             chapter = chapter_data['chapter']
             chunks_text[str(chapter)] = {}
@@ -324,25 +449,53 @@ class TnConverter(object):
                             self.logger.error('{0} not in verse_usfm!!!'.format(resource))
                             print(self.verse_usfm)
                             exit(1)
-                        if chapter not in self.verse_usfm[resource]:
+                        if chapter not in self.verse_usfm[resource].chapters:
                             self.logger.error('Chapter {0} not in {1}!!!'.format(chapter, resource))
                             exit(1)
-                        if verse not in self.verse_usfm[resource][chapter]:
+                        verseUsfm = self.verse_usfm[resource].get_verse_usfm2(chapter, verse)
+                        if verseUsfm is None:
                             self.logger.error('{0}:{1} not in {2}!!!'.format(chapter, verse, resource))
                             exit(1)
-                        versesInChunk.append(self.verse_usfm[resource][chapter][verse])
+                        versesInChunk.append(verseUsfm)
                     chunk_usfm = '\n'.join(versesInChunk)
-                    if resource not in chunks_text[str(chapter)][str(first_verse)]:
-                        chunks_text[str(chapter)][str(first_verse)][resource] = {}
+                    chunk = self.get_chunk(chunk_usfm, resource, chapter, first_verse)
+                    cache_file = os.path.join(cache_dir, '{0}.html'.format(self.get_chunk_cache_key(chunk)))
                     chunks_text[str(chapter)][str(first_verse)][resource] = {
                         'usfm': chunk_usfm,
-                        'html': self.get_chunk_html(chunk_usfm, resource, chapter, first_verse)
+                        'html': read_file(cache_file) if os.path.isfile(cache_file) else None
                     }
-            if not os.path.exists(save_dir):
-                os.makedirs(save_dir)
-            write_file(save_file, chunks_text)
+                    if chunks_text[str(chapter)][str(first_verse)][resource]['html'] is None:
+                        chunks_to_render.append((chunks_text[str(chapter)][str(first_verse)][resource], chunk,
+                                                 cache_file))
+
+        self.logger.info('Rendering {0} changed chunks...'.format(len(chunks_to_render)))
+        for (chunk_text, chunk, cache_file), html in zip(chunks_to_render, self.render_chunks(
+                [chunk for chunk_text, chunk, cache_file in chunks_to_render])):
+            chunk_text['html'] = html
+            # Written to a temp file first so a build that is killed never leaves a partial chunk in the cache
+            write_file(cache_file + '.tmp', html)
+            os.rename(cache_file + '.tmp', cache_file)
+        write_file(save_file, chunks_text)
         self.chunks_text = chunks_text
 
+    @staticmethod
+    def render_chunks(chunks):
+        """
+        Renders the chunks to HTML, in a pool of processes when there is more than one. A book worker process of
+        run() renders them itself, since it is daemonic so can't have a pool, and the other books use the CPUs anyway.
+        :param chunks: list of chunks from get_chunk()
+        :return: list of the HTML of each chunk
+        """
+        workers = min(MAX_CHUNK_WORKERS, multiprocessing.cpu_count(), len(chunks))
+        if workers < 2 or multiprocessing.current_process().daemon:
+            return [render_chunk_html(chunk) for chunk in chunks]
+        pool = multiprocessing.Pool(workers)
+        try:
+            return pool.map(render_chunk_html, chunks)
+        finally:
+            pool.close()
+            pool.join()
+
     def determine_if_regeneration_needed(self):
         # check if any commit hashes have changed
         old_info = self.get_previous_generation_info()
@@ -378,6 +531,11 @@ class TnConverter(object):
         write_file(save_file, self.bad_links)
         save_file = os.path.join(save_dir, '{0}_bad_notes.json'.format(self.book_file_id))
         write_file(save_file, self.bad_notes)
+
+    def save_generation_info(self):
+        save_dir = os.path.join(self.output_dir, 'save')
+        if not os.path.exists(save_dir):
+            os.makedirs(save_dir)
         save_file = os.path.join(save_dir, '{0}_generation_info.json'.format(self.file_id))
         write_file(save_file, self.generation_info)
 
@@ -579,42 +737,16 @@ class TnConverter(object):
         self.populate_verse_usfm_ust()
 
     def populate_verse_usfm_ust(self):
-        bookData = {}
-        book_file = os.path.join(self.ust_dir, '{0}-{1}.usfm'.format(self.book_number, self.book_id.upper()))
-        usfm3 = read_file(book_file)
-        usfm2 = usfm3_to_usfm2(usfm3)
-        chapters = usfm2.split('\\c ')
-        for chapterUsfm in chapters[1:]:
-            chapter = int(re.findall('(\d+)', chapterUsfm)[0])
-            bookData[chapter] = {}
-            chapterUsfm = '\\c '+chapterUsfm
-            verses = chapterUsfm.split('\\v ')
-            for verseUsfm in verses[1:]:
-                verse = int(re.findall('(\d+)', verseUsfm)[0])
-                verseUsfm = '\\v '+verseUsfm
-                if re.match(r'^\\v \d+\s*$', verseUsfm, flags=re.MULTILINE):
-                    verseUsfm = ''
-                bookData[chapter][verse] = verseUsfm
-        self.verse_usfm[self.ust_id] = bookData
+        self.populate_verse_usfm_for_resource(self.ust_id, self.ust_dir)
 
     def populate_verse_usfm_ult(self):
-        bookData = {}
-        book_file = os.path.join(self.ult_dir, '{0}-{1}.usfm'.format(self.book_number, self.book_id.upper()))
+        self.populate_verse_usfm_for_resource(self.ult_id, self.ult_dir)
+
+    def populate_verse_usfm_for_resource(self, resource_id, resource_dir):
+        book_file = os.path.join(resource_dir, '{0}-{1}.usfm'.format(self.book_number, self.book_id.upper()))
         usfm3 = read_file(book_file)
-        usfm2 = usfm3_to_usfm2(usfm3)
-        chapters = usfm2.split('\\c ')
-        for chapterUsfm in chapters[1:]:
-            chapter = int(re.findall('(\d+)', chapterUsfm)[0])
-            bookData[chapter] = {}
-            chapterUsfm = '\\c '+chapterUsfm
-            verses = chapterUsfm.split('\\v ')
-            for verseUsfm in verses[1:]:
-                verse = int(re.findall('(\d+)', verseUsfm)[0])
-                verseUsfm = '\\v '+verseUsfm
-                if re.match(r'^\\v \d+\s*$', verseUsfm, flags=re.MULTILINE):
-                    verseUsfm = ''
-                bookData[chapter][verse] = verseUsfm
-        self.verse_usfm[self.ult_id] = bookData
+        # Chapters are converted to USFM 2 only when one of their verses is looked up with get_verse_usfm2()
+        self.verse_usfm[resource_id] = get_usfm_book_index(usfm3)
 
     def populate_verse_usfm_ult2(self):
         bookData = {}
@@ -1103,7 +1235,7 @@ class TnConverter(object):
                         self.bad_links[source_rc] = {} 
                     self.bad_links[source_rc][rc] = fix
                 if not rc in self.resource_data:
-                    t = markdown.markdown(read_file(file_path))
+                    t = self.get_article_html(file_path)
                     alt_title = ''
                     if resource == 'ta':
                         title_file = os.path.join(os.path.dirname(file_path), 'title.md')
@@ -1222,37 +1354,40 @@ class TnConverter(object):
 
         return text
 
-    def get_chunk_html(self, usfm, resource, chapter, verse):
+    def get_chunk(self, usfm, resource, chapter, verse):
+        """
+        Gets where and with what USFM a chunk of a resource gets rendered
+        :param usfm: the USFM of the verses of the chunk
+        :param resource:
+        :param chapter:
+        :param verse: the first verse of the chunk
+        :return: tuple of the directory to render in, the base name of the files and the USFM to render
+        """
         path = os.path.join(self.working_dir, 'usfm_chunks', 'usfm-{0}-{1}-{2}-{3}-{4}'.
                                 format(self.lang_code, resource, self.book_id, chapter, verse))
         filename_base = '{0}-{1}-{2}-{3}'.format(resource, self.book_id, chapter, verse)
-        html_file = os.path.join(path, '{0}.html'.format(filename_base))
-        usfm_file = os.path.join(path, '{0}.usfm'.format(filename_base))
-        if not os.path.exists(path):
-            os.makedirs(path)
         usfm = '''\id {0}
 \ide UTF-8
 \h {1}
 \mt {1}
 
 {2}'''.format(self.book_id.upper(), self.book_title, usfm)
-        write_file(usfm_file, usfm)
-        UsfmTransform.buildSingleHtml(path, path, filename_base)
-        html = read_file(os.path.join(path, filename_base+'.html'))
-        soup = BeautifulSoup(html, 'html.parser')
-        header = soup.find('h1')
-        if header:
-            header.decompose()
-        chapter = soup.find('h2')
-        if chapter:
-            chapter.decompose()
-        html = ''.join(['%s' % x for x in soup.body.contents])
-        write_file(html_file, html)
-        return html
+        return path, filename_base, usfm
 
+    def get_chunk_cache_key(self, chunk):
+        """
+        The HTML of a chunk only depends on the USFM it is rendered from and the renderer
+        :param chunk: a chunk from get_chunk()
+        :return: the SHA-1 the chunk's HTML is cached under
+        """
+        key = '{0} {1}\n{2}'.format(CHUNK_CACHE_VERSION, self.usfm_renderer_version, chunk[2])
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def get_chunk_html(self, usfm, resource, chapter, verse):
+        return render_chunk_html(self.get_chunk(usfm, resource, chapter, verse))
 
 def main(ta_tag, tn_tag, tw_tag, ust_tag, ult_tag, ugnt_tag, lang_codes, books, working_dir, output_dir, owner,
-         regenerate, ust_id, ult_id, tn_id):
+         regenerate, ust_id, ult_id, tn_id, jobs=DEFAULT_JOBS):
     lang_codes = lang_codes
     if not lang_codes:
         lang_codes = [DEFAULT_LANG]
@@ -1275,7 +1410,7 @@ def main(ta_tag, tn_tag, tw_tag, ust_tag, ult_tag, ugnt_tag, lang_codes, books,
     for lang_code in lang_codes:
         _print('Starting TN Converter for {0}...'.format(lang_code))
         tn_converter = TnConverter(ta_tag, tn_tag, tw_tag, ust_tag, ult_tag, ugnt_tag, working_dir, output_dir,
-                                   lang_code, books, owner, regenerate, logger, ust_id, ult_id, tn_id)
+                                   lang_code, books, owner, regenerate, logger, ust_id, ult_id, tn_id, jobs)
         tn_converter.run()
 
 
@@ -1297,6 +1432,8 @@ if __name__ == '__main__':
     parser.add_argument('--owner', dest='owner', default=DEFAULT_OWNER, required=False, help='Owner')
     parser.add_argument('-r', '--regenerate', dest='regenerate', default=False, action='store_true',
                         help='Regenerate even if exists')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=DEFAULT_JOBS, required=False,
+                        help='Number of books to generate at the same time')
     args = parser.parse_args(sys.argv[1:])
     main(args.ta, args.tn, args.tw, args.ust, args.ult, args.ugnt, args.lang_codes, args.books, args.working_dir,
-         args.output_dir, args.owner, args.regenerate, args.ust_id, args.ult_id, args.tn_id)
+         args.output_dir, args.owner, args.regenerate, args.ust_id, args.ult_id, args.tn_id, args.jobs)
@@ -3,6 +3,9 @@
 # The tsvRead function imports all data from a .tsv file into a Python list of lists of strings.
 # The data consists of a list of rows. Each row is a list of field values.
 # Strips leading and trailing spaces from field values.
+# The tsvRows function yields the same rows one at a time, for files too big to hold in memory.
+# The tsvColumns function reads a TSV tN file into a TsvColumns object, which holds the file as columns
+# so that checks like header validation and ID uniqueness can look at a whole column at once.
 # This module also has a tsvWrite function that writes a list of list of strings to a specified file.
 # The list2Dict function converts a list to a Python dictionary mapping.
 # make_key() generates keys used in the dictionary.
@@ -10,20 +13,73 @@
 import io
 import codecs
 
+# Column headings of a TSV tN file, in order.
+tnColumns = ["Book", "Chapter", "Verse", "ID", "SupportReference", "OrigQuote", "Occurrence", "GLQuote", "OccurrenceNote"]
+
 # Each row becomes a list of strings
 # The entire file is returned as a list of lists of strings (rows).
 def tsvRead(inputPath):
 #    enc = detect_by_bom(inputPath, default="utf-8")
-    f = io.open(inputPath, "tr", 1, encoding="utf-8-sig")
-    data = []
-    lines = f.readlines()
-    for line in lines:
-        line = line.strip()
-        fields = line.split('\t')
-        fields = [field.strip() for field in fields]
-        data.append(fields)
-    f.close()
-    return data
+    with io.open(inputPath, "tr", encoding="utf-8-sig") as f:
+        lines = f.read().split('\n')   # Universal newlines mode has already turned \r\n and \r into \n
+    if not lines[-1]:
+        lines.pop()     # The file ends with a newline, or is empty
+    return [[field.strip() for field in line.strip().split('\t')] for line in lines]
+
+# Yields the rows of the file one at a time, each as a list of strings, the same as tsvRead would return them.
+def tsvRows(inputPath):
+    with io.open(inputPath, "tr", encoding="utf-8-sig") as f:
+        for line in f:
+            yield [field.strip() for field in line.strip().split('\t')]
+
+# Returns the int value of a Chapter or Verse value, or None if it is not a number (e.g. "front" or "intro").
+def toInt(value):
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+# The rows of a TSV tN file, along with the same values as one tuple per column.
+# columns maps each name in tnColumns to the values of that column, one per row, header row included.
+# Values missing from short rows are empty strings and values beyond the ninth column are left out,
+# so nColumns has the actual number of values in each row.
+# chapters and verses are the Chapter and Verse columns as ints, each None where the value is not a number.
+class TsvColumns:
+    def __init__(self, rows):
+        self.rows = rows
+        self.nColumns = [len(row) for row in rows]
+        width = len(tnColumns)
+        padding = [""] * width
+        fullRows = [row if len(row) == width else (row + padding)[:width] for row in rows]
+        if fullRows:
+            self.columns = dict(zip(tnColumns, zip(*fullRows)))
+        else:
+            self.columns = {name: () for name in tnColumns}
+        self.chapters = [toInt(value) for value in self.columns["Chapter"]]
+        self.verses = [toInt(value) for value in self.columns["Verse"]]
+
+    # Returns the numbers (1-based) of the columns whose value in the first row is not the expected heading.
+    def badHeaders(self):
+        if not self.rows:
+            return set(range(1, len(tnColumns) + 1))
+        return {i + 1 for i, name in enumerate(tnColumns) if self.columns[name][0] != name}
+
+    # Returns the indexes of the rows whose value in the named column is already in an earlier row.
+    # Only rows after the header row that have all the columns are compared.
+    def repeatedRows(self, name):
+        seen = set()
+        repeated = set()
+        width = len(tnColumns)
+        for i, value in enumerate(self.columns[name]):
+            if i > 0 and self.nColumns[i] == width:
+                if value in seen:
+                    repeated.add(i)
+                seen.add(value)
+        return repeated
+
+# Reads a TSV tN file into a TsvColumns object.
+def tsvColumns(inputPath):
+    return TsvColumns(tsvRead(inputPath))
 
 def tsvWrite(data, tsvPath):
     tsvFile = io.open(tsvPath, "tw", buffering=1, encoding='utf-8', newline='\n')
@@ -107,10 +107,7 @@ def cleanFile(path):
     if not os.path.isfile(bakpath):
         os.rename(path, bakpath)
 
-    data = tsv.tsvRead(bakpath)
-    for row in data:
-        row = cleanRow(row)
-    tsv.tsvWrite(data, path)
+    tsv.tsvWrite((cleanRow(row) for row in tsv.tsvRows(bakpath)), path)
 
 # Recursive routine to convert all files under the specified folder
 def cleanFolder(folder):
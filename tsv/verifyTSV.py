@@ -7,6 +7,8 @@
 #   Wrong number of columns, should be 9 per row.
 #   Non-sequential chapter numbers (non-sequential verse numbers are permitted).
 #   Invalid verse number (0).
+#   IDs that are used more than once in a book, in one file or across files of the same book.
+#   Notes that repeat the verse, SupportReference, OrigQuote and Occurrence of another note.
 #   ASCII, non-ASCII in each column.
 #   OccurrenceNote (column 9) values. Some of these conditions are correctable with tsv_cleanup.py.
 #      ASCII content only.
@@ -41,6 +43,13 @@ if language_code in {'hr','id','nag','pmy','sw','en'}:    # Expect ASCII content
 nChecked = 0
 rowno = 0
 issuesFile = None
+use_cache = True    # Replay issues of files that have not changed since the last run, from verify-cache.json
+cache = None
+workers = 0    # Processes checking files at the same time. 0 for one per CPU, 1 to check them all in this process.
+deferOutput = False    # True in worker processes, which return their issues to be written in file order
+book = None
+chapter = 0
+verse = 0
 
 # Markdown line types
 HEADING = 1
@@ -53,7 +62,10 @@ import sys
 import os
 import io
 import re
+import json
+import hashlib
 import tsv
+from concurrent.futures import ProcessPoolExecutor
 
 listitem_re = re.compile(r'[ \t]*[\*\-][ \t]')
 olistitem_re = re.compile(r'[ \t]*[0-9]+\. ')
@@ -63,6 +75,8 @@ badheading_re = re.compile(r' +#')
 class State:        # State information about a single note (a single column 9 value)
     def setPath(self, path ):
         State.path = path
+        State.issues = []
+        State.checkedPaths = {}
         State.addRow(self, "...", None)
 
     def addRow(self, key, locator):
@@ -174,18 +188,17 @@ def reportError(msg, key=""):
     locater = state.locator
 
     issue = shortpath + ": (" + key + "), row " + str(rowno) + ": " + msg + ".\n"
-    try:
-        if locater and len(locater) > 3:
-            if state.md_lineno > 1:
-                issue = shortpath + ": " + locater[0] + " " + locater[1] + ":" + locater[2] + " ID=(" + locater[3] + "), row " + str(rowno) + "." + str(state.md_lineno) + ": " + msg + ".\n"
-            else:
-                issue = shortpath + ": " + locater[0] + " " + locater[1] + ":" + locater[2] + " ID=(" + locater[3] + "), row " + str(rowno) + ": " + msg + ".\n"
-            sys.stderr.write(issue)
-    except UnicodeEncodeError as e:
-        sys.stderr.write(shortpath + ": (Unicode...), row " + str(rowno) + ": " + msg + "\n")
- 
-    issues = openIssuesFile()
-    issues.write(issue)
+    fallback = shortpath + ": (Unicode...), row " + str(rowno) + ": " + msg + "\n"
+    echoed = False
+    if locater and len(locater) > 3:
+        if state.md_lineno > 1:
+            issue = shortpath + ": " + locater[0] + " " + locater[1] + ":" + locater[2] + " ID=(" + locater[3] + "), row " + str(rowno) + "." + str(state.md_lineno) + ": " + msg + ".\n"
+        else:
+            issue = shortpath + ": " + locater[0] + " " + locater[1] + ":" + locater[2] + " ID=(" + locater[3] + "), row " + str(rowno) + ": " + msg + ".\n"
+        echoed = True
+    state.issues.append([issue, echoed, fallback])
+    if not deferOutput:
+        replayIssues([[issue, echoed, fallback]])
 
 # This function, instead of take(), checks most notes.
 # Most notes consist of a single line with no headings or anything markdown like that.
@@ -296,7 +309,7 @@ def checkTALinks(line):
             reportError("tA page reference in heading")
         manpage = page.group(1)
         path = os.path.join(ta_dir, manpage)
-        if not os.path.isdir(path):
+        if not pathExists(path, True):
             reportError("invalid tA page reference")
         page = tapage_re.search(page.group(2))
 
@@ -311,7 +324,7 @@ def checkTALinks(line):
             path = os.path.join(ta_dir, manpage)
             if path[-3:].lower() == '.md':
                 path = path[:-3]
-            if not os.path.isdir(path):
+            if not pathExists(path, True):
                 reportError("invalid tA link: " + manpage)
             link = talink_re.search(link.group(3))
     return found          
@@ -338,7 +351,7 @@ def checkOBSLinks(line):
             reportError("invalid language code in OBS link")
         elif not suppress6:
             obsPath = os.path.join(obs_dir, link.group(4)) + ".md"
-            if not os.path.isfile(obsPath):
+            if not pathExists(obsPath):
                 reportError("invalid OBS link: " + link.group(1) + link.group(2) + link.group(3) + link.group(4) + link.group(5))
         link = obslink_re.search(link.group(6))
     return found
@@ -372,7 +385,7 @@ def checkPassageLinks(line):
     while passage:
         referent = passage.group(1)
         referencedPath = os.path.join( os.path.dirname(state.path), referent )
-        if not suppress5 and not os.path.isfile(referencedPath):
+        if not suppress5 and not pathExists(referencedPath):
             reportError("invalid passage link: " + referent)
         passage = passagelink_re.search(passage.group(2))
 
@@ -412,23 +425,17 @@ def verifyNote(note, verse):
 
 # Reports an error if there is anything wrong with the first row in the TSV file.
 # That row contains nothing but column headings.
-def checkHeader(row, key):
+# badColumns is the set of column numbers whose heading is wrong.
+def checkHeader(row, key, badColumns):
     state = State()
     state.addRow(key, row[0:4])
-    if row[0] != "Book":
+    if 1 in badColumns:
         reportError("Invalid column 1 header")
-    if key != "ID.Verse.Chapter":
+    if badColumns & {2, 3, 4}:
         reportError("Invalid column headers, columns 2-4", key)
-    if row[4] != "SupportReference":
-        reportError("Invalid column 5 header")
-    if row[5] != "OrigQuote":
-        reportError("Invalid column 6 header")
-    if row[6] != "Occurrence":
-        reportError("Invalid column 7 header")
-    if row[7] != "GLQuote":
-        reportError("Invalid column 8 header")
-    if row[8] != "OccurrenceNote":
-        reportError("Invalid column 9 header")
+    for column in range(5, 10):
+        if column in badColumns:
+            reportError("Invalid column " + str(column) + " header")
 
 def verifyGLQuote(quote, verse):
     if verse == "intro":
@@ -443,7 +450,9 @@ idcheck_re = re.compile(r'[^0-9a-z]')
 
 # Checks the specified non-header row values.
 # The row must have 9 columns or this function will fail.
-def checkRow(row, key):
+# chapterNo and verseNo are the chapter and verse as ints, or None if they are not numbers.
+# repeatedID is True if an earlier row in the file has the same ID.
+def checkRow(row, key, chapterNo, verseNo, repeatedID):
     global book
     global chapter
     global verse
@@ -458,29 +467,27 @@ def checkRow(row, key):
 
     # Establish chapter number
     if row[1] != 'front':
-        try:
-            c = int(row[1])
-            if c == chapter + 1:
-                chapter = c
-            elif c != chapter:
-                reportError("Non-sequential chapter number")
-        except ValueError as e:
-            c = 0
+        if chapterNo is None:
             reportError("Non-numeric chapter number")
+        elif chapterNo == chapter + 1:
+            chapter = chapterNo
+        elif chapterNo != chapter:
+            reportError("Non-sequential chapter number")
     # Establish verse
     if row[2] == 'intro':
         verse = 0
+    elif verseNo is None:
+        reportError("Non-numeric verse number")
     else:
-        try:
-#           Based on 10/29/19 discussion on Zulip, the verse order in TSV file is not important.
-            verse = int(row[2])
-            if verse < 1 or verse > 176:
-                reportError("Invalid verse number (" + str(verse) + "). Probably should be \"intro\"")
-        except ValueError as e:
-            reportError("Non-numeric verse number")
+#       Based on 10/29/19 discussion on Zulip, the verse order in TSV file is not important.
+        verse = verseNo
+        if verse < 1 or verse > 176:
+            reportError("Invalid verse number (" + str(verse) + "). Probably should be \"intro\"")
 
     if len(row[3]) != 4 or idcheck_re.search(row[3]):
         reportError("Invalid ID")
+    elif repeatedID:
+        reportError("Duplicate ID")
 
     if not row[4].isascii():
         reportError("Non-ascii SupportReference value (column 5)")
@@ -492,66 +499,320 @@ def checkRow(row, key):
     verifyNote(row[8], row[2])
 
 
-# Processes the rows in a single TSV file.
-def verifyFile(path):
+linkRootList = None
+pathIndexes = {}    # (foldcase, dirs, files) of each link root, each built once per run by walking the root
+
+# The folders that links point into, normalized. Folders that don't exist are left out.
+def linkRoots():
+    global linkRootList
+    if linkRootList is None:
+        linkRootList = [os.path.normcase(os.path.abspath(root)) for root in [ta_dir, obs_dir, source_dir] if root and os.path.isdir(root)]
+    return linkRootList
+
+# Lists every folder and file under root once, so that links into it are checked without a stat() per link.
+# Paths are normcased, and lowercased as well if the file system of root ignores case.
+def indexRoot(root):
+    swapped = root.swapcase()
+    foldcase = swapped != root and os.path.exists(swapped) and os.path.samefile(root, swapped)
+    dirs = {root}
+    files = set()
+    for dirpath, dirnames, filenames in os.walk(root, followlinks=True):
+        dirnames[:] = [name for name in dirnames if name != ".git"]
+        dirs.update(os.path.join(dirpath, name) for name in dirnames)
+        files.update(os.path.join(dirpath, name) for name in filenames)
+    if foldcase:
+        dirs = set(path.lower() for path in dirs)
+        files = set(path.lower() for path in files)
+    return (foldcase, dirs, files)
+
+# Indexes each link root that is not inside another one, so that worker processes can be given the indexes
+# instead of each walking the roots again.
+def indexLinkRoots():
+    roots = linkRoots()
+    for root in roots:
+        if root not in pathIndexes and not any(root.startswith(other + os.sep) for other in roots):
+            pathIndexes[root] = indexRoot(root)
+    return pathIndexes
+
+# Returns True if the file or folder exists, from the index of the link root it is under.
+# Paths outside all link roots are checked on disk.
+def lookupPath(path, isdir=False):
+    key = os.path.normcase(os.path.normpath(path) if os.path.isabs(path) else os.path.abspath(path))
+    roots = [root for root in linkRoots() if key == root or key.startswith(root + os.sep)]
+    if not roots:
+        return os.path.isdir(path) if isdir else os.path.isfile(path)
+    indexed = [root for root in roots if root in pathIndexes]
+    root = indexed[0] if indexed else min(roots, key=len)
+    if root not in pathIndexes:
+        pathIndexes[root] = indexRoot(root)
+    foldcase, dirs, files = pathIndexes[root]
+    if foldcase:
+        key = key.lower()
+    return key in (dirs if isdir else files)
+
+# Returns True if the file or folder exists, remembering the answer for the cache.
+# A cached result is only replayed if all the paths it depended on still give the same answer.
+def pathExists(path, isdir=False):
+    state = State()
+    exists = lookupPath(path, isdir)
+    state.checkedPaths[path] = [isdir, exists]
+    return exists
+
+# Everything besides a file's contents that can change the issues found in it.
+def cacheSignature():
+    with io.open(__file__, "rb") as input:
+        version = hashlib.sha1(input.read()).hexdigest()
+    options = [language_code, gateway_language, ta_dir, obs_dir,
+               suppress1, suppress2, suppress3, suppress4, suppress5, suppress6,
+               suppress7, suppress8, suppress9, suppress10, suppress11]
+    return version + " " + json.dumps(options)
+
+def loadCache():
+    global cache
+    signature = cacheSignature()
+    cache = {"signature": signature, "files": {}}
+    path = os.path.join(source_dir, "verify-cache.json")
+    if os.path.isfile(path):
+        try:
+            with io.open(path, "tr", encoding="utf-8") as input:
+                saved = json.load(input)
+            if saved.get("signature") == signature:
+                cache = saved
+        except ValueError:
+            sys.stderr.write("Ignoring unreadable cache: " + path + "\n")
+
+def saveCache():
+    path = os.path.join(source_dir, "verify-cache.json")
+    with io.open(path, "tw", encoding="utf-8", newline='\n') as output:
+        json.dump(cache, output, ensure_ascii=False)
+
+# Returns the issues found the last time this file was verified, or None if it must be verified again.
+def cachedIssues(path, digest):
+    entry = cache["files"].get(shortname(path))
+    if not entry or entry["digest"] != digest:
+        return None
+    for checkedPath, (isdir, exists) in entry["paths"].items():
+        if lookupPath(checkedPath, isdir) != exists:
+            return None
+    return entry["issues"]
+
+def replayIssues(issues):
+    output = openIssuesFile()
+    for issue, echoed, fallback in issues:
+        if echoed:
+            try:
+                sys.stderr.write(issue)
+            except UnicodeEncodeError:
+                sys.stderr.write(fallback)
+        output.write(issue)
+
+def fileDigest(path):
+    with io.open(path, "rb") as input:
+        return hashlib.sha1(input.read()).hexdigest()
+
+# Returns the digest of the file and its cached issues, which are None if it must be verified again.
+def lookUpFile(path):
+    digest = fileDigest(path)
+    return digest, cachedIssues(path, digest)
+
+# Returns True if the first row of the file has the 9 columns of a header row.
+def hasHeader(path):
+    with io.open(path, "tr", 1, encoding="utf-8-sig") as input:
+        return len(input.readline().strip().split('\t')) == 9
+
+# Verifies a single TSV file, or replays its issues from the cache if it has not changed.
+# lookedUp is what lookUpFile() returned for the file, if the caller already looked it up.
+# checked is what a worker process found in the file, if it was checked in one.
+def verifyFile(path, lookedUp=None, checked=None):
+    state = State()
+    state.setPath(path)
+    if checked:
+        digest, State.issues, State.checkedPaths, cacheable, noteIndex[path] = checked
+        replayIssues(state.issues)
+    else:
+        issues = None
+        if cache is not None:
+            digest, issues = lookedUp or lookUpFile(path)
+        if issues is not None:
+            replayIssues(issues)
+            noteIndex[path] = cache["files"][shortname(path)]["notes"]
+            return
+        table = tsv.tsvColumns(path)  # The entire file, as rows and as columns
+        checkFile(table)
+        cacheable = table.nColumns[:1] == [9]
+        noteIndex[path] = indexNotes(table)
+    # Chapter checks carry over from the previous file when this one has no header row, so only cache files that have one.
+    if cache is not None and cacheable:
+        cache["files"][shortname(path)] = {"digest": digest, "paths": state.checkedPaths, "issues": state.issues,
+                                           "notes": noteIndex[path]}
+
+# Processes the rows in a single TSV file, given as a tsv.TsvColumns object.
+# The checks that need a whole column, like repeated IDs, are done up front and reported at each row.
+def checkFile(table):
     global book
     global chapter
     global verse
     global rowno
-    state = State()
-    state.setPath(path)
 
     rowno = 0
-    data = tsv.tsvRead(path)  # The entire file is returned as a list of lists of strings (rows).
-    heading = True
-    for row in data:
+    repeatedIDs = table.repeatedRows("ID")
+    for row, nColumns, chapterNo, verseNo in zip(table.rows, table.nColumns, table.chapters, table.verses):
         rowno += 1
-        nColumns = len(row)
         if nColumns > 3:
-            try:
-                verse = int(row[2])
-            except ValueError as e:
-                verse = 0
+            verse = verseNo or 0
             key = tsv.make_key(row, [3,2,1])
             if nColumns == 9:
                 if rowno == 1:
-                    checkHeader(row, key)
+                    checkHeader(row, key, table.badHeaders())
                     book = None
                     chapter = 0
                     verse = 0
                 else:
-                    checkRow(row, key)
+                    checkRow(row, key, chapterNo, verseNo, rowno - 1 in repeatedIDs)
             else:
                 reportError("Wrong number of columns (" + str(nColumns) + ")")
         else:
             key = row[0][0:3] + "... "
             reportError("Wrong number of columns (" + str(nColumns) + "). No further checks", key)
 
+noteIndex = {}    # The notes of each file verified in this run, as returned by indexNotes(), in the order verified
+
+# Returns what the checks across files need to know about each note (each full row after the header row):
+# [rowno, Book, Chapter, Verse, ID, SupportReference, OrigQuote, Occurrence]
+def indexNotes(table):
+    notes = []
+    for i, nColumns in enumerate(table.nColumns):
+        if i > 0 and nColumns == 9:
+            notes.append([i + 1] + table.rows[i][0:7])
+    return notes
+
+# Checks the notes of all the files verified in this run in one pass, with a hash map of the IDs in each book
+# and one of the notes on each OrigQuote occurrence. Reports IDs that another file of the same book already used
+# (repeats within a file are reported by checkRow), and notes with the same verse, SupportReference, OrigQuote and
+# Occurrence as an earlier note.
+def reportDuplicates():
+    global rowno
+    ids = {}
+    quotes = {}
+    state = State()
+    for path, notes in noteIndex.items():
+        state.setPath(path)
+        for note in notes:
+            row = note[1:]
+            book, chapter, verse, noteID, supportReference, origQuote, occurrence = row
+            place = (path, note[0])
+            messages = []
+            first = ids.setdefault((book, noteID), place)
+            if first[0] != path:
+                messages.append("ID also used in " + shortname(first[0]) + ", row " + str(first[1]))
+            if origQuote:
+                first = quotes.setdefault((book, chapter, verse, supportReference, origQuote, occurrence), place)
+                if first != place:
+                    messages.append("Duplicate note, same as " + shortname(first[0]) + ", row " + str(first[1]))
+            if messages:
+                state.addRow(tsv.make_key(row, [3,2,1]), row[0:4])
+                rowno = note[0]
+                for message in messages:
+                    reportError(message)
+
+# Returns the paths of the TSV files in the folder and its subfolders.
+def listFiles(dirpath):
+    paths = []
+    with os.scandir(dirpath) as entries:
+        for entry in entries:
+            if entry.is_dir() and entry.path[-4:] != ".git":
+                paths += listFiles(entry.path)
+            elif entry.is_file() and entry.name[-4:].lower() == '.tsv':
+                paths.append(entry.path)
+    return paths
+
+# Sets up a worker process to check files without writing any output.
+# indexes are the link root indexes built by the main process.
+def initWorker(source, indexes):
+    global source_dir, deferOutput
+    source_dir = source
+    deferOutput = True
+    pathIndexes.update(indexes)
+
+# Checks a run of files in a worker process, in order, so chapter checks carry over as they do in a single process.
+# files is a list of the path and digest of each file, as looked up by the main process (None if there is no cache).
+# Returns the digest, the issues, the paths its links depend on and whether it can be cached, of each file.
+def checkFilesInWorker(files):
+    global book, chapter, verse
+    book = None
+    chapter = 0
+    verse = 0
+    results = []
+    for path, digest in files:
+        state = State()
+        state.setPath(path)
+        table = tsv.tsvColumns(path)
+        checkFile(table)
+        results.append((digest, state.issues, state.checkedPaths, table.nColumns[:1] == [9], indexNotes(table)))
+    return results
+
+# Verifies the files in sorted path order, so the issues are always written in the same order.
+# Each file with a header row starts a run, together with the files without one after it. A run with any file that
+# has no cached issues is checked again as a whole, since chapter checks carry over from one file to the next.
+# Those runs are checked by worker processes while the issues of the runs before them are written.
+# Each file is looked up in the cache once.
 def verifyDir(dirpath):
-    for f in os.listdir(dirpath):
-        path = os.path.join(dirpath, f)
-        if os.path.isdir(path) and path[-4:] != ".git":
-            # It's a directory, recurse into it
-            verifyDir(path)
-        elif os.path.isfile(path) and f[-4:].lower() == '.tsv':
-            verifyFile(path)
+    global nChecked
+    paths = sorted(listFiles(dirpath))
+    lookedUp = {}
+    if cache is not None:
+        for path in paths:
+            lookedUp[path] = lookUpFile(path)
+    runs = []
+    for path in paths:
+        if not runs or hasHeader(path):
+            runs.append([path])
+        else:
+            runs[-1].append(path)
+    stale = [cache is None or any(lookedUp[path][1] is None for path in run) for run in runs]
+    nworkers = min(workers or os.cpu_count() or 1, stale.count(True))
+    checked = [None] * len(runs)
+    executor = None
+    if nworkers > 1:
+        executor = ProcessPoolExecutor(max_workers=nworkers, initializer=initWorker,
+                                       initargs=(source_dir, indexLinkRoots()))
+        for idx, run in enumerate(runs):
+            if stale[idx]:
+                files = [(path, lookedUp.get(path, (None, None))[0]) for path in run]
+                checked[idx] = executor.submit(checkFilesInWorker, files)
+    for run, runIsStale, future in zip(runs, stale, checked):
+        if runIsStale and not future:
+            for path in run:
+                if path in lookedUp:
+                    lookedUp[path] = (lookedUp[path][0], None)    # Check the whole run again, so chapter checks carry over
+        results = future.result() if future else [None] * len(run)
+        for path, result in zip(run, results):
+            verifyFile(path, lookedUp.get(path), result)
             sys.stdout.flush()
-            global nChecked
             nChecked += 1
+    if executor:
+        executor.shutdown()
 
 if __name__ == "__main__":
     if len(sys.argv) > 1 and sys.argv[1] != 'hard-coded-path':
         source_dir = sys.argv[1]
 
     if os.path.isdir(source_dir):
+        if use_cache:
+            loadCache()
         verifyDir(source_dir)
     elif os.path.isfile(source_dir):
         path = source_dir
         source_dir = os.path.dirname(path)
+        if use_cache:
+            loadCache()
         verifyFile(path)
     else:
         sys.stderr.write("Folder not found: " + source_dir + '\n') 
+    reportDuplicates()
 
     if issuesFile:
         issuesFile.close()
+    if cache is not None:
+        saveCache()
     print("Done. Checked " + str(nChecked) + " files.\n")
\ No newline at end of file
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 
+import io
 import sys
 from pyparsing import Word, OneOrMore, nums, Literal, White, Group, \
         Suppress, NoMatch, Optional, CharsNotIn, MatchFirst
@@ -338,6 +339,45 @@ def parseString(unicodeString):
         sys.exit()
     return [createToken(t) for t in tokens]
 
+# Generator version of parseString() that yields the same tokens, parsing about chunkSize
+# characters at a time, so a whole Bible never has to be held as a list of tokens.
+# source may be the USFM text or a file object opened in text mode.
+def iterTokens(source, chunkSize=65536):
+    lines = io.StringIO(source, newline='') if isinstance(source, str) else source
+    found = False
+    for chunk in readChunks(lines, chunkSize):
+        s = clean(chunk)
+        if not s.strip(' \t\r\n'):
+            continue
+        try:
+            tokens = usfm.parseString(s, parseAll=True)
+        except Exception as e:
+            print(e)
+            print(repr(chunk[:50]))
+            sys.exit()
+        for t in tokens:
+            found = True
+            yield createToken(t)
+    if not found:
+        print("No USFM tokens found")
+        sys.exit()
+
+# Joins lines into chunks of at least chunkSize characters (except the last).
+# A chunk only ends before a line that starts with a backslash. No token can span that
+# break, and tabs expand the same way, so each chunk can be parsed on its own.
+def readChunks(lines, chunkSize):
+    chunk = []
+    length = 0
+    for line in lines:
+        if length >= chunkSize and line.startswith('\\'):
+            yield ''.join(chunk)
+            chunk = []
+            length = 0
+        chunk.append(line)
+        length += len(line)
+    if chunk:
+        yield ''.join(chunk)
+
 #def parseString(unicodeString):
 #    """
 #    version of parseString for use in libraries
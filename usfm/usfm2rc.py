@@ -387,7 +387,7 @@ def convertFile(usfmpath, fname):
     sys.stdout.flush()
     success = isParseable(str, fname)
     if success:
-        for token in parseUsfm.parseString(str):
+        for token in parseUsfm.iterTokens(str):
             take(token)
         state.usfmFile.write("\n")    
         state.usfmFile.close()
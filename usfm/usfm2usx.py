@@ -303,13 +303,10 @@ def take(token):
     lastToken = token
      
 def convertFile(filename):
-    input = io.open(filename, "tr", 1, encoding="utf-8-sig")
-    str = input.read(-1)
-    input.close
-
     print("CONVERTING " + filename + ":")
-    for token in parseUsfm.parseString(str):
-        take(token)
+    with io.open(filename, "tr", 1, encoding="utf-8-sig") as input:
+        for token in parseUsfm.iterTokens(input):
+            take(token)
     state = State()
     state.closeUsxOutput()
     print("FINISHED.\nAfter running this script, check the following:")
@@ -433,7 +433,7 @@ def verifyFile(filename):
     print("CHECKING " + filename + ":")
     sys.stdout.flush()
     verifyChapterAndVerseMarkers(str, filename)
-    for token in parseUsfm.parseString(str):
+    for token in parseUsfm.iterTokens(str):
         take(token)
     verifyNotEmpty(filename)
     verifyVerseCount()      # for the last chapter